@@ -4,7 +4,9 @@ from PyQt5 import QtCore, QtWidgets
 from ui import Ui_MainWindow   # file UI Qt Designer tạo
 from utils import LoadsFile
 from utils.tiktok_action import ProfileController
-from utils.youtube_downloader import download_youtube_video
+from utils.youtube_downloader import prepare_streams, get_disk_manager
+from utils.youtube_downloader_async import download_youtube_video_async
+from utils.download_metrics import format_metrics
 from utils.video_editor import edit_video_to_65s
 from utils.download_client import DownloadAPIClient
 from selenium.webdriver.support.ui import WebDriverWait
@@ -16,8 +18,10 @@ import os
 import re
 import threading
 from datetime import datetime
-from token_rotator import TokenRotator
-from watcher import watch_channel
+from token_rotator import TokenRotator, DAILY_QUOTA
+from poll_scheduler import PollScheduler
+from watcher import BatchPoller
+from dedupe_store import DedupeStore
 
 class MainWindow(QMainWindow, Ui_MainWindow):
     # Tạo custom signal để cập nhật GUI từ thread
@@ -35,8 +39,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.profile_controllers = {}  # {row: ProfileController}
         # 🔹 Lưu file input cho mỗi hàng
         self.file_inputs = {}  # {row: file_input_element}
-        # 🔹 Lưu danh sách video đã upload (chỉ trong session hiện tại)
-        self.uploaded_videos = set()  # {video_id}
+        # 🔹 Video đã upload (lưu file, dùng chung với runner headless, restart không đăng lại)
+        self.dedupe = DedupeStore()
+        self.prepare_tasks = set()  # Task resolve stream trước (giữ reference để không bị GC)
+        # 🔹 Dọn file tạm của lần chạy trước + kiểm tra budget thư mục Downloads (chạy nền)
+        threading.Thread(target=get_disk_manager("Downloads").maintain, args=(True,), daemon=True).start()
         # 🔹 Download API Client (tùy chọn - nếu dùng API server)
         self.download_client = None  # Sẽ khởi tạo nếu cần
 
@@ -131,7 +138,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             print("⚠️ Số token ít hơn số hàng chọn, sẽ dùng lại theo vòng")
 
         print("Start clicked")
-        tasks = []
+        # 1 poller dùng chung cho tất cả hàng (gom 50 channel / 1 request)
+        scheduler = PollScheduler(daily_budget=len(self.tokens) * DAILY_QUOTA)
+        poller = BatchPoller(TokenRotator(self.tokens), interval=1, scheduler=scheduler,
+                             prepare_callback=self.prepare_video)
+        tasks = [asyncio.create_task(poller.run())]
 
         for idx, row in enumerate(checked):
             self.tbData.setItem(row, 3, QtWidgets.QTableWidgetItem("Opening Profile..."))
@@ -146,16 +157,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 self.tbData.setItem(row, 4, QtWidgets.QTableWidgetItem("Error"))
                 continue
 
-            # Tạo token rotator cho mỗi profile
-            start_index = idx % len(self.tokens)
-            rotator = TokenRotator(self.tokens, start_index=start_index)
             # Thêm task async - mở Chrome, đợi file input, rồi theo dõi YouTube
-            tasks.append(asyncio.create_task(self.run_profile_watcher(row, profile_id, channel, rotator)))
+            tasks.append(asyncio.create_task(self.run_profile_watcher(row, profile_id, channel, poller)))
 
         # Chạy tất cả task đồng thời
         await asyncio.gather(*tasks)
 
-    async def run_profile_watcher(self, row, profile_id, channel, rotator):
+    async def run_profile_watcher(self, row, profile_id, channel, poller):
         """Mở Chrome bằng Genlogin, đợi file input, sau đó theo dõi YouTube"""
         controller = None
         try:
@@ -189,7 +197,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 self.profile_controllers[row] = controller
                 self.file_inputs[row] = file_input
                 
-                # Bước 3: Bắt đầu theo dõi YouTube với token rotation
+                # Bước 3: Bắt đầu theo dõi YouTube qua batch poller dùng chung
                 self.tbData.setItem(row, 3, QtWidgets.QTableWidgetItem("Watching YouTube..."))
                 
                 def gui_log(msg, video_link=None):
@@ -203,7 +211,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 async def video_callback(video_url):
                     await self.handle_new_video(row, video_url)
                 
-                await watch_channel(channel, rotator, log_callback=gui_log, video_callback=video_callback)
+                await poller.watch(channel, log_callback=gui_log, video_callback=video_callback)
                 self.tbData.setItem(row, 4, QtWidgets.QTableWidgetItem("Done"))
             else:
                 self.tbData.setItem(row, 3, QtWidgets.QTableWidgetItem("❌ File input not found"))
@@ -232,48 +240,68 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 return match.group(1)
         return None
 
+    def prepare_video(self, video_url):
+        """Hook của poller: resolve stream ngay khi phát hiện video (download sau đó dùng lại kết quả)"""
+        video_id = self.extract_video_id(video_url) or video_url
+        if self.dedupe.is_uploaded(video_id):
+            return
+        task = asyncio.create_task(asyncio.to_thread(prepare_streams, video_url, 720))
+        self.prepare_tasks.add(task)
+        task.add_done_callback(self.prepare_tasks.discard)
+
     async def handle_new_video(self, row, video_url):
         """
         Xử lý khi có video mới: download → (tùy chọn) edit → upload lên TikTok.
         BẢN APP: gọi trực tiếp hàm download, KHÔNG dùng API server để giảm overhead.
         """
+        # Lấy thông tin profile và channel để log đẹp hơn
+        profile_item = self.tbData.item(row, 1)
+        channel_item = self.tbData.item(row, 2)
+        profile_id = profile_item.text() if profile_item else "Unknown"
+        channel_id = channel_item.text() if channel_item else "Unknown"
+
         # Trích xuất video_id để kiểm tra đã upload chưa
-        video_id = self.extract_video_id(video_url)
-        if video_id and video_id in self.uploaded_videos:
+        video_id = self.extract_video_id(video_url) or video_url
+        if self.dedupe.is_uploaded(video_id):
             print(f"⏭️ [{row}] Video {video_id} đã được upload, bỏ qua")
             self.update_status.emit(row, "⏭️ Video đã upload, bỏ qua")
             return
+        if not self.dedupe.claim(video_id, profile_id):
+            print(f"⏭️ [{row}] Video {video_id} đang được xử lý, bỏ qua")
+            self.update_status.emit(row, "⏭️ Video đang được xử lý, bỏ qua")
+            return
 
         start_time = datetime.now()
         download_time = 0
         edit_time = 0
         video_file = None
         final_file = None
+        uploaded = False
 
         try:
-            # Lấy thông tin profile và channel để log đẹp hơn
-            profile_item = self.tbData.item(row, 1)
-            channel_item = self.tbData.item(row, 2)
-            profile_id = profile_item.text() if profile_item else "Unknown"
-            channel_id = channel_item.text() if channel_item else "Unknown"
 
-            # 1️⃣ DOWNLOAD VIDEO (GỌI TRỰC TIẾP) - không block GUI nhờ to_thread
+            # 1️⃣ DOWNLOAD VIDEO (GỌI TRỰC TIẾP) - không block GUI nhờ asyncio
             self.update_status.emit(row, "📥 Đang tải video YouTube...")
             download_start = datetime.now()
 
             # Thư mục download mặc định
             download_path = "Downloads"
 
-            # Gọi trực tiếp utils.youtube_downloader.download_youtube_video trong thread phụ
-            video_file = await asyncio.to_thread(
-                download_youtube_video,
+            # Cắt 65s nếu bật checkbox: adaptive stream được cắt luôn lúc mux (1 lần ffmpeg)
+            need_edit = self.rdEdit65s.isChecked()
+
+            # Download bằng asyncio ngay trên event loop của GUI (qasync), không cần thread phụ
+            video_file, metrics = await download_youtube_video_async(
                 video_url,
                 download_path,
                 720,       # max_resolution
-                False      # progressive_only=False (cho phép adaptive nếu cần)
+                False,     # progressive_only=False (cho phép adaptive nếu cần)
+                return_metrics=True,
+                trim_duration=65 if need_edit else None
             )
 
             download_time = (datetime.now() - download_start).total_seconds()
+            print(f"📊 [{row}] {format_metrics(metrics)}")
 
             if not video_file or not os.path.exists(video_file):
                 self.update_status.emit(row, "❌ Download failed (file not found)")
@@ -281,22 +309,19 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
             final_file = video_file
 
-            # 2️⃣ EDIT (TUỲ CHỌN) - cắt 65s nếu bật checkbox
-            need_edit = self.rdEdit65s.isChecked()
-            if need_edit:
+            # 2️⃣ EDIT (TUỲ CHỌN) - cắt 65s nếu bật checkbox và chưa được cắt lúc tải
+            if need_edit and not metrics.get("trimmed"):
                 self.update_status.emit(row, "✂️ Đang cắt video 65s...")
                 edit_start = datetime.now()
 
+                # File gốc là artifact dùng chung (Downloads/{video_id}-{fmt}/), row khác cùng video
+                # có thể đang upload -> giữ nguyên input, không đổi tên / xóa
                 edited_file = await asyncio.to_thread(edit_video_to_65s, video_file)
                 edit_time = (datetime.now() - edit_start).total_seconds()
 
                 if edited_file and os.path.exists(edited_file):
+                    # File gốc để DiskManager dọn theo LRU / budget, không xóa ở đây
                     final_file = edited_file
-                    # Xoá file gốc sau khi edit xong
-                    try:
-                        os.remove(video_file)
-                    except:
-                        pass
                 else:
                     self.update_status.emit(row, "⚠️ Edit thất bại, dùng video gốc")
 
@@ -317,7 +342,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             # 4️⃣ LOG VÀ DỌN DẸP
             if upload_success and video_id and upload_times:
                 # Đánh dấu video đã upload
-                self.uploaded_videos.add(video_id)
+                self.dedupe.mark(video_id, profile_id, "uploaded")
+                uploaded = True
 
                 # Tính tổng thời gian (không tính reload)
                 total_time = download_time + edit_time + upload_times["total_upload_time"]
@@ -336,25 +362,17 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 self.txtLog.appendPlainText(log_message)
                 self.update_status.emit(row, "✅ Hoàn thành 1 vòng Download + Upload")
 
-            # Xoá file tạm sau khi upload xong (nếu còn)
-            try:
-                if final_file and os.path.exists(final_file):
-                    os.remove(final_file)
-            except:
-                pass
+            # Không xóa video_file / final_file: row khác có thể đang upload cùng file,
+            # DiskManager dọn theo LRU / budget
 
         except Exception as e:
             error_msg = f"Error handling video: {str(e)}"
             print(f"[Row {row}] {error_msg}")
             self.update_status.emit(row, f"❌ {error_msg[:60]}")
-
-            # Cleanup files nếu có lỗi
-            for f in [video_file, final_file]:
-                if f and os.path.exists(f):
-                    try:
-                        os.remove(f)
-                    except:
-                        pass
+            # File dở (nếu có) là file tạm, DiskManager sweep dọn; file hoàn chỉnh để dùng lại
+        finally:
+            if not uploaded:
+                self.dedupe.mark(video_id, profile_id, "failed")
 
     async def upload_video_to_tiktok(self, row, video_file_path):
         """Upload video lên TikTok Studio và click nút Post
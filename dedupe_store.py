@@ -0,0 +1,198 @@
+"""
+Chống upload trùng video, lưu trên đĩa và dùng chung giữa GUI (app.py) và các runner headless:
+- SQLite WAL: bảng uploads(video_id, profile_id, state, updated_at, seq), nhiều process đọc/ghi song song
+- Bloom filter trong RAM đứng trước: video chưa upload (đa số trường hợp) trả lời ngay, không chạm DB
+- Bloom được cập nhật tăng dần theo cột seq khi PRAGMA data_version báo có process khác vừa ghi
+
+Trạng thái theo từng (video, profile):
+    processing -> đang download/upload (claim), quá CLAIM_TTL thì coi như process đã chết
+    uploaded   -> đã đăng xong
+    failed     -> lỗi, được phép claim lại
+"""
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+
+DB_FILE = "uploaded_videos.db"
+BLOOM_CAPACITY = 1_000_000  # Vượt quá thì tự tăng gấp đôi
+BLOOM_ERROR_RATE = 0.01
+CLAIM_TTL = 30 * 60         # Claim "processing" quá 30 phút -> cho phép claim lại
+
+ANY_PROFILE = "*"
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+def _key(video_id: str, profile_id: str) -> str:
+    return f"{video_id}|{profile_id}"
+
+
+class DedupeStore:
+    def __init__(self, path: str = DB_FILE, bloom_capacity: int = BLOOM_CAPACITY):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                video_id   TEXT NOT NULL,
+                profile_id TEXT NOT NULL,
+                state      TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                seq        INTEGER NOT NULL,
+                PRIMARY KEY (video_id, profile_id)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_seq ON uploads(seq)")
+
+        self.bloom = BloomFilter(bloom_capacity)
+        self._last_seq = 0
+        self._data_version = None
+        with self.lock:
+            self._refresh()
+
+    # -----------------------
+    # Bloom filter
+    # -----------------------
+    def _read_uploaded(self, after_seq: int):
+        """
+        Các dòng "uploaded" có seq > after_seq và MAX(seq) hiện tại, đọc trong CÙNG 1 transaction
+        (cùng 1 snapshot WAL): process khác commit xen giữa 2 câu SELECT sẽ không bị nhảy qua seq
+        """
+        self.conn.execute("BEGIN")
+        try:
+            rows = self.conn.execute(
+                "SELECT video_id, profile_id, seq FROM uploads WHERE seq > ? AND state = 'uploaded'",
+                (after_seq,)
+            ).fetchall()
+            max_seq = self.conn.execute("SELECT MAX(seq) FROM uploads").fetchone()[0] or 0
+        finally:
+            self.conn.execute("COMMIT")
+        return rows, max_seq
+
+    def _refresh(self):
+        """Nạp các dòng "uploaded" mới (seq > _last_seq) vào Bloom nếu DB đã bị process khác ghi"""
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+
+        rows, max_seq = self._read_uploaded(self._last_seq)
+        if self.bloom.count + 2 * len(rows) > self.bloom.capacity:
+            self._rebuild(max(self.bloom.capacity * 2, (self.bloom.count + 2 * len(rows)) * 2))
+            return
+        for video_id, profile_id, _ in rows:
+            self.bloom.add(video_id)
+            self.bloom.add(_key(video_id, profile_id))
+        # Dòng không phải "uploaded" cũng đẩy seq lên để lần sau không quét lại
+        self._last_seq = max(self._last_seq, max_seq)
+
+    def _rebuild(self, capacity: int):
+        print(f"🔁 Dedupe: tăng Bloom filter lên {capacity} phần tử")
+        self.bloom = BloomFilter(capacity)
+        rows, max_seq = self._read_uploaded(0)
+        for video_id, profile_id, _ in rows:
+            self.bloom.add(video_id)
+            self.bloom.add(_key(video_id, profile_id))
+        self._last_seq = max_seq
+
+    # -----------------------
+    # API
+    # -----------------------
+    def _write(self, video_id: str, profile_id: str, state: str):
+        self.conn.execute("""
+            INSERT INTO uploads (video_id, profile_id, state, updated_at, seq)
+            VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM uploads))
+            ON CONFLICT(video_id, profile_id) DO UPDATE SET
+                state = excluded.state, updated_at = excluded.updated_at, seq = excluded.seq
+        """, (video_id, profile_id, state, time.time()))
+
+    def is_uploaded(self, video_id: str, profile_id: str = ANY_PROFILE) -> bool:
+        """Video đã được upload (bởi profile_id, hoặc bởi bất kỳ profile nào nếu không truyền)"""
+        key = video_id if profile_id == ANY_PROFILE else _key(video_id, profile_id)
+        with self.lock:
+            self._refresh()
+            if key not in self.bloom:
+                return False
+            if profile_id == ANY_PROFILE:
+                row = self.conn.execute(
+                    "SELECT 1 FROM uploads WHERE video_id = ? AND state = 'uploaded' LIMIT 1", (video_id,)
+                ).fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT 1 FROM uploads WHERE video_id = ? AND profile_id = ? AND state = 'uploaded'",
+                    (video_id, profile_id)
+                ).fetchone()
+            return row is not None
+
+    def claim(self, video_id: str, profile_id: str) -> bool:
+        """
+        Giành quyền xử lý (video, profile). False nếu đã upload hoặc process khác đang xử lý.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT state, updated_at FROM uploads WHERE video_id = ? AND profile_id = ?",
+                    (video_id, profile_id)
+                ).fetchone()
+                if row:
+                    state, updated_at = row
+                    if state == "uploaded":
+                        self.conn.execute("ROLLBACK")
+                        return False
+                    if state == "processing" and time.time() - updated_at < CLAIM_TTL:
+                        self.conn.execute("ROLLBACK")
+                        return False
+                self._write(video_id, profile_id, "processing")
+                self.conn.execute("COMMIT")
+                return True
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def mark(self, video_id: str, profile_id: str, state: str):
+        """Cập nhật trạng thái: "uploaded" hoặc "failed" (cho phép claim lại)"""
+        with self.lock:
+            self._write(video_id, profile_id, state)
+            if state == "uploaded":
+                self.bloom.add(video_id)
+                self.bloom.add(_key(video_id, profile_id))
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM uploads GROUP BY state").fetchall()
+            return {
+                "states": dict(rows),
+                "bloom_capacity": self.bloom.capacity,
+                "bloom_bytes": len(self.bloom.bits),
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -2,8 +2,23 @@
 Test script để test download YouTube video
 Sử dụng hàm download_youtube_video từ utils/youtube_downloader.py
 """
-from utils.youtube_downloader import download_youtube_video
+from utils.youtube_downloader import (
+    download_youtube_video, get_ffmpeg_path, download_stream_ranged, merge_audio_video, stream_mux,
+    partial_streams, mux_trim, exact_trim, PARTIAL_MARGIN
+)
+from utils.video_editor import edit_video_to_65s, _smart_cut_point
+from utils import dash_index, media_probe
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 import os
+import requests
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 def test_download():
     """Test download YouTube video"""
@@ -68,7 +83,426 @@ def test_download():
     print("\n✅ Test completed!")
     print(f"📁 Check files in: {os.path.abspath(download_path)}")
 
+# -----------------------
+# Fixture local (không cần mạng): track adaptive sinh bằng ffmpeg + HTTP server hỗ trợ &range=
+# -----------------------
+FIXTURE_SECONDS = 180
+FIXTURE_FPS = 30
+FIXTURE_GOP = 4   # Keyframe mỗi 4s -> điểm cắt 65s nằm giữa GOP (64s - 68s)
+FIXTURE_RATE = 8 * 1024 * 1024   # Giới hạn tốc độ mỗi kết nối (bytes/s), gần với server media thật
+
+
+def make_fixtures(directory, seconds=FIXTURE_SECONDS):
+    """
+    video.mp4 (H.264 có B-frame) + audio.m4a (AAC), fragmented MP4 có sidx giống stream DASH của YouTube
+    Returns: (video_file, audio_file)
+    """
+    ffmpeg_path = get_ffmpeg_path()
+    video_file = os.path.join(directory, "video.mp4")
+    audio_file = os.path.join(directory, "audio.m4a")
+    print(f"🧱 Tạo fixture {seconds}s trong {directory}...")
+    subprocess.run([
+        ffmpeg_path, "-v", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size=426x240:rate={FIXTURE_FPS}",
+        "-t", str(seconds),
+        "-c:v", "libx264", "-preset", "ultrafast", "-bf", "2", "-crf", "30",
+        "-g", str(FIXTURE_GOP * FIXTURE_FPS), "-pix_fmt", "yuv420p",
+        "-movflags", "+dash+global_sidx",
+        video_file
+    ], check=True)
+    subprocess.run([
+        ffmpeg_path, "-v", "error", "-y",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+        "-t", str(seconds),
+        "-c:a", "aac", "-b:a", "128k",
+        "-movflags", "+dash+global_sidx", "-frag_duration", str(FIXTURE_GOP * 1000000),
+        audio_file
+    ], check=True)
+    return video_file, audio_file
+
+
+class RangeServer:
+    """
+    HTTP server local phục vụ file trong `root`, hỗ trợ &range=start-end như server media của YouTube
+    rate: giới hạn bytes/s mỗi kết nối (None = tốc độ loopback, tải gần như tức thì)
+    """
+
+    def __init__(self, root, rate=FIXTURE_RATE):
+        self.root = root
+        self.rate = rate
+        self.bytes_served = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = os.path.join(server.root, os.path.basename(url.path))
+                size = os.path.getsize(path)
+                start, end = 0, size - 1
+                query = parse_qs(url.query)
+                if "range" in query:
+                    start, end = map(int, query["range"][0].split("-"))
+                    end = min(end, size - 1)
+                with open(path, "rb") as f:
+                    f.seek(start)
+                    body = f.read(end - start + 1)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                block = 64 * 1024
+                start_time = time.perf_counter()
+                try:
+                    for offset in range(0, len(body), block):
+                        self.wfile.write(body[offset:offset + block])
+                        with server.lock:
+                            server.bytes_served += len(body[offset:offset + block])
+                        if server.rate:
+                            delay = (offset + block) / server.rate - (time.perf_counter() - start_time)
+                            if delay > 0:
+                                time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client ngừng đọc (VD: ffmpeg đã đủ -t)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{name}?source=fixture"
+
+
+class FixtureStream:
+    """Giả lập pytubefix Stream adaptive (chỉ các thuộc tính downloader dùng) trỏ tới file fixture"""
+    is_sabr = False
+    is_otf = False
+    subtype = "mp4"
+
+    def __init__(self, server, path, itag, video_codec=None):
+        self.url = server.url(os.path.basename(path))
+        self.filesize = os.path.getsize(path)
+        self.itag = itag
+        self.video_codec = video_codec
+
+    def download(self, output_path=".", filename=None, **kwargs):
+        filepath = os.path.join(output_path, filename)
+        with requests.get(self.url, timeout=30) as response:
+            response.raise_for_status()
+            with open(filepath, "wb") as f:
+                f.write(response.content)
+        return filepath
+
+
+def frame_count(path):
+    """Số frame video: framecrc in 1 dòng / packet (copy, không decode)"""
+    result = subprocess.run(
+        [get_ffmpeg_path(), "-v", "error", "-i", path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    return sum(1 for line in result.stdout.splitlines() if line and not line.startswith("#"))
+
+
+def download_and_merge(video_stream, audio_stream, output_file, trim_duration=None):
+    """Cách cũ: tải 2 track ra file tạm (song song), xong mới merge. Returns: thời gian merge"""
+    video_file, audio_file = f"{output_file}.video.mp4", f"{output_file}.audio.m4a"
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for future in [executor.submit(download_stream_ranged, video_stream, video_file),
+                           executor.submit(download_stream_ranged, audio_stream, audio_file)]:
+                future.result()
+        merge_start = time.perf_counter()
+        merge_audio_video(video_file, audio_file, output_file, trim_duration)
+        return time.perf_counter() - merge_start
+    finally:
+        for path in (video_file, audio_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def check_ranged_download(video_stream, video_file, work):
+    """Tải track video bằng 1 kết nối vs ranged (nhiều kết nối), kiểm tra file giống hệt bản gốc"""
+    with open(video_file, "rb") as f:
+        original = f.read()
+    for name, download in (
+        ("1 kết nối", lambda path: video_stream.download(os.path.dirname(path), os.path.basename(path))),
+        ("ranged", lambda path: download_stream_ranged(video_stream, path)),
+    ):
+        path = os.path.join(work, "ranged_check.mp4")
+        start = time.perf_counter()
+        download(path)
+        elapsed = time.perf_counter() - start
+        with open(path, "rb") as f:
+            same = f.read() == original
+        os.remove(path)
+        print(f"   {name}: {elapsed:.2f}s | {len(original) / 1024 / 1024:.1f} MB | "
+              f"{'✅ giống file gốc' if same else '❌ KHÁC file gốc'}")
+
+
+def benchmark_stream_mux(seconds=FIXTURE_SECONDS, rounds=3):
+    """
+    So sánh trên fixture local: tải 2 file tạm rồi merge  vs  stream mux (ffmpeg mux trong lúc tải)
+    Kiểm tra 2 cách cho ra file cùng độ dài / cùng số frame
+    """
+    print("=" * 60)
+    print("⏱️ BENCHMARK: tải + merge  vs  stream mux (fixture local)")
+    print("=" * 60)
+    work = tempfile.mkdtemp(prefix="bench_mux_")
+    try:
+        video_file, audio_file = make_fixtures(work, seconds)
+        expected_frames = frame_count(video_file)
+        with RangeServer(work) as server:
+            video_stream = FixtureStream(server, video_file, itag=134, video_codec="avc1.4d4015")
+            audio_stream = FixtureStream(server, audio_file, itag=140)
+            check_ranged_download(video_stream, video_file, work)
+
+            results = {"tải + merge": [], "stream mux": []}
+            merge_times = []
+            for i in range(rounds):
+                for name in results:
+                    output_file = os.path.join(work, f"out_{i}_{len(results[name])}.mp4")
+                    start = time.perf_counter()
+                    if name == "stream mux":
+                        if not stream_mux(video_stream, audio_stream, output_file):
+                            print("❌ stream mux: FAILED")
+                            return
+                    else:
+                        merge_times.append(download_and_merge(video_stream, audio_stream, output_file))
+                    elapsed = time.perf_counter() - start
+                    frames = frame_count(output_file)
+                    duration = media_probe.get_duration(output_file)
+                    if frames != expected_frames:
+                        print(f"❌ {name}: {frames} frame, mong đợi {expected_frames}")
+                    results[name].append(elapsed)
+                    print(f"   {name}: {elapsed:.2f}s | {duration:.2f}s video | {frames} frame")
+                    os.remove(output_file)
+
+        print("-" * 60)
+        for name, times in results.items():
+            print(f"📊 {name}: best {min(times):.2f}s / {rounds} lần")
+        print(f"🔗 Merge riêng (sau khi tải xong): best {min(merge_times):.2f}s")
+        print(f"⚡ Tiết kiệm: {min(results['tải + merge']) - min(results['stream mux']):.2f}s")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def benchmark_fused_trim(seconds=FIXTURE_SECONDS, rounds=3, trim=65):
+    """
+    So sánh trên fixture local (luôn là track adaptive, không phụ thuộc video trên YouTube):
+    tải + merge rồi edit_video_to_65s (đọc lại cả video)  vs  merge có -t (65 + TRIM_MARGIN) rồi
+    smart-cut GOP cuối trên bản đã cắt (như downloader)
+    Cả 2 cách phải ra clip dài đúng `trim` giây, nếu không thì so sánh thời gian vô nghĩa
+    """
+    print("=" * 60)
+    print(f"⏱️ BENCHMARK: merge + edit {trim}s  vs  mux có -t {trim} (fixture local)")
+    print("=" * 60)
+    work = tempfile.mkdtemp(prefix="bench_trim_")
+    try:
+        video_file, audio_file = make_fixtures(work, seconds)
+        with RangeServer(work) as server:
+            video_stream = FixtureStream(server, video_file, itag=134, video_codec="avc1.4d4015")
+            audio_stream = FixtureStream(server, audio_file, itag=140)
+
+            def two_pass(output_file):
+                download_and_merge(video_stream, audio_stream, output_file)
+                return edit_video_to_65s(output_file, duration=trim, keep_input=False)
+
+            def fused(output_file):
+                # Như downloader: H.264 mux dư TRIM_MARGIN rồi smart-cut GOP cuối về đúng trim
+                muxed = mux_trim(video_stream, trim)
+                download_and_merge(video_stream, audio_stream, output_file, trim_duration=muxed)
+                exact_trim(output_file, trim, muxed)
+                return output_file
+
+            results = {}
+            for name, run in (("merge + edit", two_pass), ("fused trim", fused)):
+                times = []
+                for i in range(rounds):
+                    start = time.perf_counter()
+                    filepath = run(os.path.join(work, f"out_{i}.mp4"))
+                    elapsed = time.perf_counter() - start
+                    duration = media_probe.get_duration(filepath) if filepath else None
+                    frames = frame_count(filepath) if filepath else None
+                    if duration is None or abs(duration - trim) > 0.1 or frames != trim * FIXTURE_FPS:
+                        print(f"❌ {name}: clip dài {duration}s / {frames} frame, "
+                              f"mong đợi {trim}s / {trim * FIXTURE_FPS} frame")
+                        return
+                    times.append(elapsed)
+                    print(f"   {name}: {elapsed:.2f}s | {duration:.2f}s video | {frames} frame")
+                    os.remove(filepath)
+                results[name] = min(times)
+
+        print("-" * 60)
+        for name, best in results.items():
+            print(f"📊 {name}: best {best:.2f}s / {rounds} lần")
+        print(f"⚡ Tiết kiệm: {results['merge + edit'] - results['fused trim']:.2f}s")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def check_smart_cut(seconds=FIXTURE_SECONDS, trim=65):
+    """
+    Kiểm tra smart-cut trên clip sinh bằng ffmpeg (keyframe mỗi FIXTURE_GOP giây, có B-frame):
+    - media_probe.video_track đọc đúng codec + vị trí keyframe
+    - _smart_cut_point chọn keyframe cuối trước điểm cắt, bỏ qua khi điểm cắt trùng keyframe
+    - edit_video_to_65s ra đúng trim * FPS frame, đúng độ dài; so với cắt copy và encode lại toàn bộ
+    """
+    print("=" * 60)
+    print(f"🎯 SMART-CUT: cắt {trim}s trên clip fixture")
+    print("=" * 60)
+    work = tempfile.mkdtemp(prefix="smartcut_")
+    failures = []
+
+    def check(ok, message):
+        print(f"   {'✅' if ok else '❌'} {message}")
+        if not ok:
+            failures.append(message)
+
+    try:
+        video_file, audio_file = make_fixtures(work, seconds)
+        clip = os.path.join(work, "clip.mp4")
+        merge_audio_video(video_file, audio_file, clip)
+
+        track = media_probe.video_track(clip)
+        expected_keyframes = [i * FIXTURE_GOP for i in range(seconds // FIXTURE_GOP)]
+        check(track and track["codec"] == "h264", f"codec: {track and track['codec']}")
+        keyframes = track["keyframes"] if track else None
+        check(keyframes is not None and len(keyframes) == len(expected_keyframes) and all(
+            abs(k - e) < 0.5 / FIXTURE_FPS for k, e in zip(keyframes, expected_keyframes)
+        ), f"keyframe: {keyframes[:4] if keyframes else None}... ({len(keyframes or [])} keyframe)")
+
+        cut_point = _smart_cut_point(clip, trim)
+        expected_keyframe = trim // FIXTURE_GOP * FIXTURE_GOP
+        check(cut_point is not None and abs(cut_point[0] - expected_keyframe) < 0.5 / FIXTURE_FPS
+              and cut_point[1] == expected_keyframe * FIXTURE_FPS,
+              f"điểm cắt {trim}s -> keyframe {cut_point} (mong đợi {expected_keyframe}s, "
+              f"{expected_keyframe * FIXTURE_FPS} packet)")
+        check(_smart_cut_point(clip, expected_keyframe) is None,
+              f"điểm cắt {expected_keyframe}s trùng keyframe -> cắt copy")
+
+        expected_frames = trim * FIXTURE_FPS
+        for name, smart in (("smart-cut", True), ("cắt copy", False)):
+            output_file = os.path.join(work, f"{name}.mp4")
+            start = time.perf_counter()
+            edit_video_to_65s(clip, output_file, duration=trim, smart_cut=smart)
+            elapsed = time.perf_counter() - start
+            frames = frame_count(output_file)
+            duration = media_probe.get_duration(output_file)
+            print(f"   {name}: {elapsed:.2f}s | {duration:.3f}s | {frames} frame")
+            if smart:
+                check(frames == expected_frames, f"smart-cut ra đúng {expected_frames} frame")
+                check(abs(duration - trim) < 0.1, f"smart-cut dài {duration:.3f}s")
+
+        # Mốc so sánh tốc độ: encode lại toàn bộ trim giây
+        output_file = os.path.join(work, "reencode.mp4")
+        start = time.perf_counter()
+        subprocess.run([get_ffmpeg_path(), "-v", "error", "-y", "-i", clip, "-t", str(trim),
+                        "-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-c:a", "copy", output_file],
+                       check=True)
+        print(f"   encode lại toàn bộ: {time.perf_counter() - start:.2f}s | {frame_count(output_file)} frame")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print("-" * 60)
+    print("✅ Smart-cut OK" if not failures else f"❌ {len(failures)} kiểm tra lỗi")
+    return not failures
+
+
+def check_partial_download(seconds=FIXTURE_SECONDS, trim=65):
+    """
+    Kiểm tra tải một phần theo sidx trên fixture fMP4 qua RangeServer:
+    - dash_index.parse_sidx / partial_size trên phần đầu file (fragment FIXTURE_GOP giây)
+    - partial_streams chỉ tải phần đầu, server gửi ít hơn nhiều so với cả 2 file
+    - stream mux / tải + merge từ stream một phần (mux dư TRIM_MARGIN + smart-cut như downloader)
+      ra đúng trim giây, đúng trim * FPS frame
+    """
+    print("=" * 60)
+    print(f"✂️ TẢI MỘT PHẦN: {trim}s đầu của fixture {seconds}s")
+    print("=" * 60)
+    work = tempfile.mkdtemp(prefix="partial_")
+    failures = []
+
+    def check(ok, message):
+        print(f"   {'✅' if ok else '❌'} {message}")
+        if not ok:
+            failures.append(message)
+
+    try:
+        video_file, audio_file = make_fixtures(work, seconds)
+        total = os.path.getsize(video_file) + os.path.getsize(audio_file)
+        needed = trim + PARTIAL_MARGIN
+
+        for path in (video_file, audio_file):
+            with open(path, "rb") as f:
+                head = f.read(dash_index.HEAD_SIZE)
+            fragments = dash_index.parse_sidx(head)
+            size = dash_index.partial_size(head, needed)
+            name = os.path.basename(path)
+            check(fragments is not None and all(
+                abs(d - FIXTURE_GOP) < 0.1 for _, _, _, d in fragments[:-1]
+            ), f"{name}: {len(fragments or [])} fragment ~{FIXTURE_GOP}s")
+            check(size is not None and size < os.path.getsize(path),
+                  f"{name}: cần {(size or 0) / 1024:.0f} KB / {os.path.getsize(path) / 1024:.0f} KB "
+                  f"cho {needed}s đầu")
+
+        expected_frames = trim * FIXTURE_FPS
+        with RangeServer(work) as server:
+            video_stream = FixtureStream(server, video_file, itag=134, video_codec="avc1.4d4015")
+            audio_stream = FixtureStream(server, audio_file, itag=140)
+            for name in ("stream mux", "tải + merge"):
+                server.bytes_served = 0
+                output_file = os.path.join(work, f"{name}.mp4")
+                start = time.perf_counter()
+                muxed = mux_trim(video_stream, trim)
+                partial_video, partial_audio = partial_streams(video_stream, audio_stream, muxed)
+                if name == "stream mux":
+                    ok = stream_mux(partial_video, partial_audio, output_file, trim_duration=muxed)
+                    check(ok, "stream mux chạy được trên stream một phần")
+                    if not ok:
+                        continue
+                else:
+                    download_and_merge(partial_video, partial_audio, output_file, trim_duration=muxed)
+                exact_trim(output_file, trim, muxed)
+                elapsed = time.perf_counter() - start
+                frames = frame_count(output_file)
+                duration = media_probe.get_duration(output_file)
+                print(f"   {name}: {elapsed:.2f}s | server gửi {server.bytes_served / 1024 / 1024:.1f} MB "
+                      f"/ {total / 1024 / 1024:.1f} MB | {duration:.3f}s | {frames} frame")
+                check(server.bytes_served < total * (needed + FIXTURE_GOP) / seconds,
+                      f"{name}: chỉ tải phần đầu")
+                check(abs(duration - trim) < 0.1, f"{name}: dài {duration:.3f}s")
+                check(frames == expected_frames, f"{name}: {frames} frame (mong đợi {expected_frames})")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    print("-" * 60)
+    print("✅ Tải một phần OK" if not failures else f"❌ {len(failures)} kiểm tra lỗi")
+    return not failures
+
+
 if __name__ == "__main__":
-    test_download()
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark_fused_trim()
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench-mux":
+        benchmark_stream_mux()
+    elif len(sys.argv) > 1 and sys.argv[1] == "smartcut":
+        sys.exit(0 if check_smart_cut() else 1)
+    elif len(sys.argv) > 1 and sys.argv[1] == "partial":
+        sys.exit(0 if check_partial_download() else 1)
+    else:
+        test_download()
 
 
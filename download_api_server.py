@@ -5,20 +5,48 @@ Chạy server: uvicorn download_api_server:app --host 0.0.0.0 --port 8000
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from utils.youtube_downloader import download_youtube_video
-from utils.video_editor import edit_video_to_65s
+from utils.youtube_downloader import extract_video_id, prepare_streams, get_disk_manager
+from utils.disk_manager import SWEEP_INTERVAL
+from utils.youtube_downloader_async import download_youtube_video_async, close_http_client
+from utils.video_editor import edit_video_to_65s, ffmpeg_pool, FFMPEG_WORKERS
+from utils.artifact_cache import ArtifactCache
+from utils.download_metrics import MetricsAggregator
+from utils.job_queue import Job, JobRegistry, PrioritySlots
 import os
 import asyncio
+import time
 from typing import Optional
 import sys
 
 app = FastAPI(title="YouTube Download API", version="1.0.0")
 
+# Số job chạy cùng lúc theo tài nguyên: tải (mạng, asyncio nên rẻ) và edit ffmpeg (CPU)
+# ffmpeg_slots dùng cùng giới hạn với ffmpeg_pool: job chờ edit nằm trong hàng đợi asyncio
+# (có trạng thái waiting_edit, không chiếm thread) thay vì chờ trong thread của pool
+DOWNLOAD_WORKERS = 16
+MAX_LONG_POLL = 60  # GET /jobs/{id}?wait= tối đa 60 giây
+DOWNLOAD_PATH = os.path.join(os.getcwd(), "Downloads")
+EDIT_DURATION = 65  # edit_65s: adaptive stream được cắt luôn lúc mux, progressive mới cần edit riêng
+
+# Job theo id + job đang chạy theo key request (request trùng chờ chung 1 job, không tải lại)
+jobs = JobRegistry()
+download_slots = PrioritySlots("download", DOWNLOAD_WORKERS)
+ffmpeg_slots = PrioritySlots("ffmpeg", FFMPEG_WORKERS)
+# File đã tải xong: trả ngay cho request lặp lại (chỉ mục, không tự xóa file)
+artifact_cache = ArtifactCache()
+# Nơi duy nhất xóa file trong Downloads: budget dung lượng (LRU) + dọn file mồ côi
+disk = get_disk_manager(DOWNLOAD_PATH)
+_maintenance_task = None
+# Metrics từng pha của các download gần đây (percentile ở /stats)
+download_stats = MetricsAggregator()
+
 class DownloadRequest(BaseModel):
     url: str
     max_resolution: int = 720
     progressive_only: bool = False
     edit_65s: bool = False  # Có edit 65s không
+    # Cao hơn = chạy trước khi phải chờ slot (VD: video mới phát hiện 10, tải bù 0)
+    priority: int = 0
 
 class DownloadResponse(BaseModel):
     success: bool
@@ -26,90 +54,245 @@ class DownloadResponse(BaseModel):
     error: Optional[str] = None
     download_time: Optional[float] = None
     edit_time: Optional[float] = None
+    cached: bool = False  # True nếu lấy từ cache / dùng chung kết quả với request đang chạy
+    metrics: Optional[dict] = None  # Thời gian từng pha, TTFB, tốc độ từng stream
+
+class PrepareRequest(DownloadRequest):
+    # True: tải luôn trong nền, request /download sau đó chờ chung job / lấy từ cache
+    # False: chỉ resolve + chọn stream (cache tới khi URL hết hạn)
+    start_download: bool = True
+
+def _request_key(request: DownloadRequest):
+    video_id = extract_video_id(request.url) or request.url
+    return (video_id, request.max_resolution, request.progressive_only, request.edit_65s)
 
 @app.get("/")
 async def root():
     return {"message": "YouTube Download API Server", "status": "running"}
 
+def _submit(request: DownloadRequest):
+    """
+    Tạo job (hoặc dùng chung job giống hệt đang chạy / kết quả trong cache)
+    Returns: (job, joined) - joined=True nếu không phải tải mới
+    """
+    key = _request_key(request)
+    artifact_cache.cleanup()
+    jobs.cleanup()
+
+    job = jobs.find_active(key)
+    if job is not None:
+        job.bump(request.priority)
+        return job, True
+
+    job = Job(key, request, request.priority)
+    cached = artifact_cache.get(key)
+    if cached is not None:
+        print(f"♻️ Cache hit: {key[0]}")
+        disk.touch(cached.file_path)
+        job.result = cached.model_copy(update={"cached": True, "download_time": 0, "edit_time": 0})
+        job.started_at = job.created_at
+        jobs.add(job)
+        jobs.finish(job, "done")
+        return job, True
+
+    jobs.add(job)
+    job.task = asyncio.create_task(_run_job(job))
+    job.task.add_done_callback(lambda task: _on_job_cancelled(job, task))
+    return job, False
+
+async def _run_job(job: Job) -> DownloadResponse:
+    result = await _run_download(job.request, job)
+    if result.success and result.file_path:
+        artifact_cache.put(job.key, result.file_path, result)
+    job.result = result
+    jobs.finish(job, "done" if result.success else "failed")
+    return result
+
+def _on_job_cancelled(job: Job, task: asyncio.Task):
+    # Chạy cả khi task bị hủy trước khi kịp bắt đầu (lúc đó _run_job không chạy dòng nào)
+    if task.cancelled() and not job.finished:
+        print(f"🛑 Job {job.id} ({job.key[0]}) đã bị hủy")
+        job.result = DownloadResponse(success=False, error="Job cancelled")
+        jobs.finish(job, "cancelled")
+
+def _job_response(job: Job):
+    data = job.to_dict()
+    data["result"] = job.result.model_dump() if job.result is not None else None
+    return data
+
 @app.post("/download", response_model=DownloadResponse)
 async def download_video(request: DownloadRequest):
     """
-    Download YouTube video và trả về đường dẫn file
+    Download YouTube video và trả về đường dẫn file (giữ kết nối tới khi xong)
     Có thể edit 65s nếu cần
-    GỌI TRỰC TIẾP để tối ưu tốc độ (giống dowloadstest.py)
+    Request trùng (cùng video + tùy chọn) đang chạy thì chờ chung 1 job,
+    đã tải xong thì trả ngay từ cache
+    """
+    job, joined = _submit(request)
+    if job.task is None:
+        return job.result
+    if joined:
+        print(f"🔗 Chờ chung job đang chạy: {job.key[0]}")
+
+    try:
+        # shield: 1 client ngắt kết nối không hủy job của các client khác
+        result = await asyncio.shield(job.task)
+    except asyncio.CancelledError:
+        if not job.task.cancelled():
+            raise  # Chính request này bị hủy (client ngắt kết nối)
+        return job.result
+    return result.model_copy(update={"cached": True}) if joined else result
+
+@app.post("/jobs")
+async def submit_job(request: DownloadRequest):
+    """Đưa job vào hàng đợi, trả về job_id ngay (lấy kết quả bằng GET /jobs/{job_id})"""
+    job, joined = _submit(request)
+    return {**_job_response(job), "joined": joined}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Trạng thái job. wait > 0: long-poll, giữ request tối đa `wait` giây (<= MAX_LONG_POLL)
+    cho tới khi job xong
     """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if wait > 0 and job.task is not None and not job.task.done():
+        # wait() không hủy task khi hết giờ, client ngắt kết nối cũng không ảnh hưởng job
+        await asyncio.wait({job.task}, timeout=min(wait, MAX_LONG_POLL))
+    return _job_response(job)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Hủy job (mọi request đang chờ chung job này đều nhận kết quả cancelled)"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.task is not None and not job.task.done():
+        job.task.cancel()
+        await asyncio.wait({job.task})
+    return _job_response(job)
+
+@app.get("/jobs")
+async def list_jobs():
+    """Job chưa xong + độ sâu hàng đợi / thời gian chờ slot"""
+    return {
+        "active": [job.to_dict() for job in jobs.active.values()],
+        "queue": _queue_stats(),
+    }
+
+def _queue_stats():
+    return {
+        **jobs.stats(),
+        "download": download_slots.stats(),
+        "ffmpeg": ffmpeg_slots.stats(),
+        "ffmpeg_pool": ffmpeg_pool.stats(),
+    }
+
+@app.post("/prepare")
+async def prepare_video(request: PrepareRequest):
+    """
+    Gọi ngay khi watcher phát hiện video mới (trước khi profile sẵn sàng upload):
+    resolve stream và (mặc định) bắt đầu tải trong nền
+    """
+    key = _request_key(request)
+    if request.start_download:
+        job, _ = _submit(DownloadRequest(**request.model_dump(exclude={"start_download"})))
+        return {"success": True, "video_id": key[0], "download_started": True, "job_id": job.id}
+
+    prepared = await asyncio.to_thread(prepare_streams, request.url, request.max_resolution)
+    if not prepared:
+        return {"success": False, "video_id": key[0], "error": "Cannot resolve streams"}
+    return {
+        "success": True,
+        "video_id": prepared["video_id"],
+        "title": prepared["title"],
+        "format": prepared["fmt"],
+        "expires_at": prepared["expires_at"],
+        "download_started": False,
+    }
+
+async def _run_download(request: DownloadRequest, job: Job) -> DownloadResponse:
     from datetime import datetime
     
     try:
-        download_path = os.path.join(os.getcwd(), "Downloads")
-        
-        # Download video - GỌI TRỰC TIẾP (nhanh nhất, giống dowloadstest.py)
-        # Dùng asyncio.to_thread() để không block event loop nhưng vẫn nhanh
-        download_start = datetime.now()
+        download_path = DOWNLOAD_PATH
         
-        # Python 3.9+: dùng to_thread (nhanh hơn), fallback về run_in_executor
-        if sys.version_info >= (3, 9):
-            video_file = await asyncio.to_thread(
-                download_youtube_video,
-                request.url,
-                download_path,
-                request.max_resolution,
-                request.progressive_only
-            )
-        else:
-            loop = asyncio.get_event_loop()
-            video_file = await loop.run_in_executor(
-                None,
-                download_youtube_video,
+        # Download video bằng asyncio (không chiếm thread của executor trong lúc tải)
+        # Chờ slot tải theo priority của job
+        async with download_slots.slot(job.priority, job) as waited:
+            job.wait_time += waited
+            job.status = "downloading"
+            job.started_at = job.started_at or time.time()
+            download_start = datetime.now()
+            video_file, metrics = await download_youtube_video_async(
                 request.url,
                 download_path,
                 request.max_resolution,
-                request.progressive_only
+                request.progressive_only,
+                return_metrics=True,
+                trim_duration=EDIT_DURATION if request.edit_65s else None
             )
-        
-        download_time = (datetime.now() - download_start).total_seconds()
+            download_time = (datetime.now() - download_start).total_seconds()
+        metrics["phases"]["queue_wait"] = round(waited, 3)
         
         if not video_file or not os.path.exists(video_file):
             return DownloadResponse(
                 success=False,
                 error="Download failed - file not found",
-                download_time=download_time
+                download_time=download_time,
+                metrics=metrics
             )
         
         final_file = video_file
         edit_time = 0
         
         # Edit nếu cần - GỌI TRỰC TIẾP (giống dowloadstest.py)
-        if request.edit_65s:
-            edit_start = datetime.now()
-            
-            # Python 3.9+: dùng to_thread, fallback về run_in_executor
-            if sys.version_info >= (3, 9):
-                edited_file = await asyncio.to_thread(edit_video_to_65s, video_file)
-            else:
-                loop = asyncio.get_event_loop()
-                edited_file = await loop.run_in_executor(None, edit_video_to_65s, video_file)
-            
-            edit_time = (datetime.now() - edit_start).total_seconds()
+        # File đã được cắt lúc mux (metrics["trimmed"]) thì không chạy ffmpeg lần 2
+        if request.edit_65s and not metrics.get("trimmed"):
+            # ffmpeg tốn CPU: giới hạn theo số core, job priority cao được edit trước
+            job.status = "waiting_edit"
+            async with ffmpeg_slots.slot(job.priority, job) as edit_waited:
+                job.wait_time += edit_waited
+                job.status = "editing"
+                edit_start = datetime.now()
+                ffmpeg_stats = {}
+                # File gốc là artifact dùng chung (media_store.lookup), job khác có thể đang dùng
+                # -> giữ nguyên input, không đổi tên / xóa
+                edit = lambda: edit_video_to_65s(
+                    video_file, priority=job.priority, ffmpeg_stats=ffmpeg_stats
+                )
+                
+                # Python 3.9+: dùng to_thread, fallback về run_in_executor
+                if sys.version_info >= (3, 9):
+                    edited_file = await asyncio.to_thread(edit)
+                else:
+                    loop = asyncio.get_event_loop()
+                    edited_file = await loop.run_in_executor(None, edit)
+                
+                edit_time = (datetime.now() - edit_start).total_seconds()
+            metrics["phases"]["edit"] = round(edit_time, 3)
+            metrics["phases"]["edit_queue_wait"] = round(edit_waited, 3)
+            if ffmpeg_stats:
+                metrics["edit_ffmpeg"] = ffmpeg_stats  # wait / wall / cpu của process ffmpeg
             
             if edited_file and os.path.exists(edited_file):
+                # File gốc để DiskManager dọn theo LRU / budget, không xóa ở đây
                 final_file = edited_file
-                # Xóa file gốc
-                try:
-                    os.remove(video_file)
-                except:
-                    pass
             else:
                 print("Edit failed, using original file")
         
         # Trả về đường dẫn file tuyệt đối
         absolute_path = os.path.abspath(final_file)
+        download_stats.add(metrics)
         
         return DownloadResponse(
             success=True,
             file_path=absolute_path,
             download_time=download_time,
-            edit_time=edit_time
+            edit_time=edit_time,
+            metrics=metrics
         )
         
     except Exception as e:
@@ -123,10 +306,58 @@ async def download_video(request: DownloadRequest):
             edit_time=0
         )
 
+async def _disk_maintenance():
+    """Định kỳ dọn file mồ côi + kiểm tra budget (không đợi tới lần download kế tiếp)"""
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await asyncio.to_thread(disk.maintain, True)
+        except Exception as e:
+            print(f"⚠️ Disk maintenance lỗi: {e}")
+
+@app.on_event("startup")
+async def startup():
+    global _maintenance_task
+    # File tạm của lần chạy trước (server bị tắt / crash giữa chừng)
+    os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+    await asyncio.to_thread(disk.maintain, True)
+    _maintenance_task = asyncio.create_task(_disk_maintenance())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if _maintenance_task:
+        _maintenance_task.cancel()
+    # Hủy các download đang chạy (xóa file tạm) rồi đóng pool kết nối
+    tasks = [job.task for job in jobs.active.values() if job.task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await close_http_client()
+
+@app.get("/stats")
+async def stats():
+    """Percentile (p50 / p90 / p99) thời gian từng pha + tốc độ của các download gần đây"""
+    return {
+        **download_stats.summary(),
+        "queue": _queue_stats(),
+        "cache": artifact_cache.stats(),
+        "disk": await asyncio.to_thread(disk.usage),
+    }
+
+@app.get("/disk")
+async def disk_usage():
+    """Dung lượng thư mục Downloads: artifact, file tạm, budget, số file đã xóa"""
+    return await asyncio.to_thread(disk.usage)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "download_api"}
+    return {
+        "status": "healthy",
+        "service": "download_api",
+        "inflight": len(jobs.active),
+        "cache": artifact_cache.stats(),
+    }
 
 if __name__ == "__main__":
     import uvicorn
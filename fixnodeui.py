@@ -5,8 +5,11 @@ import asyncio
 import os
 from datetime import datetime
 from loader import TxtLoader
-from token_rotator import TokenRotator
-from watcher import watch_channel
+from token_rotator import TokenRotator, DAILY_QUOTA
+from poll_scheduler import PollScheduler
+from watcher import BatchPoller
+from dedupe_store import DedupeStore
+from utils.download_metrics import format_metrics
 from utils.tiktok_action import ProfileController
 import httpx
 from selenium.webdriver.support.ui import WebDriverWait
@@ -17,9 +20,11 @@ import re
 # Cấu hình
 EDIT_VIDEO = True  # True = edit 65s, False = không edit
 MAX_RESOLUTION = 720
+PRIORITY_NEW_VIDEO = 10  # Video mới phát hiện chạy trước job tải bù (priority 0)
+JOB_POLL_WAIT = 30       # Long-poll GET /jobs/{id} mỗi lần tối đa 30s
 
 # Lưu trữ
-uploaded_videos = set()
+dedupe = DedupeStore()  # Video đã upload (lưu file, dùng chung với GUI / runner khác)
 profile_controllers = {}
 file_inputs = {}
 API_BASE_URL = "http://localhost:8000"  # API server URL
@@ -127,33 +132,73 @@ async def upload_video_to_tiktok(row, video_file_path, profile_id, channel_id):
         print(f"[Row {row}] Upload error: {e}")
         return False, None
 
+async def download_via_job(payload):
+    """
+    Gửi job vào hàng đợi của API server rồi long-poll tới khi xong
+    (không giữ 1 request mở suốt thời gian tải như /download)
+    Returns: dict kết quả giống response của /download
+    """
+    response = await http_client.post(f"{API_BASE_URL}/jobs", json=payload)
+    response.raise_for_status()
+    job = response.json()
+    while job["status"] not in ("done", "failed", "cancelled"):
+        response = await http_client.get(f"{API_BASE_URL}/jobs/{job['job_id']}", params={"wait": JOB_POLL_WAIT})
+        response.raise_for_status()
+        job = response.json()
+    return job["result"] or {"success": False, "error": f"Job {job['status']}"}
+
+prepare_tasks = set()
+
+def prepare_video(video_url):
+    """Phát hiện video mới -> báo server resolve stream + tải trước (không chờ kết quả)"""
+    if dedupe.is_uploaded(extract_video_id(video_url) or video_url):
+        return
+
+    async def _prepare():
+        try:
+            await http_client.post(f"{API_BASE_URL}/prepare", json={
+                "url": video_url,
+                "max_resolution": MAX_RESOLUTION,
+                "progressive_only": False,
+                "edit_65s": EDIT_VIDEO,
+                "priority": PRIORITY_NEW_VIDEO
+            })
+        except Exception as e:
+            print(f"⚠️ Prepare lỗi {video_url}: {e}")
+
+    task = asyncio.create_task(_prepare())
+    prepare_tasks.add(task)
+    task.add_done_callback(prepare_tasks.discard)
+
 async def handle_new_video(row, video_url, profile_id, channel_id):
     """Xử lý khi có video mới - TỐI ƯU REQUEST API"""
-    video_id = extract_video_id(video_url)
-    if video_id and video_id in uploaded_videos:
+    video_id = extract_video_id(video_url) or video_url
+    if dedupe.is_uploaded(video_id):
         print(f"⏭️ [{row}] Video {video_id} đã được upload, bỏ qua")
         return
+    if not dedupe.claim(video_id, profile_id):
+        print(f"⏭️ [{row}] Video {video_id} đang được xử lý, bỏ qua")
+        return
     
     start_time = datetime.now()
+    uploaded = False
     try:
         print(f"[Row {row}] 📥 Downloading video: {video_url}")
         
         # FIX 3: DÙNG GLOBAL CLIENT (KHÔNG DÙNG 'ASYNC WITH' Ở ĐÂY)
         # Tốc độ phản hồi JSON sẽ đạt mức tối đa như Postman
-        response = await http_client.post(
-            f"{API_BASE_URL}/download",
-            json={
-                "url": video_url,
-                "max_resolution": MAX_RESOLUTION,
-                "progressive_only": False,
-                "edit_65s": EDIT_VIDEO
-            }
-        )
-        response.raise_for_status()
-        result = response.json()
+        result = await download_via_job({
+            "url": video_url,
+            "max_resolution": MAX_RESOLUTION,
+            "progressive_only": False,
+            "edit_65s": EDIT_VIDEO,
+            "priority": PRIORITY_NEW_VIDEO
+        })
         
         download_time = result.get('download_time', 0)
         edit_time = result.get('edit_time', 0)
+        if result.get('metrics'):
+            print(f"[Row {row}] 📊 {format_metrics(result['metrics'])}")
         
         if not result.get('success') or not result.get('file_path'):
             print(f"[Row {row}] ❌ Download failed: {result.get('error', 'Unknown error')}")
@@ -168,7 +213,8 @@ async def handle_new_video(row, video_url, profile_id, channel_id):
         upload_success, upload_times = await upload_video_to_tiktok(row, final_file, profile_id, channel_id)
         
         if upload_success and upload_times:
-            uploaded_videos.add(video_id)
+            dedupe.mark(video_id, profile_id, "uploaded")
+            uploaded = True
             total_time = (datetime.now() - start_time).total_seconds()
             
             print(f"\n{'='*60}")
@@ -182,12 +228,15 @@ async def handle_new_video(row, video_url, profile_id, channel_id):
             print(f"Total: {total_time:.1f}s")
             print(f"{'='*60}\n")
         
-        if os.path.exists(final_file): os.remove(final_file)
+        # File do API server quản lý (cache TTL + giới hạn dung lượng), không xóa ở đây
             
     except Exception as e:
         print(f"[Row {row}] ❌ Error: {e}")
+    finally:
+        if not uploaded:
+            dedupe.mark(video_id, profile_id, "failed")
 
-async def run_profile_watcher(row, profile_id, channel_id, tokens):
+async def run_profile_watcher(row, profile_id, channel_id, poller):
     """Mở Chrome và theo dõi YouTube"""
     try:
         print(f"[Row {row}] Starting Genlogin profile: {profile_id}")
@@ -206,13 +255,11 @@ async def run_profile_watcher(row, profile_id, channel_id, tokens):
         profile_controllers[row] = controller
         file_inputs[row] = file_input
         
-        rotator = TokenRotator(tokens, start_index=row % len(tokens))
-        
         # Wrapper callback để log giữ nguyên format của bạn
         async def video_callback(video_url):
             await handle_new_video(row, video_url, profile_id, channel_id)
         
-        await watch_channel(channel_id, rotator, 
+        await poller.watch(channel_id,
                             log_callback=lambda msg, vl=None: print(f"[Row {row}] {msg}" + (f"\nVideo link: {vl}" if vl else "")), 
                             video_callback=video_callback)
         
@@ -227,11 +274,13 @@ async def main():
     tokens = TxtLoader.loads("tokens.txt")
     channels_data = TxtLoader.loads("channels.txt")
     
-    tasks = []
+    scheduler = PollScheduler(daily_budget=len(tokens) * DAILY_QUOTA)
+    poller = BatchPoller(TokenRotator(tokens), interval=1, scheduler=scheduler, prepare_callback=prepare_video)
+    tasks = [asyncio.create_task(poller.run())]
     for idx, line in enumerate(channels_data):
         parts = line.strip().split("|")
         cid, pid = (parts[0].strip(), parts[1].strip()) if len(parts) == 2 else (line.strip(), f"profile_{idx}")
-        tasks.append(asyncio.create_task(run_profile_watcher(idx, pid, cid, tokens)))
+        tasks.append(asyncio.create_task(run_profile_watcher(idx, pid, cid, poller)))
     
     await asyncio.gather(*tasks)
 
@@ -5,8 +5,12 @@ import asyncio
 import os
 from datetime import datetime
 from loader import TxtLoader
-from token_rotator import TokenRotator
-from watcher import watch_channel
+from token_rotator import TokenRotator, DAILY_QUOTA
+from poll_scheduler import PollScheduler
+from watcher import BatchPoller
+from youtube_client import close_http_client
+from dedupe_store import DedupeStore
+from utils.download_metrics import format_metrics
 from utils.tiktok_action import ProfileController
 import httpx
 from selenium.webdriver.support.ui import WebDriverWait
@@ -17,10 +21,16 @@ import re
 # Cấu hình
 EDIT_VIDEO = True  # True = edit 65s, False = không edit
 MAX_RESOLUTION = 720
+PRIORITY_NEW_VIDEO = 10  # Video mới phát hiện chạy trước job tải bù (priority 0)
+JOB_POLL_WAIT = 30       # Long-poll GET /jobs/{id} mỗi lần tối đa 30s
+# WebSub push (tùy chọn): URL public trỏ về port WEBSUB_PORT, VD "https://abc.ngrok.app/websub"
+# None = chỉ dùng poll
+WEBSUB_CALLBACK_URL = None
+WEBSUB_PORT = 8001
+WEBSUB_SECRET = None
 
 # Lưu trữ
-uploaded_videos = set()          # Chỉ theo video_id (toàn cục, tránh trùng)
-seen_video_keys = set()          # (channel_id, video_id/url) để chắc chắn không lặp
+dedupe = DedupeStore()           # Video đã upload (lưu file, dùng chung với GUI / runner khác)
 profile_controllers = {}         # row -> ProfileController
 file_inputs = {}                 # row -> input[type=file] element
 API_BASE_URL = "http://localhost:8000"  # API server URL
@@ -199,25 +209,67 @@ async def upload_video_to_tiktok(row, video_file_path, profile_id, channel_id):
         # Trả về False để lần video này được coi là thất bại và sẽ chờ video mới
         return False, None
 
+async def download_via_job(payload):
+    """
+    Gửi job vào hàng đợi của API server rồi long-poll tới khi xong
+    (không giữ 1 request mở suốt thời gian tải như /download)
+    Returns: dict kết quả giống response của /download
+    """
+    response = await http_client.post(f"{API_BASE_URL}/jobs", json=payload)
+    response.raise_for_status()
+    job = response.json()
+    while job["status"] not in ("done", "failed", "cancelled"):
+        response = await http_client.get(f"{API_BASE_URL}/jobs/{job['job_id']}", params={"wait": JOB_POLL_WAIT})
+        response.raise_for_status()
+        job = response.json()
+    return job["result"] or {"success": False, "error": f"Job {job['status']}"}
+
+prepare_tasks = set()            # Giữ reference tới task prepare đang chạy
+
+def prepare_video(video_url):
+    """
+    Hook của poller: gọi ngay khi phát hiện video mới -> server resolve stream và tải trước,
+    /download của handle_new_video sau đó chờ chung job hoặc lấy file từ cache
+    """
+    video_id = extract_video_id(video_url)
+    if http_client is None or dedupe.is_uploaded(video_id or video_url):
+        return
+
+    async def _prepare():
+        try:
+            await http_client.post(f"{API_BASE_URL}/prepare", json={
+                "url": video_url,
+                "max_resolution": MAX_RESOLUTION,
+                "progressive_only": False,
+                "edit_65s": EDIT_VIDEO,
+                "priority": PRIORITY_NEW_VIDEO
+            })
+            print(f"🚀 Prepare: {video_url}")
+        except Exception as e:
+            print(f"⚠️ Prepare lỗi {video_url}: {e}")
+
+    task = asyncio.create_task(_prepare())
+    prepare_tasks.add(task)
+    task.add_done_callback(prepare_tasks.discard)
+
 async def handle_new_video(row, video_url, profile_id, channel_id):
     """Xử lý khi có video mới - KHÔNG UI, GỌI TRỰC TIẾP"""
     video_id = extract_video_id(video_url)
     
-    # Tạo key duy nhất cho video theo channel (phòng trường hợp extract_video_id bị fail trả về None)
+    # Tạo key duy nhất cho video (phòng trường hợp extract_video_id bị fail trả về None)
     dedup_key = video_id or video_url
-    global seen_video_keys
-    if dedup_key and (channel_id, dedup_key) in seen_video_keys:
-        print(f"⏭️ [{row}] Video đã được xử lý trước đó cho channel {channel_id}, bỏ qua")
+    if dedupe.is_uploaded(dedup_key):
+        print(f"⏭️ [{row}] Video {dedup_key} đã được upload, bỏ qua")
         return
-    
-    if video_id and video_id in uploaded_videos:
-        print(f"⏭️ [{row}] Video {video_id} đã được upload (uploaded_videos), bỏ qua")
+    if not dedupe.claim(dedup_key, profile_id):
+        print(f"⏭️ [{row}] Video {dedup_key} đang được xử lý cho profile {profile_id}, bỏ qua")
         return
     
     start_time = datetime.now()
     download_time = 0
     edit_time = 0
     final_file = None
+    uploaded = False
     
     try:
         # TỐI ƯU: Kiểm tra file_input sẵn sàng trước khi download để tránh overhead
@@ -235,15 +287,15 @@ async def handle_new_video(row, video_url, profile_id, channel_id):
             "url": video_url,
             "max_resolution": MAX_RESOLUTION,
             "progressive_only": False,
-            "edit_65s": EDIT_VIDEO
+            "edit_65s": EDIT_VIDEO,
+            "priority": PRIORITY_NEW_VIDEO
         }
-        response = await http_client.post(f"{API_BASE_URL}/download", json=json_payload)
-        response.raise_for_status()
-        # TỐI ƯU: Parse JSON một lần
-        result = response.json()
+        result = await download_via_job(json_payload)
         
         download_time = result.get('download_time', 0)
         edit_time = result.get('edit_time', 0)
+        if result.get('metrics'):
+            print(f"[Row {row}] 📊 {format_metrics(result['metrics'])}")
         
         if not result.get('success') or not result.get('file_path'):
             error_msg = result.get('error', 'Unknown error')
@@ -260,11 +312,9 @@ async def handle_new_video(row, video_url, profile_id, channel_id):
         upload_success, upload_times = await upload_video_to_tiktok(row, final_file, profile_id, channel_id)
         
         if upload_success and upload_times:
-            # Đánh dấu video đã xử lý để không lặp lại (theo session)
-            if dedup_key:
-                seen_video_keys.add((channel_id, dedup_key))
-            if video_id:
-                uploaded_videos.add(video_id)
+            # Đánh dấu video đã upload (lưu file, restart không đăng lại)
+            dedupe.mark(dedup_key, profile_id, "uploaded")
+            uploaded = True
 
             # Tính total_time = download + edit + upload (KHÔNG tính overhead và reload_time)
             # Chỉ tính các bước chính, không tính network latency và overhead giữa các bước
@@ -301,19 +351,18 @@ async def handle_new_video(row, video_url, profile_id, channel_id):
             except Exception as _e:
                 print(f"[Row {row}] ⚠️ Không thể ghi history.txt: {_e}")
         
-        # Xóa file
-        try:
-            if os.path.exists(final_file):
-                os.remove(final_file)
-        except:
-            pass
+        # Không xóa file: API server giữ file trong cache (row khác có thể đang upload cùng file),
+        # tự xóa khi hết TTL / vượt dung lượng
             
     except Exception as e:
         print(f"[Row {row}] ❌ Error: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        if not uploaded:
+            dedupe.mark(dedup_key, profile_id, "failed")
 
-async def run_profile_watcher(row, profile_id, channel_id, tokens):
+async def run_profile_watcher(row, profile_id, channel_id, poller):
     """Mở Chrome bằng Genlogin, đợi file input, sau đó theo dõi YouTube"""
     try:
         print(f"[Row {row}] Starting Genlogin profile: {profile_id}")
@@ -343,9 +392,6 @@ async def run_profile_watcher(row, profile_id, channel_id, tokens):
         # Bắt đầu theo dõi YouTube
         print(f"[Row {row}] 👀 Watching YouTube channel: {channel_id}")
         
-        start_index = row % len(tokens)
-        rotator = TokenRotator(tokens, start_index=start_index)
-        
         def gui_log(msg, video_link=None):
             print(f"[Row {row}] {msg}")
             if video_link:
@@ -354,7 +400,7 @@ async def run_profile_watcher(row, profile_id, channel_id, tokens):
         async def video_callback(video_url):
             await handle_new_video(row, video_url, profile_id, channel_id)
         
-        await watch_channel(channel_id, rotator, log_callback=gui_log, video_callback=video_callback)
+        await poller.watch(channel_id, log_callback=gui_log, video_callback=video_callback)
         
     except Exception as e:
         print(f"[Row {row}] ❌ Error: {e}")
@@ -418,6 +464,21 @@ async def main():
     )
     print(f"✅ HTTP client initialized (reusable, {max_connections} connections for {num_channels} channels)")
     
+    # 1 poller dùng chung cho tất cả channel (gom 50 channel / 1 request)
+    # Lịch poll thích ứng: ngân sách = tổng quota của tất cả token
+    scheduler = PollScheduler(daily_budget=len(tokens) * DAILY_QUOTA)
+    poller = BatchPoller(TokenRotator(tokens), interval=1, scheduler=scheduler, prepare_callback=prepare_video)
+    background_tasks = [asyncio.create_task(poller.run())]
+
+    # WebSub: channel có lease push thì poller không cần poll nữa
+    websub_receiver = None
+    if WEBSUB_CALLBACK_URL:
+        from websub_server import WebSubReceiver, serve
+        websub_receiver = WebSubReceiver(WEBSUB_CALLBACK_URL, on_video=poller.push, secret=WEBSUB_SECRET)
+        poller.push_source = websub_receiver
+        background_tasks.append(asyncio.create_task(serve(websub_receiver, port=WEBSUB_PORT)))
+        print(f"✅ WebSub receiver: {WEBSUB_CALLBACK_URL} (port {WEBSUB_PORT})")
+
     # Parse channels (format: channel_id|profile_id hoặc chỉ channel_id)
     tasks = []
     for idx, line in enumerate(channels_data):
@@ -432,11 +493,17 @@ async def main():
             continue
         
         print(f"\n[{idx}] Channel: {channel_id} | Profile: {profile_id}")
-        tasks.append(asyncio.create_task(run_profile_watcher(idx, profile_id, channel_id, tokens)))
+        tasks.append(asyncio.create_task(run_profile_watcher(idx, profile_id, channel_id, poller)))
+        if websub_receiver:
+            websub_receiver.channels.add(channel_id)
+
+    if websub_receiver:
+        # run_renewal gửi subscribe lần đầu và tự gia hạn lease
+        background_tasks.append(asyncio.create_task(websub_receiver.run_renewal()))
     
     print(f"\n✅ Starting {len(tasks)} watchers (ĐA LUỒNG - chạy song song)...")
     print("="*60)
-    print(f"📊 Mỗi watcher sẽ theo dõi 1 kênh YouTube độc lập")
+    print(f"📊 Mỗi watcher theo dõi 1 kênh YouTube, poll chung qua batch poller")
     print(f"📊 Tất cả watchers chạy đồng thời (async/await)")
     print(f"📊 Mỗi watcher có profile GenLogin riêng và không block nhau")
     print("="*60)
@@ -448,8 +515,11 @@ async def main():
         # 2. Theo dõi YouTube channel riêng  
         # 3. Download và upload video khi có video mới
         # Tất cả chạy song song, không block nhau
-        await asyncio.gather(*tasks, return_exceptions=True)  # return_exceptions để không dừng khi 1 task lỗi
+        await asyncio.gather(*background_tasks, *tasks, return_exceptions=True)  # return_exceptions để không dừng khi 1 task lỗi
     finally:
+        if websub_receiver is not None:
+            await websub_receiver.close()
+        await close_http_client()
         # Đóng http client khi kết thúc
         if http_client is not None:
             await http_client.aclose()
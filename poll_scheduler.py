@@ -0,0 +1,202 @@
+"""
+Lịch poll thích ứng cho từng channel, học từ lịch sử upload:
+- Histogram upload theo giờ trong tuần (7 x 24 slot, giờ UTC) cho mỗi channel
+- Slot hay upload -> poll nhanh, slot ít upload -> giãn ra
+- Pha poll của các channel rải đều trong interval (không poll cùng lúc)
+- Tổng tốc độ poll luôn nằm trong ngân sách request/giây và quota/ngày
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+HISTORY_FILE = "upload_history.json"
+SLOTS = 7 * 24
+MIN_SAMPLES = 3    # Ít hơn số upload này thì coi như chưa có lịch sử (poll đều)
+HOT_SCORE = 2.0    # Slot có xác suất upload >= 2 lần trung bình -> poll nhanh nhất
+SMOOTHING = 0.5    # Laplace smoothing cho slot chưa từng có upload
+SAVE_INTERVAL = 5  # Ghi file lịch sử tối đa 5s / lần (trên thread nền)
+
+
+def _slot(ts: float) -> int:
+    dt = datetime.fromtimestamp(ts, timezone.utc)
+    return dt.weekday() * 24 + dt.hour
+
+
+class PollScheduler:
+    def __init__(self, min_interval=0.25, max_interval=300.0, max_rps=5.0,
+                 daily_budget=None, poll_cost=1, history_file=HISTORY_FILE, base_interval=1.0):
+        """
+        min_interval / max_interval: giới hạn interval poll mỗi channel (giây),
+            min_interval < base_interval để slot hay upload được poll nhanh hơn mức đều
+        base_interval: interval của slot trung bình và của channel chưa đủ lịch sử (giây)
+        max_rps: tổng số channel được poll / giây (tất cả channel cộng lại)
+        daily_budget: tổng quota / ngày có thể dùng (VD: số token * 10000), None = không giới hạn
+        poll_cost: quota tốn cho 1 lần poll 1 channel
+        """
+        self.min_interval = min_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.max_rps = max_rps
+        self.daily_budget = daily_budget
+        self.poll_cost = poll_cost
+        self.history_file = history_file
+
+        self.histograms = self._load()  # channel_id -> [SLOTS counts]
+        self._lock = threading.Lock()   # histograms được đọc từ thread ghi file
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        atexit.register(self._save)
+        self._next_due = {}             # channel_id -> timestamp
+        self._intervals = {}            # channel_id -> interval đang áp dụng (sau khi scale)
+        self._watched = set()           # channel chạy riêng qua interval_for (watch_channel)
+        self._watched_scale = None      # (slot, hệ số giãn) của nhóm _watched, None = cần tính lại
+
+    # -----------------------
+    # Lịch sử upload
+    # -----------------------
+    def _load(self):
+        if not os.path.exists(self.history_file):
+            return {}
+        try:
+            with open(self.history_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ Không đọc được {self.history_file}: {e}")
+            return {}
+
+    def _save(self):
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                data = json.dumps(self.histograms)
+            tmp_file = f"{self.history_file}.tmp"
+            try:
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_file, self.history_file)
+            except Exception as e:
+                print(f"⚠️ Không ghi được {self.history_file}: {e}")
+                with self._lock:
+                    self._dirty = True
+
+    def record_upload(self, channel_id: str, ts: float = None):
+        """
+        Ghi nhận 1 lần phát hiện video mới (mặc định: thời điểm hiện tại).
+        Được gọi từ event loop: file lịch sử ghi trên thread nền, gộp tối đa SAVE_INTERVAL / lần
+        """
+        with self._lock:
+            histogram = self.histograms.setdefault(channel_id, [0] * SLOTS)
+            histogram[_slot(ts or time.time())] += 1
+            self._dirty = True
+        self._watched_scale = None
+        if time.time() - self._last_save >= SAVE_INTERVAL:
+            self._last_save = time.time()
+            threading.Thread(target=self._save, daemon=True).start()
+
+    def _score(self, channel_id: str, slot: int) -> float:
+        """Xác suất upload ở slot so với trung bình (1.0 = đều, chưa đủ dữ liệu cũng = 1.0)"""
+        histogram = self.histograms.get(channel_id)
+        total = sum(histogram) if histogram else 0
+        if total < MIN_SAMPLES:
+            return 1.0
+        # Làm mượt với 2 slot kề bên (upload hay lệch giờ)
+        window = histogram[(slot - 1) % SLOTS] + 2 * histogram[slot] + histogram[(slot + 1) % SLOTS]
+        p = (window + SMOOTHING) / (4 * total + SMOOTHING * SLOTS)
+        return p * SLOTS
+
+    def _raw_interval(self, channel_id: str, slot: int) -> float:
+        score = max(self._score(channel_id, slot), 1e-6)
+        if score >= HOT_SCORE:
+            return self.min_interval
+        # score = 1.0 (slot trung bình / chưa có lịch sử) -> đúng base_interval
+        return min(self.max_interval, max(self.min_interval, self.base_interval / score))
+
+    # -----------------------
+    # Lập lịch
+    # -----------------------
+    def _budget_rate(self) -> float:
+        """Số lần poll channel / giây tối đa cho phép"""
+        rate = self.max_rps
+        if self.daily_budget:
+            rate = min(rate, self.daily_budget / 86400 / self.poll_cost)
+        return rate
+
+    def _stretch(self, raw_intervals) -> float:
+        """Vượt ngân sách -> hệ số giãn tất cả interval theo cùng tỉ lệ (>= 1)"""
+        total_rate = sum(1 / i for i in raw_intervals)
+        return max(1.0, total_rate / self._budget_rate()) if total_rate else 1.0
+
+    def _plan(self, channel_ids, now: float):
+        slot = _slot(now)
+        raw = {c: self._raw_interval(c, slot) for c in channel_ids}
+        scale = self._stretch(raw.values())
+        # Chỉ cập nhật channel được lập lịch lần này, channel khác giữ interval cũ cho report()
+        self._intervals.update({c: i * scale for c, i in raw.items()})
+
+    def _phase(self, channel_id: str, interval: float) -> float:
+        # Pha cố định theo channel_id để rải đều các channel trong interval
+        return (zlib.crc32(channel_id.encode()) / 0xFFFFFFFF) * interval
+
+    def due_channels(self, channel_ids, now: float = None):
+        """Trả về các channel đến lượt poll và đặt lịch lần poll kế tiếp cho chúng"""
+        now = now or time.time()
+        self._plan(channel_ids, now)
+
+        due = []
+        for channel_id in channel_ids:
+            if self._next_due.get(channel_id, 0) > now:
+                continue
+            due.append(channel_id)
+            interval = self._intervals[channel_id]
+            phase = self._phase(channel_id, interval)
+            # Lần poll kế tiếp rơi vào mốc phase + k * interval
+            k = int((now - phase) // interval) + 1
+            self._next_due[channel_id] = phase + k * interval
+        return due
+
+    def interval_for(self, channel_id: str, now: float = None) -> float:
+        """
+        Interval cho 1 channel chạy riêng (watch_channel). Các channel đã gọi interval_for
+        chia chung ngân sách request/giây + quota như _plan (giãn cùng tỉ lệ khi vượt)
+        """
+        slot = _slot(now or time.time())
+        if channel_id not in self._watched:
+            self._watched.add(channel_id)
+            self._watched_scale = None
+        # Hệ số giãn chỉ đổi khi sang slot mới / thêm channel / có upload mới -> cache lại
+        if self._watched_scale is None or self._watched_scale[0] != slot:
+            self._watched_scale = (slot, self._stretch(self._raw_interval(c, slot) for c in self._watched))
+        interval = self._raw_interval(channel_id, slot) * self._watched_scale[1]
+        self._intervals[channel_id] = interval
+        return interval
+
+    def expected_latency(self, channel_id: str) -> float:
+        """
+        Độ trễ phát hiện kỳ vọng (giây): trung bình interval / 2, có trọng số theo
+        xác suất upload ở từng slot
+        """
+        scale = 1.0
+        if channel_id in self._intervals:
+            scale = self._intervals[channel_id] / self._raw_interval(channel_id, _slot(time.time()))
+        weights = [self._score(channel_id, s) for s in range(SLOTS)]
+        total = sum(weights)
+        latency = sum(w * self._raw_interval(channel_id, s) * scale / 2 for s, w in enumerate(weights))
+        return latency / total
+
+    def report(self):
+        """Thống kê từng channel: interval hiện tại, số upload đã học, độ trễ kỳ vọng"""
+        return {
+            channel_id: {
+                "interval": round(interval, 2),
+                "samples": sum(self.histograms.get(channel_id, [])),
+                "expected_latency": round(self.expected_latency(channel_id), 2),
+            }
+            for channel_id, interval in self._intervals.items()
+        }
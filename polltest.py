@@ -0,0 +1,251 @@
+"""
+Benchmark poll channel với stub Data API server chạy local (không tốn quota, không cần mạng)
+So sánh mỗi channel 1 request (watch_channel cũ) với BatchPoller (tối đa 50 channel / HTTP request)
+Chạy: python polltest.py [số channel] [số chu kỳ]
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import youtube_client
+from watcher import BatchPoller
+
+
+class StubAPI:
+    """Dữ liệu giả: mỗi channel "UC{n}" có playlist "UU{n}" với danh sách video mới nhất trước"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.videos = {}     # playlist_id -> [video]
+        self.requests = 0    # số HTTP request server nhận (1 batch = 1 request)
+        self.calls = 0       # số API call (mỗi part trong batch tính 1)
+
+    def add_video(self, channel_id: str, video_id: str):
+        playlist_id = "UU" + channel_id[2:]
+        with self.lock:
+            self.videos.setdefault(playlist_id, []).insert(0, {
+                "video_id": video_id,
+                "published_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            })
+
+    def handle(self, path: str, query: dict, etag: str = None):
+        """Returns: (status, headers, body bytes)"""
+        with self.lock:
+            self.calls += 1
+            if path.endswith("/channels"):
+                ids = query["id"][0].split(",")
+                items = [{"id": c, "contentDetails": {"relatedPlaylists": {"uploads": "UU" + c[2:]}}}
+                         for c in ids if c.startswith("UC")]
+                return 200, {}, json.dumps({"items": items}).encode()
+
+            if path.endswith("/playlistItems"):
+                playlist_id = query["playlistId"][0]
+                count = int(query.get("maxResults", ["5"])[0])
+                offset = int(query.get("pageToken", ["0"])[0])  # pageToken giả = vị trí bắt đầu
+                playlist = self.videos.get(playlist_id, [])
+                videos = playlist[offset:offset + count]
+                new_etag = f'"{playlist_id}-{count}-{offset}-{videos[0]["video_id"] if videos else ""}"'
+                if etag == new_etag:
+                    return 304, {"ETag": new_etag}, b""
+                items = [{"snippet": {
+                    "title": f"Video {v['video_id']}",
+                    "publishedAt": v["published_at"],
+                    "resourceId": {"videoId": v["video_id"]},
+                }} for v in videos]
+                body = {"etag": new_etag, "items": items}
+                if offset + count < len(playlist):
+                    body["nextPageToken"] = str(offset + count)
+                return 200, {"ETag": new_etag}, json.dumps(body).encode()
+
+        return 404, {}, b"{}"
+
+
+def start_stub_server(api: StubAPI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, headers, body, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with api.lock:
+                api.requests += 1
+            url = urlparse(self.path)
+            self._send(*api.handle(url.path, parse_qs(url.query), self.headers.get("If-None-Match")))
+
+        def do_POST(self):
+            # Batch endpoint: multipart/mixed, mỗi part là 1 GET
+            with api.lock:
+                api.requests += 1
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            message = BytesParser().parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+            boundary = "stub_batch_boundary"
+            parts = []
+            for part in message.get_payload():
+                lines = part.get_payload(decode=True).decode().split("\r\n")
+                url = urlparse(lines[0].split(" ")[1])
+                etag = next((l.split(": ", 1)[1] for l in lines[1:] if l.startswith("If-None-Match")), None)
+                status, headers, content = api.handle(url.path, parse_qs(url.query), etag)
+                header_lines = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+                parts.append(
+                    f"--{boundary}\r\nContent-Type: application/http\r\n"
+                    f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n{header_lines}\r\n".encode()
+                    + content + b"\r\n"
+                )
+            payload = b"".join(parts) + f"--{boundary}--\r\n".encode()
+            self._send(200, {}, payload, f"multipart/mixed; boundary={boundary}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StubRotator:
+    def __init__(self):
+        self.charged = 0  # tổng quota đã charge, phải khớp số API call stub nhận được
+
+    def current(self):
+        return "stub-key"
+
+    def next(self):
+        return "stub-key"
+
+    def charge(self, token, units):
+        self.charged += units
+
+    def mark_exhausted(self, token):
+        pass
+
+    def all_exhausted(self):
+        return False
+
+
+async def bench_per_channel(api: StubAPI, channel_ids, cycles: int):
+    """Cách cũ: mỗi channel 1 request playlistItems.list / chu kỳ (chạy song song)"""
+    times = []
+    for _ in range(cycles):
+        start = time.perf_counter()
+        await asyncio.gather(*(youtube_client.get_recent_videos_async(c, "stub-key") for c in channel_ids))
+        times.append(time.perf_counter() - start)
+    return times
+
+
+BURST = 12  # Chu kỳ cuối: 1 channel đăng nhiều hơn RECENT_COUNT video giữa 2 lần poll
+
+
+async def bench_batch(api: StubAPI, channel_ids, cycles: int):
+    """
+    BatchPoller: gom tối đa 50 channel / HTTP request, kiểm tra có phát hiện đủ video mới
+    (kể cả BURST video của 1 channel trong 1 chu kỳ -> phải đọc thêm trang theo pageToken)
+    và quota charge vào rotator khớp số API call (kể cả channels.list khi resolve lại playlist)
+    """
+    rotator = StubRotator()
+    poller = BatchPoller(rotator, interval=0)
+    # 1/100 channel chưa có trong cache playlist -> chu kỳ đầu phải gọi channels.list
+    with youtube_client._cache_lock:
+        for channel_id in channel_ids[::100]:
+            youtube_client._playlist_cache.pop(channel_id, None)
+    detected = []
+
+    async def on_video(video_url):
+        detected.append(video_url)
+
+    tasks = [asyncio.create_task(poller.watch(c, log_callback=lambda *a: None, video_callback=on_video))
+             for c in channel_ids]
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.sleep(0)
+
+    times = []
+    total_expected = 0
+    for cycle in range(cycles):
+        # Chu kỳ 2 trở đi: 1/10 số channel có video mới
+        expected = []
+        if cycle:
+            for channel_id in channel_ids[::10]:
+                video_id = f"new{cycle}-{channel_id}"
+                api.add_video(channel_id, video_id)
+                expected.append(video_id)
+        if cycle and cycle == cycles - 1 and len(channel_ids) > 1:
+            for i in range(BURST):
+                video_id = f"burst{i}-{channel_ids[1]}"
+                api.add_video(channel_ids[1], video_id)
+                expected.append(video_id)
+        total_expected += len(expected)
+
+        # watch() in log từng channel, bỏ qua để dễ đọc kết quả
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            await poller.poll_once()
+            times.append(time.perf_counter() - start)
+            for _ in range(10):
+                await asyncio.sleep(0)
+        missing = [v for v in expected if not any(d.endswith(v) for d in detected)]
+        if missing:
+            print(f"❌ Chu kỳ {cycle + 1}: sót {len(missing)} video mới (VD: {missing[0]})")
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return times, len(detected), total_expected, rotator.charged
+
+
+async def main(channels: int = 1000, cycles: int = 5):
+    api = StubAPI()
+    server = start_stub_server(api)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    youtube_client.API_URL = f"{base_url}/youtube/v3"
+    youtube_client.BATCH_URL = f"{base_url}/batch"
+    youtube_client.PLAYLIST_CACHE_FILE = os.path.join(tempfile.mkdtemp(prefix="polltest_"), "playlists.json")
+
+    channel_ids = [f"UC{i:06d}" for i in range(channels)]
+    for channel_id in channel_ids:
+        api.add_video(channel_id, f"old-{channel_id}")
+
+    print("=" * 60)
+    print(f"⏱️ BENCHMARK POLL: {channels} channel x {cycles} chu kỳ (stub API {base_url})")
+    print("=" * 60)
+
+    # Resolve playlist 1 lần cho cả 2 cách (cache dùng chung)
+    await youtube_client.resolve_uploads_playlists_async(channel_ids, "stub-key")
+
+    results = {}
+    for name, bench in (("mỗi channel 1 request", bench_per_channel), ("batch 50 / request", bench_batch)):
+        api.requests = api.calls = 0
+        youtube_client._etag_cache.clear()
+        output = await bench(api, channel_ids, cycles)
+        times = output[0] if isinstance(output, tuple) else output
+        results[name] = times
+        print(f"🔹 {name}: {api.requests / cycles:.0f} HTTP request / chu kỳ, "
+              f"{api.calls / cycles:.0f} API call / chu kỳ, "
+              f"trung bình {sum(times) / len(times) * 1000:.1f} ms / chu kỳ")
+        if isinstance(output, tuple):
+            print(f"   Phát hiện {output[1]} video mới (mong đợi {output[2]})")
+            print(f"   {'✅' if output[3] == api.calls else '❌'} Quota đã charge: {output[3]} "
+                  f"(API call: {api.calls})")
+
+    await youtube_client.close_http_client()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*(int(a) for a in sys.argv[1:3])))
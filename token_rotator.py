@@ -1,31 +1,194 @@
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+    PACIFIC_TZ = ZoneInfo("America/Los_Angeles")
+except Exception:
+    # Windows không có tzdata thì dùng UTC-8 cố định (lệch 1 giờ khi có DST)
+    PACIFIC_TZ = timezone(timedelta(hours=-8))
+
+# Quota mặc định mỗi API key / ngày, reset lúc 0h giờ Pacific
+DAILY_QUOTA = 10000
+
+# Chi phí quota theo tài liệu YouTube Data API v3
+QUOTA_COSTS = {
+    "search.list": 100,
+    "playlistItems.list": 1,
+    "channels.list": 1,
+    "videos.list": 1,
+}
+
+USAGE_FILE = "quota_usage.json"
+SAVE_INTERVAL = 5  # Ghi file tối đa 5s / lần
+
+
+def quota_day() -> str:
+    """Ngày quota hiện tại (theo giờ Pacific)"""
+    return datetime.now(PACIFIC_TZ).strftime("%Y-%m-%d")
+
+
+def seconds_until_reset() -> float:
+    now = datetime.now(PACIFIC_TZ)
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+class QuotaLedger:
+    """
+    Sổ ghi quota đã dùng của từng key trong ngày, dùng chung cho mọi TokenRotator
+    trong process và lưu ra file để restart không gọi lại key đã hết quota.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, path: str = USAGE_FILE) -> "QuotaLedger":
+        with cls._instances_lock:
+            if path not in cls._instances:
+                cls._instances[path] = cls(path)
+            return cls._instances[path]
+
+    def __init__(self, path: str = USAGE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.day = quota_day()
+        self.usage = {}  # token -> units đã dùng trong ngày
+        self._dirty = False
+        self._last_save = 0.0
+        self._save_lock = threading.Lock()  # Chỉ 1 lần ghi file tại 1 thời điểm (thread nền / atexit)
+        self.usage = self._read_file()
+        atexit.register(self.save)
+
+    def _read_file(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("day") == self.day:
+                return data.get("usage", {})
+        except Exception as e:
+            print(f"⚠️ Không đọc được {self.path}: {e}")
+        return {}
+
+    def _roll_day(self):
+        day = quota_day()
+        if day != self.day:
+            self.day = day
+            self.usage = {}
+            self._dirty = True
+
+    def used(self, token: str) -> int:
+        with self.lock:
+            self._roll_day()
+            return self.usage.get(token, 0)
+
+    def charge(self, token: str, units: int):
+        with self.lock:
+            self._roll_day()
+            self.usage[token] = self.usage.get(token, 0) + units
+            self._dirty = True
+        if time.time() - self._last_save >= SAVE_INTERVAL:
+            self.save_soon()
+
+    def set_used(self, token: str, units: int):
+        with self.lock:
+            self._roll_day()
+            self.usage[token] = max(self.usage.get(token, 0), units)
+            self._dirty = True
+        self.save_soon()
+
+    def save_soon(self):
+        """
+        Ghi file trên thread nền: charge() / set_used() được gọi từ event loop của watcher,
+        không để đọc + ghi JSON chặn loop. atexit vẫn gọi save() trực tiếp.
+        """
+        self._last_save = time.time()
+        threading.Thread(target=self.save, daemon=True).start()
+
+    def save(self):
+        with self._save_lock:
+            with self.lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+            # Process khác (GUI / headless) có thể cũng đang ghi: lấy max từng key
+            on_disk = self._read_file()
+            with self.lock:
+                for token, units in on_disk.items():
+                    if units > self.usage.get(token, 0):
+                        self.usage[token] = units
+                data = {"day": self.day, "usage": dict(self.usage)}
+            tmp_file = f"{self.path}.tmp"
+            try:
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2)
+                os.replace(tmp_file, self.path)
+            except Exception as e:
+                print(f"⚠️ Không ghi được {self.path}: {e}")
+                with self.lock:
+                    self._dirty = True
+            self._last_save = time.time()
+
+
 class TokenRotator:
     """
     Vòng quay token: luôn trả về token hiện tại, nếu lỗi thì gọi next()
     để lấy token kế tiếp. Khi đã thử hết, reset vòng quay và đi tiếp.
+    Mỗi lần gọi API được charge() theo chi phí quota; token hết quota bị bỏ qua,
+    next() chọn token còn nhiều quota nhất.
     """
 
-    def __init__(self, tokens: list[str], start_index: int = 0):
+    def __init__(self, tokens: list[str], start_index: int = 0,
+                 daily_quota: int = DAILY_QUOTA, ledger: QuotaLedger = None):
         if not tokens:
             raise ValueError("Danh sách token rỗng")
         self.tokens = tokens
         self.index = start_index % len(tokens)
         self.used = set()
+        self.daily_quota = daily_quota
+        self.ledger = ledger or QuotaLedger.shared()
+
+    def remaining(self, token: str) -> int:
+        return self.daily_quota - self.ledger.used(token)
+
+    def all_exhausted(self) -> bool:
+        return all(self.remaining(t) <= 0 for t in self.tokens)
 
     def current(self) -> str:
-        return self.tokens[self.index]
+        token = self.tokens[self.index]
+        if self.remaining(token) <= 0 and not self.all_exhausted():
+            return self.next()
+        return token
+
+    def charge(self, token: str, units: int):
+        """Ghi nhận quota đã dùng cho token"""
+        self.ledger.charge(token, units)
+
+    def mark_exhausted(self, token: str):
+        """Token bị 403 quotaExceeded: coi như đã dùng hết quota hôm nay"""
+        self.ledger.set_used(token, self.daily_quota)
 
     def next(self) -> str:
         self.used.add(self.index)
 
-        # tìm token tiếp theo chưa dùng trong vòng hiện tại
-        for step in range(1, len(self.tokens) + 1):
-            candidate = (self.index + step) % len(self.tokens)
-            if candidate not in self.used:
-                self.index = candidate
+        # chọn token chưa dùng trong vòng hiện tại và còn nhiều quota nhất
+        candidates = [i for i in range(len(self.tokens)) if i not in self.used]
+        if candidates:
+            best = max(candidates, key=lambda i: self.remaining(self.tokens[i]))
+            if self.remaining(self.tokens[best]) > 0:
+                self.index = best
                 return self.tokens[self.index]
 
-        # tất cả token đã được thử, reset vòng quay về đầu (index 0)
+        # tất cả token đã được thử (hoặc hết quota), reset vòng quay
+        # và lấy token còn nhiều quota nhất
         self.used.clear()
-        self.index = 0
+        self.index = max(range(len(self.tokens)), key=lambda i: self.remaining(self.tokens[i]))
         self.used.add(self.index)
-        return self.tokens[self.index]
\ No newline at end of file
+        return self.tokens[self.index]
@@ -0,0 +1,80 @@
+"""
+Cache kết quả download/edit đã xong theo key request: chỉ hết hạn theo TTL
+Chỉ là chỉ mục (key -> kết quả), KHÔNG xóa file và KHÔNG có byte budget / LRU / pin riêng.
+Các phần đó đã chuyển hẳn sang DiskManager (utils/disk_manager.py), tránh 2 nơi cùng xóa
+1 file đang được stream / upload:
+- byte budget: DISK_BUDGET / disk_budget_gb cho cả thư mục Downloads
+- LRU: xóa artifact lâu không dùng nhất trước (theo mtime, DiskManager.touch() khi dùng lại)
+- pin: artifact vừa dùng trong PROTECT_SECONDS không bị xóa
+Entry trỏ tới file đã bị DiskManager xóa sẽ tự bỏ khỏi chỉ mục ở lần get() kế tiếp
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_TTL = 30 * 60                   # Kết quả dùng lại tối đa 30 phút
+
+
+class ArtifactCache:
+    def __init__(self, ttl: float = CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> {path, size, created_at, last_access, value}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry["size"]
+
+    def get(self, key):
+        """Trả về value đã lưu, None nếu không có / hết hạn / file đã bị xóa"""
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if now - entry["created_at"] > self.ttl or not os.path.exists(entry["path"]):
+                # Chỉ bỏ khỏi chỉ mục, file (nếu còn) để DiskManager dọn
+                self._remove(key)
+                self.misses += 1
+                return None
+            entry["last_access"] = now
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, key, path: str, value):
+        with self.lock:
+            if key in self._entries:
+                self._remove(key)
+            size = os.path.getsize(path)
+            now = time.time()
+            self._entries[key] = {
+                "path": path,
+                "size": size,
+                "created_at": now,
+                "last_access": now,
+                "value": value,
+            }
+            self.total_bytes += size
+
+    def cleanup(self):
+        """Gọi định kỳ để bỏ kết quả hết hạn / file đã bị DiskManager xóa khỏi chỉ mục"""
+        with self.lock:
+            now = time.time()
+            for key in [k for k, e in self._entries.items()
+                        if now - e["created_at"] > self.ttl or not os.path.exists(e["path"])]:
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,90 @@
+"""
+Đọc segment index (sidx) của stream adaptive (DASH / fragmented MP4) của YouTube:
+    ftyp | moov | sidx | moof mdat | moof mdat | ...
+sidx ghi byte range + thời lượng từng fragment -> chỉ cần tải phần đầu file
+(init + các fragment đầu) là đủ N giây đầu, không phải tải cả video rồi cắt
+"""
+import struct
+
+HEAD_SIZE = 64 * 1024   # ftyp + moov + sidx của YouTube thường chỉ vài KB
+
+
+def _find_sidx(head: bytes):
+    """(offset, size) của box sidx top-level, None nếu gặp media (moof / mdat) trước"""
+    pos = 0
+    while pos + 8 <= len(head):
+        size, kind = struct.unpack_from(">I4s", head, pos)
+        if size == 1:
+            if pos + 16 > len(head):
+                return None
+            size = struct.unpack_from(">Q", head, pos + 8)[0]
+        if kind == b"sidx":
+            return pos, size
+        if kind in (b"moof", b"mdat") or size < 8:
+            return None
+        pos += size
+    return None
+
+
+def sidx_end(head: bytes):
+    """Số byte đầu file cần có để đọc hết sidx (có thể > len(head)), None nếu không có sidx"""
+    found = _find_sidx(head)
+    return found[0] + found[1] if found else None
+
+
+def parse_sidx(head: bytes):
+    """
+    Danh sách fragment: (byte_start, byte_end, start_time, duration) - byte_end không tính, thời gian theo giây
+    None nếu không có sidx / sidx phân cấp (trỏ tới sidx khác)
+    """
+    found = _find_sidx(head)
+    if not found:
+        return None
+    offset, box_size = found
+    header = 16 if struct.unpack_from(">I", head, offset)[0] == 1 else 8
+    pos = offset + header
+    version = head[pos]
+    pos += 4 + 4   # version + flags, reference_ID
+    timescale = struct.unpack_from(">I", head, pos)[0]
+    pos += 4
+    if version == 0:
+        earliest, first_offset = struct.unpack_from(">II", head, pos)
+        pos += 8
+    else:
+        earliest, first_offset = struct.unpack_from(">QQ", head, pos)
+        pos += 16
+    count = struct.unpack_from(">H", head, pos + 2)[0]
+    pos += 4
+    if not timescale:
+        return None
+
+    # Fragment đầu nằm ngay sau sidx (+ first_offset)
+    start = offset + box_size + first_offset
+    elapsed = earliest / timescale
+    fragments = []
+    for _ in range(count):
+        reference, duration, _ = struct.unpack_from(">III", head, pos)
+        pos += 12
+        if reference >> 31:
+            return None
+        length = reference & 0x7FFFFFFF
+        fragments.append((start, start + length, elapsed, duration / timescale))
+        start += length
+        elapsed += duration / timescale
+    return fragments
+
+
+def partial_size(head: bytes, seconds: float):
+    """
+    Số byte đầu file cần tải để có đủ `seconds` giây đầu (init + mọi fragment bắt đầu trước `seconds`)
+    None nếu không xác định được (không có sidx) -> tải toàn bộ
+    """
+    fragments = parse_sidx(head)
+    if not fragments:
+        return None
+    end = fragments[0][0]
+    for start, stop, start_time, _ in fragments:
+        if start_time >= seconds:
+            break
+        end = stop
+    return end
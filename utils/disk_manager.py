@@ -0,0 +1,230 @@
+"""
+Quản lý dung lượng thư mục Downloads (dùng chung cho youtube_downloader, video_editor, API server):
+- Giới hạn tổng dung lượng: vượt budget thì xóa thư mục {video_id}-{format} dùng lâu nhất trước (LRU)
+- Dọn file mồ côi do lần chạy lỗi để lại: Downloads/.tmp/*, file tạm của downloader / editor
+  (*.tmp.mp4, *.fifo, *.part...), manifest trỏ tới file đã mất, thư mục rỗng.
+  Chỉ xóa đúng các mẫu file tạm này: file hoàn chỉnh (kể cả không có manifest, VD: output _65s
+  còn lại sau khi file gốc bị evict) chỉ bị xóa qua budget LRU
+- Báo cáo dung lượng đang dùng
+"Dùng" = tạo / đọc lại artifact (touch() cập nhật mtime của file + manifest)
+"""
+import os
+import shutil
+import threading
+import time
+
+from utils import media_store
+
+DISK_BUDGET = 20 * 1024 ** 3   # Mặc định 20 GB cho cả thư mục Downloads
+ORPHAN_AGE = 30 * 60           # File tạm không đổi trong 30 phút -> coi như của process đã chết
+PROTECT_SECONDS = 10 * 60      # Artifact vừa dùng (có thể đang upload) thì không xóa
+SWEEP_INTERVAL = 10 * 60       # maintain() dọn định kỳ tối đa 10 phút / lần
+
+TEMP_SUFFIXES = (".fifo", ".tmp.mp4", ".audio.mp4", ".part")
+
+_managers = {}   # abspath root -> DiskManager
+_managers_lock = threading.Lock()
+
+
+def get_manager(root: str, budget_bytes: int = DISK_BUDGET):
+    """DiskManager dùng chung cho 1 thư mục (tạo 1 lần / process)"""
+    root = os.path.abspath(root)
+    with _managers_lock:
+        manager = _managers.get(root)
+        if manager is None:
+            manager = DiskManager(root, budget_bytes)
+            _managers[root] = manager
+        return manager
+
+
+def manager_for(path: str):
+    """DiskManager đang quản lý thư mục chứa path (None nếu path nằm ngoài các thư mục đã đăng ký)"""
+    path = os.path.abspath(path)
+    with _managers_lock:
+        for root, manager in _managers.items():
+            if path.startswith(root + os.sep):
+                return manager
+    return None
+
+
+def temp_output(output_file: str) -> str:
+    """Tên file tạm cạnh output (giữ đuôi .mp4 cho ffmpeg), xong thì os.replace sang output"""
+    base = os.path.splitext(output_file)[0]
+    return f"{base}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+
+
+def _tree_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class DiskManager:
+    def __init__(self, root: str, budget_bytes: int = DISK_BUDGET,
+                 orphan_age: float = ORPHAN_AGE, protect_seconds: float = PROTECT_SECONDS):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.orphan_age = orphan_age
+        self.protect_seconds = protect_seconds
+        self.lock = threading.Lock()
+        self.last_sweep = 0.0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.swept = 0
+        self.swept_bytes = 0
+
+    # -----------------------
+    # Artifact
+    # -----------------------
+    def _artifact_dirs(self):
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return []
+        return [e for e in entries if e.is_dir() and e.name != media_store.TMP_DIR]
+
+    def _last_used(self, directory: str) -> float:
+        # Theo mtime của file (mtime thư mục đổi cả khi sweep xóa file tạm bên trong)
+        mtimes = [e.stat().st_mtime for e in os.scandir(directory) if e.is_file()]
+        return max(mtimes) if mtimes else os.path.getmtime(directory)
+
+    def touch(self, path: str):
+        """Đánh dấu artifact chứa path vừa được dùng (LRU): cập nhật mtime file + manifest"""
+        manifest = os.path.join(os.path.dirname(path), media_store.MANIFEST_FILE)
+        for target in (path, manifest):
+            try:
+                os.utime(target)
+            except OSError:
+                pass
+
+    def enforce_budget(self):
+        """Xóa artifact dùng lâu nhất tới khi tổng dung lượng <= budget"""
+        with self.lock:
+            dirs = []
+            for entry in self._artifact_dirs():
+                try:
+                    dirs.append((self._last_used(entry.path), _tree_size(entry.path), entry.path))
+                except OSError:
+                    continue
+            total = sum(size for _, size, _ in dirs) + _tree_size(os.path.join(self.root, media_store.TMP_DIR))
+            if total <= self.budget_bytes:
+                return 0
+
+            now = time.time()
+            freed = 0
+            for last_used, size, path in sorted(dirs):
+                if total - freed <= self.budget_bytes:
+                    break
+                if now - last_used < self.protect_seconds:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                freed += size
+                self.evicted += 1
+                self.evicted_bytes += size
+                print(f"🧹 Disk budget: xóa {os.path.basename(path)} ({size / 1024 / 1024:.1f} MB)")
+            if total - freed > self.budget_bytes:
+                print(f"⚠️ Downloads vẫn vượt budget ({(total - freed) / 1024 ** 3:.2f} GB), "
+                      f"các file còn lại đang được dùng")
+            return freed
+
+    # -----------------------
+    # File mồ côi
+    # -----------------------
+    def _remove_if_old(self, path: str, now: float, max_age: float) -> int:
+        try:
+            stat = os.stat(path)
+            if now - stat.st_mtime < max_age:
+                return 0
+            os.remove(path)
+        except OSError:
+            return 0
+        self.swept += 1
+        self.swept_bytes += stat.st_size
+        return stat.st_size
+
+    def sweep_orphans(self, max_age: float = None):
+        """Xóa file tạm / file dở không được cập nhật trong max_age giây. Returns: số bytes đã xóa"""
+        max_age = self.orphan_age if max_age is None else max_age
+        now = time.time()
+        freed = 0
+        with self.lock:
+            if not os.path.isdir(self.root):
+                return 0
+            # Downloads/.tmp: file đang tải / đang merge
+            tmp_dir = os.path.join(self.root, media_store.TMP_DIR)
+            if os.path.isdir(tmp_dir):
+                for entry in os.scandir(tmp_dir):
+                    freed += self._remove_if_old(entry.path, now, max_age)
+
+            for entry in os.scandir(self.root):
+                if entry.is_file():
+                    # Gốc Downloads có thể chứa file của người dùng / bản tải cũ -> chỉ xóa file tạm
+                    if entry.name.endswith(TEMP_SUFFIXES):
+                        freed += self._remove_if_old(entry.path, now, max_age)
+                elif entry.is_dir() and entry.name != media_store.TMP_DIR:
+                    freed += self._sweep_artifact_dir(entry.path, now, max_age)
+
+            self.last_sweep = now
+        if freed:
+            print(f"🧹 Dọn file mồ côi trong {self.root}: {freed / 1024 / 1024:.1f} MB")
+        return freed
+
+    def _sweep_artifact_dir(self, directory: str, now: float, max_age: float) -> int:
+        freed = 0
+        manifest = media_store.read_manifest(directory)
+        for name in os.listdir(directory):
+            if name.endswith(TEMP_SUFFIXES):
+                freed += self._remove_if_old(os.path.join(directory, name), now, max_age)
+
+        # Manifest trỏ tới file đã bị xóa (VD: file gốc bị xóa sau khi edit) -> bỏ manifest
+        if manifest and not os.path.exists(os.path.join(directory, manifest.get("file", ""))):
+            freed += self._remove_if_old(os.path.join(directory, media_store.MANIFEST_FILE), now, max_age)
+
+        try:
+            if not os.listdir(directory):
+                os.rmdir(directory)
+        except OSError:
+            pass
+        return freed
+
+    # -----------------------
+    # Định kỳ + báo cáo
+    # -----------------------
+    def maintain(self, force: bool = False):
+        """Gọi sau mỗi lần ghi file: kiểm tra budget, dọn file mồ côi tối đa SWEEP_INTERVAL / lần"""
+        if force or time.time() - self.last_sweep >= SWEEP_INTERVAL:
+            self.sweep_orphans()
+        self.enforce_budget()
+
+    def usage(self):
+        artifacts = self._artifact_dirs()
+        artifact_bytes = sum(_tree_size(e.path) for e in artifacts)
+        temp_bytes = _tree_size(os.path.join(self.root, media_store.TMP_DIR))
+        other_bytes = 0
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                if entry.is_file():
+                    other_bytes += entry.stat().st_size
+        try:
+            free_bytes = shutil.disk_usage(self.root).free
+        except OSError:
+            free_bytes = None
+        return {
+            "root": self.root,
+            "total_bytes": artifact_bytes + temp_bytes + other_bytes,
+            "budget_bytes": self.budget_bytes,
+            "artifacts": len(artifacts),
+            "artifact_bytes": artifact_bytes,
+            "temp_bytes": temp_bytes,
+            "other_bytes": other_bytes,
+            "disk_free_bytes": free_bytes,
+            "evicted": self.evicted,
+            "evicted_bytes": self.evicted_bytes,
+            "swept": self.swept,
+            "swept_bytes": self.swept_bytes,
+        }
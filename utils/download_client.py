@@ -8,6 +8,85 @@ class DownloadAPIClient:
     def __init__(self, base_url: str = "http://localhost:8000"):
         self.base_url = base_url
     
+    def prepare_video(
+        self,
+        url: str,
+        max_resolution: int = 720,
+        progressive_only: bool = False,
+        edit_65s: bool = False,
+        start_download: bool = True
+    ) -> Optional[Dict]:
+        """
+        Báo server resolve stream (và tải trước nếu start_download) ngay khi phát hiện video.
+        Gọi download_video() sau đó với cùng tham số sẽ chờ chung job / lấy từ cache.
+        """
+        try:
+            response = requests.post(
+                f"{self.base_url}/prepare",
+                json={
+                    "url": url,
+                    "max_resolution": max_resolution,
+                    "progressive_only": progressive_only,
+                    "edit_65s": edit_65s,
+                    "start_download": start_download
+                },
+                timeout=60
+            )
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"❌ API Error: {e}")
+            return {"success": False, "error": str(e)}
+
+    def submit_job(
+        self,
+        url: str,
+        max_resolution: int = 720,
+        progressive_only: bool = False,
+        edit_65s: bool = False,
+        priority: int = 0
+    ) -> Optional[Dict]:
+        """
+        Đưa download vào hàng đợi của server, trả về ngay dict có job_id + status
+        priority cao hơn chạy trước (VD: video mới 10, tải bù 0)
+        """
+        try:
+            response = requests.post(
+                f"{self.base_url}/jobs",
+                json={
+                    "url": url,
+                    "max_resolution": max_resolution,
+                    "progressive_only": progressive_only,
+                    "edit_65s": edit_65s,
+                    "priority": priority
+                },
+                timeout=30
+            )
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"❌ API Error: {e}")
+            return {"status": "failed", "error": str(e), "result": None}
+
+    def get_job(self, job_id: str, wait: float = 0) -> Optional[Dict]:
+        """Trạng thái job; wait > 0 thì server giữ request tới khi job xong (tối đa wait giây)"""
+        try:
+            response = requests.get(f"{self.base_url}/jobs/{job_id}", params={"wait": wait}, timeout=wait + 30)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"❌ API Error: {e}")
+            return None
+
+    def cancel_job(self, job_id: str) -> Optional[Dict]:
+        try:
+            response = requests.delete(f"{self.base_url}/jobs/{job_id}", timeout=30)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"❌ API Error: {e}")
+            return None
+
     def download_video(
         self,
         url: str,
@@ -0,0 +1,148 @@
+"""
+Đo thời gian từng pha của 1 lần download (để biết nên tối ưu chỗ nào):
+    phases:  youtube_init, title, streams (resolve), download, merge / mux, publish, edit...
+    streams: bytes, thời gian, TTFB, bytes/giây, thời gian ghi đĩa của từng stream
+MetricsAggregator gộp nhiều lần download thành percentile (dùng cho /stats của API server)
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PERCENTILES = (50, 90, 99)
+
+
+class StreamStats:
+    """Số liệu của 1 stream, an toàn khi nhiều thread (kết nối ranged) cùng cập nhật"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.first_byte = None
+        self.finished = None
+        self.bytes = 0
+        self.write_time = 0.0
+
+    def on_data(self, size: int, write_time: float = 0.0):
+        with self.lock:
+            if self.first_byte is None:
+                self.first_byte = time.perf_counter()
+            self.bytes += size
+            self.write_time += write_time
+
+    def finish(self, size: int = None):
+        """size: tổng bytes thực tế (khi stream được tải bằng pytubefix, không qua on_data)"""
+        with self.lock:
+            self.finished = time.perf_counter()
+            if size is not None:
+                self.bytes = size
+
+    def to_dict(self):
+        seconds = (self.finished or time.perf_counter()) - self.started
+        return {
+            "bytes": self.bytes,
+            "seconds": round(seconds, 3),
+            "ttfb": round(self.first_byte - self.started, 3) if self.first_byte else None,
+            "bytes_per_sec": round(self.bytes / seconds) if seconds > 0 else None,
+            "write_time": round(self.write_time, 3),
+        }
+
+
+class DownloadMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.phases = {}    # tên pha -> giây
+        self.streams = {}   # "video" / "audio" / "progressive" -> StreamStats
+        self.info = {}      # mode, resolve_cached, reused_file, size...
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def stream(self, name: str) -> StreamStats:
+        stats = StreamStats()
+        self.streams[name] = stats
+        return stats
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def to_dict(self):
+        phases = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        streams = {name: stats.to_dict() for name, stats in self.streams.items()}
+        if streams:
+            # Thời gian ghi đĩa khi tải (đã nằm trong pha download)
+            phases["disk_write"] = round(sum(s["write_time"] for s in streams.values()), 3)
+        return {
+            "total": round((self.finished or time.perf_counter()) - self.started, 3),
+            "phases": phases,
+            "streams": streams,
+            **self.info,
+        }
+
+
+def format_metrics(metrics: dict) -> str:
+    """1 dòng tóm tắt cho log: pha + tốc độ từng stream"""
+    parts = [f"{name} {seconds:.2f}s" for name, seconds in metrics.get("phases", {}).items()]
+    for name, stream in metrics.get("streams", {}).items():
+        rate = (stream["bytes_per_sec"] or 0) / 1024 / 1024
+        ttfb = f" ttfb {stream['ttfb']:.2f}s" if stream["ttfb"] is not None else ""
+        parts.append(f"{name} {rate:.1f} MB/s{ttfb}")
+    return " | ".join(parts)
+
+
+def _flatten(metrics: dict, prefix=""):
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def _percentile(values, p):
+    """Nearest-rank percentile trên list đã sort"""
+    index = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+class MetricsAggregator:
+    """Giữ metrics của max_samples lần download gần nhất, trả về percentile từng chỉ số"""
+
+    def __init__(self, max_samples: int = 1000):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+
+    def add(self, metrics: dict):
+        with self.lock:
+            self.samples.append(dict(_flatten(metrics)))
+            self.count += 1
+
+    def summary(self):
+        with self.lock:
+            samples = list(self.samples)
+            count = self.count
+
+        values = {}
+        for sample in samples:
+            for name, value in sample.items():
+                values.setdefault(name, []).append(value)
+
+        stats = {}
+        for name in sorted(values):
+            data = sorted(values[name])
+            stats[name] = {
+                "count": len(data),
+                **{f"p{p}": _percentile(data, p) for p in PERCENTILES},
+                "max": data[-1],
+            }
+        return {"downloads": count, "window": len(samples), "metrics": stats}
@@ -0,0 +1,160 @@
+"""
+Hàng đợi job cho download_api_server:
+- PrioritySlots: giới hạn số job chạy cùng lúc trên 1 loại tài nguyên (mạng / CPU ffmpeg),
+  job priority cao hơn được cấp slot trước, cùng priority thì ai đến trước được trước
+- Job: trạng thái 1 job  queued -> downloading -> (waiting_edit -> editing) -> done / failed / cancelled
+- JobRegistry: tra job theo id / theo key request, dọn job đã xong sau JOB_TTL
+"""
+import asyncio
+import heapq
+import itertools
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from utils.download_metrics import MetricsAggregator
+
+JOB_TTL = 60 * 60   # Job đã xong giữ lại 1 giờ để client lấy kết quả
+FINISHED = ("done", "failed", "cancelled")
+
+
+class PrioritySlots:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.active = 0
+        self._waiters = []               # heap (-priority, seq, future)
+        self._seq = itertools.count()
+        self.wait_stats = MetricsAggregator()
+
+    @property
+    def depth(self) -> int:
+        """Số job đang chờ slot (1 future có thể nằm 2 lần trong heap sau khi tăng priority)"""
+        return len({id(f) for _, _, f in self._waiters if not f.done()})
+
+    async def acquire(self, priority: int = 0, job=None) -> float:
+        """Chờ tới lượt, trả về số giây đã chờ"""
+        if self.active < self.limit and not self.depth:
+            self.active += 1
+            self.wait_stats.add({"wait": 0.0})
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._seq), future))
+        if job is not None:
+            job.waiting = (self, future)
+        start = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Slot vừa được giao đúng lúc task bị hủy -> trả lại cho job kế tiếp
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            if job is not None:
+                job.waiting = None
+        waited = time.monotonic() - start
+        self.wait_stats.add({"wait": waited})
+        return waited
+
+    def requeue(self, future, priority: int):
+        """Job đang chờ được tăng priority: thêm entry mới, entry cũ bị bỏ qua khi tới lượt"""
+        if not future.done():
+            heapq.heappush(self._waiters, (-priority, next(self._seq), future))
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # Chuyển slot thẳng cho job đó (active giữ nguyên)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = 0, job=None):
+        waited = await self.acquire(priority, job)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def stats(self):
+        wait = self.wait_stats.summary()["metrics"].get("wait", {})
+        return {"limit": self.limit, "active": self.active, "queued": self.depth, "wait": wait}
+
+
+class Job:
+    def __init__(self, key, request, priority: int = 0):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.request = request
+        self.priority = priority
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.wait_time = 0.0
+        self.result = None
+        self.task = None
+        self.waiting = None   # (PrioritySlots, future) khi đang chờ slot
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def bump(self, priority: int):
+        """Request trùng có priority cao hơn (VD: video mới của channel nhanh) -> job chạy sớm hơn"""
+        if priority <= self.priority:
+            return
+        self.priority = priority
+        if self.waiting:
+            slots, future = self.waiting
+            slots.requeue(future, priority)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "video_id": self.key[0],
+            "status": self.status,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "wait_time": round(self.wait_time, 3),
+        }
+
+
+class JobRegistry:
+    def __init__(self, ttl: float = JOB_TTL):
+        self.ttl = ttl
+        self.jobs = {}     # job_id -> Job
+        self.active = {}   # key request -> Job chưa xong (request trùng dùng chung)
+
+    def add(self, job: Job):
+        self.jobs[job.id] = job
+        if not job.finished:
+            self.active[job.key] = job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def find_active(self, key):
+        return self.active.get(key)
+
+    def finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        if self.active.get(job.key) is job:
+            del self.active[job.key]
+
+    def cleanup(self):
+        now = time.time()
+        for job_id in [i for i, j in self.jobs.items() if j.finished and now - j.finished_at > self.ttl]:
+            del self.jobs[job_id]
+
+    def stats(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"jobs": counts, "active": len(self.active)}
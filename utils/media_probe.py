@@ -0,0 +1,340 @@
+"""
+Đọc thông tin file video (độ dài...) - cache theo (đường dẫn, size, mtime) nên mỗi file chỉ probe 1 lần
+Thứ tự thử:
+    1. Đọc box moov/mvhd của MP4 bằng Python (không cần chạy process nào, chỉ đọc vài KB)
+    2. ffprobe -print_format json
+    3. ffmpeg -i (parse dòng "Duration: HH:MM:SS.xx" trong stderr) khi không có ffprobe
+video_track(): codec + thời điểm các keyframe của track video (moov/trak/.../stss, fallback ffprobe)
+"""
+import json
+import os
+import re
+import struct
+import subprocess
+import threading
+
+CACHE_SIZE = 1024
+PROBE_TIMEOUT = 10
+
+_cache = {}   # (kind, abspath, size, mtime_ns) -> dict
+_cache_lock = threading.Lock()
+
+# Mã codec trong stsd -> tên codec giống ffprobe
+MP4_CODECS = {b"avc1": "h264", b"avc3": "h264", b"hvc1": "hevc", b"hev1": "hevc", b"vp09": "vp9", b"av01": "av1"}
+
+
+def _bin_path(name: str) -> str:
+    """bin/{name}.exe của project (giống video_editor.get_ffmpeg_path), không có thì dùng PATH"""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    path = os.path.join(project_root, "bin", f"{name}.exe")
+    return path if os.path.exists(path) else name
+
+
+# -----------------------
+# MP4: moov/mvhd
+# -----------------------
+def _boxes(f, start: int, end: int):
+    """Duyệt các box trong khoảng [start, end): yield (type, data_start, box_end)"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size:
+            return
+        yield kind, pos + header_size, pos + size
+        pos += size
+
+
+def probe_mp4(path: str):
+    """Độ dài (giây) từ mvhd, None nếu không phải MP4 / không có moov / duration = 0 (fragmented)"""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        for kind, start, end in _boxes(f, 0, file_size):
+            if kind != b"moov":
+                continue
+            for child, child_start, _ in _boxes(f, start, end):
+                if child != b"mvhd":
+                    continue
+                f.seek(child_start)
+                version = f.read(4)[0]
+                if version == 1:
+                    f.seek(16, os.SEEK_CUR)  # creation_time + modification_time (8 + 8)
+                    timescale, duration = struct.unpack(">IQ", f.read(12))
+                else:
+                    f.seek(8, os.SEEK_CUR)   # creation_time + modification_time (4 + 4)
+                    timescale, duration = struct.unpack(">II", f.read(8))
+                if timescale and duration and duration != 0xFFFFFFFF:
+                    return {"duration": duration / timescale, "source": "mp4"}
+                return None
+    return None
+
+
+def _child(f, start: int, end: int, *path):
+    """Box con theo đường dẫn (VD: b"mdia", b"minf"), trả về (data_start, box_end) hoặc None"""
+    for name in path:
+        for kind, child_start, child_end in _boxes(f, start, end):
+            if kind == name:
+                start, end = child_start, child_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _read_table(f, box, fmt: str, header: int = 4):
+    """Bảng trong stts / stss / ctts / elst: version+flags, 4 bytes số entry, rồi các entry"""
+    f.seek(box[0] + header)
+    count = struct.unpack(">I", f.read(4))[0]
+    size = struct.calcsize(fmt)
+    data = f.read(count * size)
+    return list(struct.iter_unpack(fmt, data[:len(data) - len(data) % size]))
+
+
+def _at_samples(table, samples, cumulative: bool):
+    """
+    Bảng run-length (count, value) -> giá trị tại các sample (số từ 1, tăng dần)
+    cumulative: cộng dồn value (stts -> dts), ngược lại lấy value của run chứa sample (ctts)
+    """
+    values = []
+    first, total, i = 1, 0, 0
+    for count, value in table:
+        while i < len(samples) and samples[i] < first + count:
+            values.append(total + (samples[i] - first) * value if cumulative else value)
+            i += 1
+        first += count
+        total += count * value
+    # Sample nằm ngoài bảng (file lỗi): coi như value cuối
+    values += [total if cumulative else 0] * (len(samples) - i)
+    return values
+
+
+def _movie_timescale(f, moov):
+    mvhd = _child(f, *moov, b"mvhd")
+    if not mvhd:
+        return 0
+    f.seek(mvhd[0])
+    version = f.read(4)[0]
+    f.seek(16 if version == 1 else 8, os.SEEK_CUR)
+    return struct.unpack(">I", f.read(4))[0]
+
+
+def _edit_offset(f, trak, timescale: int, movie_timescale: int) -> float:
+    """Độ lệch (giây) giữa thời gian trong track và thời gian hiển thị theo edit list (elst)"""
+    elst = _child(f, *trak, b"edts", b"elst")
+    if not elst:
+        return 0.0
+    f.seek(elst[0])
+    version = f.read(1)[0]
+    entries = _read_table(f, elst, ">Qqhh" if version == 1 else ">Iihh")
+    offset = 0.0
+    for segment_duration, media_time, _, _ in entries:
+        if media_time == -1:
+            # Edit rỗng: track bắt đầu hiển thị trễ segment_duration
+            offset += segment_duration / movie_timescale if movie_timescale else 0
+            continue
+        return offset - media_time / timescale
+    return offset
+
+
+def video_track_mp4(path: str):
+    """
+    Track video đầu tiên của MP4: {codec, keyframes, keyframe_packets}
+        keyframes: thời điểm hiển thị (giây) của các keyframe
+        keyframe_packets: số packet đứng trước mỗi keyframe (thứ tự decode)
+    keyframes = None nếu không có stss (mọi frame đều là keyframe)
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        moov = _child(f, 0, file_size, b"moov")
+        if not moov:
+            return None
+        for kind, start, end in _boxes(f, *moov):
+            if kind != b"trak":
+                continue
+            hdlr = _child(f, start, end, b"mdia", b"hdlr")
+            if not hdlr:
+                continue
+            f.seek(hdlr[0] + 8)
+            if f.read(4) != b"vide":
+                continue
+
+            mdhd = _child(f, start, end, b"mdia", b"mdhd")
+            stbl = _child(f, start, end, b"mdia", b"minf", b"stbl")
+            if not mdhd or not stbl:
+                return None
+            f.seek(mdhd[0])
+            version = f.read(4)[0]
+            f.seek(16 if version == 1 else 8, os.SEEK_CUR)
+            timescale = struct.unpack(">I", f.read(4))[0]
+
+            stsd = _child(f, *stbl, b"stsd")
+            codec = None
+            if stsd:
+                f.seek(stsd[0] + 12)   # version+flags, entry_count, size của entry đầu
+                fourcc = f.read(4)
+                codec = MP4_CODECS.get(fourcc, fourcc.decode("latin-1"))
+
+            stss = _child(f, *stbl, b"stss")
+            stts = _child(f, *stbl, b"stts")
+            if not stss or not stts or not timescale:
+                return {"codec": codec, "keyframes": None, "keyframe_packets": None, "source": "mp4"}
+
+            # pts = dts (cộng dồn stts) + composition offset (ctts, có khi có B-frame), dời theo edit list
+            sync_samples = [n for (n,) in _read_table(f, stss, ">I")]
+            dts = _at_samples(_read_table(f, stts, ">II"), sync_samples, cumulative=True)
+            ctts = _child(f, *stbl, b"ctts")
+            if ctts:
+                f.seek(ctts[0])
+                signed = f.read(1)[0] == 1
+                offsets = _at_samples(_read_table(f, ctts, ">Ii" if signed else ">II"), sync_samples, cumulative=False)
+            else:
+                offsets = [0] * len(sync_samples)
+            shift = _edit_offset(f, (start, end), timescale, _movie_timescale(f, moov))
+            return {
+                "codec": codec,
+                "keyframes": [max(0.0, (d + o) / timescale + shift) for d, o in zip(dts, offsets)],
+                "keyframe_packets": [n - 1 for n in sync_samples],
+                "source": "mp4",
+            }
+    return None
+
+
+# -----------------------
+# ffprobe / ffmpeg
+# -----------------------
+def probe_ffprobe(path: str):
+    command = [
+        _bin_path("ffprobe"),
+        "-v", "quiet",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        path
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    data = json.loads(result.stdout)
+    info = {"source": "ffprobe"}
+    duration = data.get("format", {}).get("duration")
+    if duration:
+        info["duration"] = float(duration)
+    for stream in data.get("streams", []):
+        kind = stream.get("codec_type")
+        if kind == "video" and "video_codec" not in info:
+            info["video_codec"] = stream.get("codec_name")
+            info["width"] = stream.get("width")
+            info["height"] = stream.get("height")
+        elif kind == "audio" and "audio_codec" not in info:
+            info["audio_codec"] = stream.get("codec_name")
+    return info if "duration" in info else None
+
+
+def video_track_ffprobe(path: str):
+    command = [
+        _bin_path("ffprobe"),
+        "-v", "quiet",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name:packet=pts_time,flags",
+        "-print_format", "json",
+        path
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, timeout=PROBE_TIMEOUT * 6)
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    data = json.loads(result.stdout)
+    streams = data.get("streams", [])
+    if not streams:
+        return None
+    # Packet theo thứ tự decode: vị trí trong list = số packet đứng trước
+    keyframes, keyframe_packets = [], []
+    for index, packet in enumerate(data.get("packets", [])):
+        if "K" in packet.get("flags", "") and packet.get("pts_time") not in (None, "N/A"):
+            keyframes.append(float(packet["pts_time"]))
+            keyframe_packets.append(index)
+    return {
+        "codec": streams[0].get("codec_name"),
+        "keyframes": keyframes,
+        "keyframe_packets": keyframe_packets,
+        "source": "ffprobe",
+    }
+
+
+def probe_ffmpeg(path: str):
+    """Chỉ có ffmpeg (bản đóng gói trong bin/): đọc độ dài từ stderr của `ffmpeg -i`"""
+    from utils.video_editor import get_ffmpeg_path
+    result = subprocess.run(
+        [get_ffmpeg_path(), "-hide_banner", "-i", path],
+        capture_output=True, text=True, timeout=PROBE_TIMEOUT
+    )
+    match = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return {"duration": int(hours) * 3600 + int(minutes) * 60 + float(seconds), "source": "ffmpeg"}
+
+
+# -----------------------
+# API
+# -----------------------
+def _cached(kind: str, path: str, probe_funcs):
+    """Kết quả probe đầu tiên khác None, cache theo path + size + mtime"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (kind, os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        if key in _cache:
+            return _cache[key]
+
+    info = None
+    for probe_func in probe_funcs:
+        try:
+            info = probe_func(path)
+        except FileNotFoundError:
+            continue  # Không có ffprobe / ffmpeg
+        except Exception as e:
+            print(f"⚠️ {probe_func.__name__} lỗi với {os.path.basename(path)}: {e}")
+            continue
+        if info:
+            break
+    if info:
+        info["size"] = stat.st_size
+
+    with _cache_lock:
+        if len(_cache) >= CACHE_SIZE:
+            _cache.clear()
+        _cache[key] = info
+    return info
+
+
+def probe(path: str):
+    """
+    Thông tin file (cache theo path + size + mtime)
+    Returns: dict {duration, source, size, ...} hoặc None nếu không đọc được
+    """
+    return _cached("probe", path, (probe_mp4, probe_ffprobe, probe_ffmpeg))
+
+
+def video_track(path: str):
+    """
+    Track video: dict {codec, keyframes, keyframe_packets, source} hoặc None nếu không đọc được
+    keyframes: list thời điểm hiển thị (giây) tăng dần, None nếu mọi frame đều là keyframe
+    """
+    return _cached("video_track", path, (video_track_mp4, video_track_ffprobe))
+
+
+def get_duration(path: str):
+    """Độ dài video (giây), None nếu không xác định được"""
+    info = probe(path)
+    return info.get("duration") if info else None
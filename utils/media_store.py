@@ -0,0 +1,89 @@
+"""
+Lưu file download theo video_id + format (không đụng nhau khi tải song song):
+    Downloads/{video_id}-{format}/{title}.mp4       <- giữ tên theo title (dùng làm caption TikTok)
+    Downloads/{video_id}-{format}/manifest.json     <- size, duration, codec...
+    Downloads/.tmp/{uuid}.mp4                       <- file đang tải / đang merge
+File chỉ xuất hiện ở thư mục đích sau khi hoàn tất (os.replace là atomic).
+"""
+import json
+import os
+import time
+import uuid
+
+TMP_DIR = ".tmp"
+MANIFEST_FILE = "manifest.json"
+
+
+def format_key(*streams) -> str:
+    """VD: progressive itag 18 -> "18", adaptive 137 + 140 -> "137+140" """
+    return "+".join(str(s.itag) for s in streams if s is not None)
+
+
+def artifact_dir(download_path: str, video_id: str, fmt: str) -> str:
+    return os.path.join(download_path, f"{video_id}-{fmt}")
+
+
+def temp_path(download_path: str, suffix: str = ".mp4") -> str:
+    """Tên file tạm duy nhất trong Downloads/.tmp (cùng ổ đĩa với đích để os.replace atomic)"""
+    tmp_dir = os.path.join(download_path, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, f"{uuid.uuid4().hex}{suffix}")
+
+
+def read_manifest(directory: str):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def lookup(download_path: str, video_id: str, fmt: str):
+    """Trả về đường dẫn file đã tải xong (size khớp manifest), None nếu chưa có"""
+    directory = artifact_dir(download_path, video_id, fmt)
+    manifest = read_manifest(directory)
+    if not manifest:
+        return None
+    path = os.path.join(directory, manifest["file"])
+    try:
+        if os.path.getsize(path) == manifest["size"]:
+            return path
+    except OSError:
+        pass
+    return None
+
+
+def stream_info(video_stream, audio_stream=None) -> dict:
+    """Thông tin codec / resolution lấy sẵn từ stream (không cần ffprobe lại)"""
+    audio_stream = audio_stream or video_stream
+    return {
+        "resolution": video_stream.resolution,
+        "video_codec": video_stream.video_codec,
+        "audio_codec": audio_stream.audio_codec,
+    }
+
+
+def publish(tmp_file: str, download_path: str, video_id: str, fmt: str, filename: str, **info) -> str:
+    """
+    Chuyển file tạm vào thư mục đích + ghi manifest
+    info: thông tin thêm vào manifest (title, duration, codec...)
+    Returns: đường dẫn file cuối cùng
+    """
+    directory = artifact_dir(download_path, video_id, fmt)
+    os.makedirs(directory, exist_ok=True)
+    final_file = os.path.join(directory, filename)
+    os.replace(tmp_file, final_file)
+
+    manifest = {
+        "video_id": video_id,
+        "format": fmt,
+        "file": filename,
+        "size": os.path.getsize(final_file),
+        "created_at": time.time(),
+        **info,
+    }
+    tmp_manifest = temp_path(download_path, ".json")
+    with open(tmp_manifest, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_manifest, os.path.join(directory, MANIFEST_FILE))
+    return final_file
@@ -1,10 +1,29 @@
 """
 Video Editor - Cắt video 65s đầu tiên
 Sử dụng ffmpeg.exe từ thư mục bin để tương thích khi nén exe
+Mọi lệnh ffmpeg (edit, merge, stream mux) chạy qua ffmpeg_pool: giới hạn số process theo số core,
+job priority cao chạy trước, kill process treo quá FFMPEG_TIMEOUT, đo CPU time + wall time
 """
+import asyncio
+import contextlib
+import heapq
+import itertools
 import os
+import shutil
 import subprocess
+import threading
 import time
+from utils import disk_manager, media_probe
+from utils.download_metrics import MetricsAggregator
+
+FFMPEG_WORKERS = os.cpu_count() or 2   # ffmpeg -c copy chủ yếu tốn đĩa + 1 core / process
+FFMPEG_TIMEOUT = 5 * 60                # Process chạy quá 5 phút coi như treo -> kill
+
+# Smart-cut: copy tới keyframe cuối trước điểm cắt, chỉ encode lại đoạn GOP cuối
+SMART_CUT_CODECS = ("h264",)
+SMART_CUT_MIN_TAIL = 0.05   # Keyframe sát điểm cắt (< 50ms) thì cắt copy là đủ chính xác
+# repeat-headers: SPS/PPS của đoạn encode lại nằm trong bitstream, decoder đổi tham số đúng chỗ nối
+SMART_CUT_ENCODE = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-x264-params", "repeat-headers=1"]
 
 def get_ffmpeg_path():
     """Lấy đường dẫn ffmpeg.exe từ thư mục bin (giống chromedriver)"""
@@ -20,13 +39,294 @@ def get_ffmpeg_path():
     # Fallback: thử dùng ffmpeg từ PATH nếu không tìm thấy
     return "ffmpeg"
 
-def edit_video_to_65s(input_file, output_file=None, duration=65):
+def _cpu_time(process):
+    """Chờ process kết thúc, trả về CPU time (user + system, giây) của riêng process đó"""
+    if hasattr(os, "wait4"):
+        # POSIX: tự reap bằng wait4 để lấy rusage (Popen.wait() không trả về rusage)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return usage.ru_utime + usage.ru_stime
+
+    process.wait()
+    try:
+        # Windows: GetProcessTimes trên handle của process (Popen vẫn giữ handle sau khi wait)
+        import ctypes
+        from ctypes import wintypes
+        creation, exit_time, kernel, user = (wintypes.FILETIME() for _ in range(4))
+        ok = ctypes.windll.kernel32.GetProcessTimes(
+            wintypes.HANDLE(int(process._handle)),
+            ctypes.byref(creation), ctypes.byref(exit_time), ctypes.byref(kernel), ctypes.byref(user)
+        )
+        if not ok:
+            return None
+        # FILETIME: đơn vị 100ns
+        return sum(((t.dwHighDateTime << 32) | t.dwLowDateTime) / 1e7 for t in (kernel, user))
+    except Exception:
+        return None
+
+
+class FFmpegResult:
+    def __init__(self, returncode, stderr, wait_time, wall_time, cpu_time, timed_out):
+        self.returncode = returncode
+        self.stderr = stderr
+        self.wait_time = wait_time
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.timed_out = timed_out
+
+    def to_dict(self):
+        return {
+            "wait": round(self.wait_time, 3),
+            "wall": round(self.wall_time, 3),
+            "cpu": round(self.cpu_time, 3) if self.cpu_time is not None else None,
+        }
+
+
+class FFmpegPool:
+    """
+    Chạy ffmpeg với tối đa `limit` process cùng lúc (dùng từ nhiều thread).
+    Hết slot thì xếp hàng: priority cao trước, cùng priority thì ai đến trước chạy trước.
+    """
+
+    def __init__(self, limit: int = FFMPEG_WORKERS, timeout: float = FFMPEG_TIMEOUT):
+        self.limit = max(1, limit)
+        self.timeout = timeout
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self._queue = []   # heap (-priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.job_stats = MetricsAggregator()
+
+    def _acquire(self, priority: int) -> float:
+        ticket = (-priority, next(self._seq))
+        start = time.perf_counter()
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            while self.active >= self.limit or self._queue[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._queue)
+            self.active += 1
+            # Job kế tiếp trong hàng đợi có thể lấy slot còn trống ngay, không đợi _release
+            self._cond.notify_all()
+        return time.perf_counter() - start
+
+    def _release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, priority: int = 0):
+        """
+        Giữ 1 slot cho process ffmpeg tự quản lý (VD: stream mux đọc từ pipe), yield thời gian chờ
+        """
+        wait_time = self._acquire(priority)
+        try:
+            yield wait_time
+        finally:
+            self._release()
+
+    @contextlib.asynccontextmanager
+    async def async_slot(self, priority: int = 0):
+        """Như slot() cho code asyncio: chờ slot ở thread riêng, không block event loop"""
+        acquire = asyncio.ensure_future(asyncio.to_thread(self._acquire, priority))
+        try:
+            wait_time = await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # Thread vẫn sẽ lấy được slot sau khi bị hủy -> trả lại ngay khi lấy xong
+            acquire.add_done_callback(lambda f: f.cancelled() or f.exception() or self._release())
+            raise
+        try:
+            yield wait_time
+        finally:
+            self._release()
+
+    def run(self, command, priority: int = 0, timeout: float = None, check: bool = True) -> FFmpegResult:
+        """
+        Chạy 1 lệnh ffmpeg (stdout bỏ, stderr giữ lại để báo lỗi)
+        Raises: subprocess.TimeoutExpired (đã kill process), subprocess.CalledProcessError nếu check
+        """
+        timeout = timeout or self.timeout
+        wait_time = self._acquire(priority)
+        try:
+            start = time.perf_counter()
+            process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            timed_out = threading.Event()
+
+            def kill():
+                timed_out.set()
+                process.kill()
+
+            timer = threading.Timer(timeout, kill)
+            timer.daemon = True
+            timer.start()
+            # Đọc stderr ở thread riêng để ffmpeg không bị block khi pipe đầy
+            stderr = []
+            reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+            reader.start()
+            try:
+                cpu_time = _cpu_time(process)
+            finally:
+                timer.cancel()
+                reader.join()
+                process.stderr.close()
+            result = FFmpegResult(
+                process.returncode, stderr[0] if stderr else b"", wait_time,
+                time.perf_counter() - start, cpu_time, timed_out.is_set()
+            )
+        finally:
+            self._release()
+
+        self.job_stats.add(result.to_dict())
+        if result.timed_out:
+            self.timeouts += 1
+            print(f"⏱️ ffmpeg chạy quá {timeout}s, đã kill")
+            raise subprocess.TimeoutExpired(command, timeout, stderr=result.stderr)
+        if result.returncode != 0:
+            self.failed += 1
+            if check:
+                raise subprocess.CalledProcessError(result.returncode, command, stderr=result.stderr)
+        else:
+            self.completed += 1
+        return result
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._queue)
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            **self.job_stats.summary(),
+        }
+
+
+# Dùng chung cho cả process (API server, app, downloader)
+ffmpeg_pool = FFmpegPool()
+
+def _after_write(output_file):
+    """Output nằm trong thư mục Downloads đang được quản lý: đánh dấu vừa dùng + kiểm tra budget"""
+    manager = disk_manager.manager_for(output_file)
+    if manager:
+        manager.touch(output_file)
+        manager.maintain()
+
+def _place_unchanged(input_file, output_file, keep_input):
+    """Output giống hệt input: hardlink (cùng ổ đĩa) / đổi tên nếu không cần giữ input / copy"""
+    tmp_output = disk_manager.temp_output(output_file)
+    try:
+        os.link(input_file, tmp_output)
+        os.replace(tmp_output, output_file)
+        return
+    except OSError:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+    if not keep_input:
+        os.replace(input_file, output_file)
+        return
+    shutil.copy2(input_file, tmp_output)
+    os.replace(tmp_output, output_file)
+
+def _sum_stats(results):
+    """Cộng wait / wall / CPU của nhiều lần chạy ffmpeg (1 lần edit)"""
+    cpu = [r.cpu_time for r in results]
+    return {
+        "wait": round(sum(r.wait_time for r in results), 3),
+        "wall": round(sum(r.wall_time for r in results), 3),
+        "cpu": round(sum(cpu), 3) if None not in cpu else None,
+    }
+
+def _smart_cut_point(input_file, duration):
+    """
+    Keyframe cuối cùng trước điểm cắt nếu nên smart-cut: (thời điểm, số packet đứng trước)
+    None nếu cắt copy là đủ / không hỗ trợ
+    """
+    track = media_probe.video_track(input_file)
+    if not track or track["codec"] not in SMART_CUT_CODECS or not track["keyframes"]:
+        return None
+    candidates = [k for k in zip(track["keyframes"], track["keyframe_packets"]) if k[0] <= duration]
+    if not candidates:
+        return None
+    keyframe, packets = max(candidates)
+    # keyframe = 0: cả đoạn là 1 GOP, encode lại toàn bộ thì chậm -> cắt copy
+    if keyframe <= 0 or duration - keyframe < SMART_CUT_MIN_TAIL:
+        return None
+    return keyframe, packets
+
+def _smart_cut(input_file, tmp_output, duration, cut_point, priority=0):
+    """
+    Cắt chính xác tới `duration` mà không encode lại cả video:
+        1. copy video tới ngay trước keyframe (đếm theo packet: không lẫn frame của GOP sau)
+        2. encode lại video [keyframe, duration) (chỉ 1 GOP)
+        3. nối 2 đoạn (concat, copy) + audio gốc cắt đúng duration -> MP4
+    Returns: danh sách FFmpegResult của 3 lần chạy
+    """
+    keyframe, packets = cut_point
+    ffmpeg_path = get_ffmpeg_path()
+    # File tạm đuôi .part: nếu process chết giữa chừng, disk_manager dọn như file tải dở
+    work = os.path.splitext(tmp_output)[0]
+    head, tail, concat_list = f"{work}.head.part", f"{work}.tail.part", f"{work}.concat.part"
+    results = []
+    try:
+        results.append(ffmpeg_pool.run([
+            ffmpeg_path, "-y",
+            "-i", input_file,
+            "-map", "0:v:0",
+            "-frames:v", str(packets),  # Copy: đếm packet theo thứ tự decode
+            "-c", "copy",
+            "-f", "mp4", head
+        ], priority=priority))
+        results.append(ffmpeg_pool.run([
+            ffmpeg_path, "-y",
+            "-ss", f"{keyframe:.3f}",  # -ss trước -i + encode lại: bắt đầu đúng từ keyframe
+            "-i", input_file,
+            "-map", "0:v:0",
+            # Trừ 1ms: frame nằm đúng tại điểm cắt không bị lấy thừa do làm tròn
+            "-t", f"{duration - round(keyframe, 3) - 0.001:.3f}",
+            *SMART_CUT_ENCODE,
+            "-f", "mp4", tail
+        ], priority=priority))
+
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for part in (head, tail):
+                escaped = os.path.abspath(part).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        results.append(ffmpeg_pool.run([
+            ffmpeg_path, "-y",
+            "-f", "concat", "-safe", "0", "-i", concat_list,
+            "-i", input_file,
+            "-map", "0:v:0",
+            "-map", "1:a:0?",
+            "-t", str(duration),
+            "-c", "copy",
+            "-avoid_negative_ts", "make_zero",
+            tmp_output
+        ], priority=priority))
+        return results
+    finally:
+        for path in (head, tail, concat_list):
+            if os.path.exists(path):
+                os.remove(path)
+
+def edit_video_to_65s(input_file, output_file=None, duration=65, keep_input=True, priority=0, ffmpeg_stats=None,
+                      smart_cut=True):
     """
     Cắt video thành 65s đầu tiên (hoặc toàn bộ nếu video ngắn hơn)
     Args:
         input_file: Đường dẫn file video input
         output_file: Đường dẫn file output (nếu None thì ghi đè)
         duration: Độ dài video cần cắt (mặc định 65s)
+        keep_input: False nếu caller sẽ xóa input sau khi edit (cho phép đổi tên thay vì copy)
+        priority: thứ tự trong hàng đợi ffmpeg_pool (cao hơn chạy trước)
+        ffmpeg_stats: dict nhận thời gian chờ / wall / CPU của lần chạy ffmpeg
+        smart_cut: H.264 thì cắt chính xác (copy tới keyframe cuối + encode lại GOP cuối),
+                   lỗi / codec khác thì quay về cắt copy
     Returns:
         Đường dẫn file output hoặc None nếu lỗi
     """
@@ -35,43 +335,27 @@ def edit_video_to_65s(input_file, output_file=None, duration=65):
             print(f"❌ File không tồn tại: {input_file}")
             return None
         
-        # Kiểm tra độ dài video thực tế (tùy chọn - để tối ưu cho video ngắn)
-        # Nếu video ngắn hơn duration, chỉ cần copy file (nhanh hơn)
-        try:
-            import subprocess as sp
-            ffmpeg_path = get_ffmpeg_path()
-            probe_cmd = [
-                ffmpeg_path, "-i", input_file,
-                "-show_entries", "format=duration",
-                "-v", "quiet", "-of", "csv=p=0"
-            ]
-            result = sp.run(probe_cmd, capture_output=True, text=True, timeout=5)
-            if result.returncode == 0 and result.stdout.strip():
-                video_duration = float(result.stdout.strip())
-                # Nếu video ngắn hơn hoặc bằng duration, chỉ cần copy file
-                if video_duration <= duration:
-                    print(f"📹 Video chỉ có {video_duration:.1f}s, không cần cắt")
-                    # Copy file trực tiếp (nhanh nhất)
-                    import shutil
-                    if output_file is None:
-                        base_name = os.path.splitext(input_file)[0]
-                        ext = os.path.splitext(input_file)[1]
-                        output_file = f"{base_name}_65s{ext}"
-                    shutil.copy2(input_file, output_file)
-                    print(f"✅ Copy complete (no edit needed) | Size: {os.path.getsize(output_file) / (1024*1024):.2f} MB")
-                    return output_file
-        except:
-            pass  # Nếu không probe được thì cắt bình thường
-        
         # Nếu không có output_file, tạo tên mới
         if output_file is None:
             base_name = os.path.splitext(input_file)[0]
             ext = os.path.splitext(input_file)[1]
             output_file = f"{base_name}_65s{ext}"
         
+        # Video ngắn hơn hoặc bằng duration: không cần chạy ffmpeg
+        # (độ dài đọc từ moov/mvhd, cache theo file -> gần như không tốn gì)
+        video_duration = media_probe.get_duration(input_file)
+        if video_duration is not None and video_duration <= duration:
+            print(f"📹 Video chỉ có {video_duration:.1f}s, không cần cắt")
+            _place_unchanged(input_file, output_file, keep_input)
+            _after_write(output_file)
+            print(f"✅ No edit needed | Size: {os.path.getsize(output_file) / (1024*1024):.2f} MB")
+            return output_file
+        
         ffmpeg_path = get_ffmpeg_path()
+        # Ghi ra file tạm rồi mới đổi tên: lỗi giữa chừng không để lại file output dở
+        tmp_output = disk_manager.temp_output(output_file)
         
-        # Command để cắt video 65s đầu tiên (hoặc toàn bộ nếu ngắn hơn)
+        # Command cắt copy 65s đầu tiên (hoặc toàn bộ nếu ngắn hơn) - chỉ cắt đúng tại keyframe
         command = [
             ffmpeg_path,
             "-y",  # Overwrite output file
@@ -79,25 +363,42 @@ def edit_video_to_65s(input_file, output_file=None, duration=65):
             "-t", str(duration),  # Cắt 65s đầu tiên (hoặc toàn bộ nếu ngắn hơn)
             "-c", "copy",  # Copy codec để nhanh (không encode lại)
             "-avoid_negative_ts", "make_zero",  # Tránh lỗi timestamp
-            output_file
+            tmp_output
         ]
         
         print(f"✂️ Editing video: {os.path.basename(input_file)} → {os.path.basename(output_file)}")
         start_time = time.perf_counter()
         
-        # Chạy ffmpeg
-        result = subprocess.run(
-            command,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.PIPE,
-            check=True
-        )
+        # Chạy ffmpeg (qua pool: chờ slot nếu đang có đủ FFMPEG_WORKERS process)
+        try:
+            results = None
+            cut_point = _smart_cut_point(input_file, duration) if smart_cut else None
+            if cut_point is not None:
+                try:
+                    results = _smart_cut(input_file, tmp_output, duration, cut_point, priority)
+                    keyframe = cut_point[0]
+                    print(f"🎯 Smart-cut: copy tới {keyframe:.2f}s, encode lại {duration - keyframe:.2f}s cuối")
+                except subprocess.SubprocessError as e:
+                    stderr = getattr(e, "stderr", None) or b""
+                    print(f"⚠️ Smart-cut lỗi, cắt copy: {stderr.decode('utf-8', errors='ignore')[-200:] or e}")
+            if results is None:
+                results = [ffmpeg_pool.run(command, priority=priority)]
+            stats = _sum_stats(results)
+            if ffmpeg_stats is not None:
+                ffmpeg_stats.update(stats)
+            if os.path.exists(tmp_output):
+                os.replace(tmp_output, output_file)
+        finally:
+            if os.path.exists(tmp_output):
+                os.remove(tmp_output)
         
         elapsed = time.perf_counter() - start_time
         
         if os.path.exists(output_file):
+            _after_write(output_file)
             size_mb = os.path.getsize(output_file) / (1024 * 1024)
-            print(f"✅ Edit complete in {elapsed:.1f}s | Size: {size_mb:.2f} MB")
+            cpu = f"{stats['cpu']:.1f}s" if stats["cpu"] is not None else "?"
+            print(f"✅ Edit complete in {elapsed:.1f}s (cpu {cpu}, chờ {stats['wait']:.1f}s) | Size: {size_mb:.2f} MB")
             return output_file
         else:
             print(f"❌ Output file không được tạo: {output_file}")
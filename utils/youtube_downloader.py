@@ -1,10 +1,23 @@
+import io
 import os
 import re
 import time
+import queue
 import threading
 import subprocess
-from pytubefix import YouTube
+import weakref
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from pytubefix import YouTube, extract
+from pytubefix.botGuard import bot_guard
+from pytubefix.cipher import Cipher
+from pytubefix.sig_nsig.node_runner import NodeRunner
 from pytubefix.exceptions import VideoUnavailable, AgeRestrictedError
+from utils import media_store, disk_manager, dash_index
+from utils.download_metrics import DownloadMetrics
+from utils.video_editor import ffmpeg_pool, edit_video_to_65s
 
 # -----------------------
 # Load config
@@ -28,6 +41,16 @@ config = load_config()
 FFMPEG_PATH = config.get("ffmpeg_path")
 DOWNLOAD_PATH = config.get("download_path", "Downloads")
 MAX_RESOLUTION = int(config.get("max_resolution", 720))
+# Adaptive: vừa tải vừa mux qua pipe vào ffmpeg (không ghi 2 file tạm video/audio)
+STREAM_MUX = config.get("stream_mux", "true").lower() == "true"
+# Tổng dung lượng tối đa của thư mục Downloads (GB), vượt thì xóa artifact dùng lâu nhất
+DISK_BUDGET_GB = float(config.get("disk_budget_gb", 20))
+# Edit 65s: chỉ tải các fragment đầu (theo sidx) đủ 65s + PARTIAL_MARGIN giây thay vì cả video
+PARTIAL_DOWNLOAD = config.get("partial_download", "true").lower() == "true"
+PARTIAL_MARGIN = 5
+# Edit 65s + H.264: mux dư TRIM_MARGIN giây rồi smart-cut về đúng 65s (chính xác từng frame)
+SMART_CUT_TRIM = config.get("smart_cut_trim", "true").lower() == "true"
+TRIM_MARGIN = 1
 
 # -----------------------
 # Utility functions
@@ -36,6 +59,23 @@ def sanitize_filename(name):
     """Loại bỏ ký tự đặc biệt, emoji"""
     return re.sub(r'[\\/*?:"<>|#]', "_", name)
 
+def extract_video_id(url):
+    """Trích xuất video_id (11 ký tự) từ URL watch / shorts / youtu.be, None nếu không có"""
+    patterns = [
+        r'(?:v=|\/)([0-9A-Za-z_-]{11}).*',
+        r'youtube\.com\/shorts\/([0-9A-Za-z_-]{11})',
+        r'youtu\.be\/([0-9A-Za-z_-]{11})'
+    ]
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+def get_disk_manager(download_path=DOWNLOAD_PATH):
+    """DiskManager của thư mục download (budget lấy từ config disk_budget_gb)"""
+    return disk_manager.get_manager(download_path, int(DISK_BUDGET_GB * 1024 ** 3))
+
 def get_ffmpeg_path():
     if FFMPEG_PATH and os.path.exists(FFMPEG_PATH):
         return FFMPEG_PATH
@@ -43,8 +83,69 @@ def get_ffmpeg_path():
     return "ffmpeg"
 
 
-def merge_audio_video(video_file, audio_file, output_file):
-    """Tối ưu merge với ffmpeg - dùng copy codec để nhanh hơn"""
+def trim_args(trim_duration=None):
+    """
+    Cắt luôn lúc mux (-t + copy codec). Không dùng -avoid_negative_ts make_zero: input luôn bắt đầu
+    từ 0, make_zero chỉ dời cả track đi độ trễ B-frame -> keyframe lệch, smart-cut sau đó thiếu frame
+    """
+    if not trim_duration:
+        return []
+    return ["-t", str(trim_duration)]
+
+
+def mux_trim(video_stream, trim_duration):
+    """
+    Giá trị -t dùng lúc mux: H.264 mux dư TRIM_MARGIN giây để exact_trim smart-cut về đúng
+    trim_duration (-t + copy chỉ dừng theo packet, thiếu / thừa vài frame quanh điểm cắt),
+    codec khác (VP9 / AV1) cắt copy luôn lúc mux
+    """
+    codec = getattr(video_stream, "video_codec", None) or ""
+    if trim_duration and SMART_CUT_TRIM and codec.startswith("avc1"):
+        return trim_duration + TRIM_MARGIN
+    return trim_duration
+
+
+def exact_trim(output_file, trim_duration, muxed_duration, metrics=None):
+    """Bản đã mux dư (muxed_duration > trim_duration) -> smart-cut đúng trim_duration, ghi đè output_file"""
+    if not trim_duration or muxed_duration == trim_duration:
+        return
+    start = time.perf_counter()
+    cut_file = f"{os.path.splitext(output_file)[0]}.cut.mp4"
+    try:
+        if not edit_video_to_65s(output_file, cut_file, duration=trim_duration):
+            raise RuntimeError(f"Không cắt được {trim_duration}s")
+        os.replace(cut_file, output_file)
+    finally:
+        if os.path.exists(cut_file):
+            os.remove(cut_file)
+    if metrics:
+        metrics.add_phase("smart_cut", time.perf_counter() - start)
+
+
+def plan_output(prepared, trim_duration=None):
+    """
+    Có trim_duration (edit 65s) + adaptive stream: cắt ngay lúc mux (H.264: mux dư rồi exact_trim
+    smart-cut GOP cuối) thay vì merge ra file đầy đủ rồi edit_video_to_65s đọc lại để cắt
+    Returns: (trim, fmt, filename, trimmed)
+        trim: giá trị -t truyền cho ffmpeg lúc mux (None nếu không cắt)
+        fmt / filename: nơi lưu trong media_store (bản đã cắt lưu riêng {format}-65s)
+        trimmed: True nếu file trả về đã <= trim_duration (caller bỏ qua bước edit)
+    """
+    title_clean = prepared["title_clean"]
+    fmt = prepared["fmt"]
+    length = prepared["length"]
+    if not trim_duration:
+        return None, fmt, f"{title_clean}.mp4", False
+    if length and length <= trim_duration:
+        return None, fmt, f"{title_clean}.mp4", True
+    if prepared["progressive"]:
+        # Progressive không qua ffmpeg lúc tải -> caller tự edit
+        return None, fmt, f"{title_clean}.mp4", False
+    return trim_duration, f"{fmt}-{trim_duration:g}s", f"{title_clean}_{trim_duration:g}s.mp4", True
+
+
+def merge_audio_video(video_file, audio_file, output_file, trim_duration=None, priority=0, metrics=None):
+    """Tối ưu merge với ffmpeg - dùng copy codec để nhanh hơn (trim_duration: cắt luôn N giây đầu)"""
     ffmpeg_path = get_ffmpeg_path()
     command = [
         ffmpeg_path,
@@ -54,186 +155,838 @@ def merge_audio_video(video_file, audio_file, output_file):
         "-c:v", "copy",  # Copy video codec - không encode lại
         "-c:a", "copy",  # Copy audio codec - nhanh hơn aac encode
         "-shortest",  # Dừng khi stream ngắn nhất kết thúc
+        *trim_args(trim_duration),
         output_file
     ]
-    subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    # Chung hàng đợi / giới hạn process với edit_video_to_65s
+    result = ffmpeg_pool.run(command, priority=priority)
+    if metrics:
+        metrics.info["merge_ffmpeg"] = result.to_dict()
     print(f"Merged into {output_file}")
 
-def download_stream_async(stream, output_path, filename, result_dict, key):
+# -----------------------
+# Player cache: dùng lại kết quả giải mã signature / po_token / visitor_data giữa các lần download
+# -----------------------
+PLAYER_CACHE_TTL = 6 * 3600   # Cipher theo player (base.js) giữ tối đa 6 giờ
+PLAYER_CACHE_SIZE = 2         # YouTube hay A/B test 2 player cùng lúc
+PO_TOKEN_TTL = 6 * 3600
+VISITOR_DATA_TTL = 6 * 3600
+SIG_CACHE_SIZE = 10000
+
+_player_lock = threading.Lock()
+_ciphers = {}      # js_url -> (created_at, SharedCipher)
+_po_tokens = {}    # video_id -> (created_at, po_token)
+_visitor_data = None  # (created_at, visitor_data)
+
+
+class SharedRunner:
+    """
+    Bọc NodeRunner của cipher dùng chung: extract.apply_signature gọi close() ở cuối mỗi video,
+    close() ở đây không làm gì (process node sống tới khi cipher bị bỏ khỏi cache và hết người dùng).
+    Process chết vì lý do khác thì spawn lại ở lần gọi kế tiếp.
+    """
+
+    def __init__(self, runner: NodeRunner):
+        self._runner = runner
+
+    def load_function(self, function_name: str):
+        return self._runner.load_function(function_name)
+
+    def call(self, args: list):
+        if self._runner.proc.poll() is not None:
+            print("⚠️ Node runner của cipher đã dừng, khởi động lại")
+            runner = NodeRunner(self._runner.code)
+            runner.load_function(self._runner.function_name)
+            self._runner = runner
+        return self._runner.call(args)
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        try:
+            self._runner.close()
+        except Exception:
+            pass
+
+
+def _shutdown_runners(*runners):
+    for runner in runners:
+        runner.shutdown()
+
+
+class SharedCipher(Cipher):
+    """
+    Cipher dùng chung cho mọi video cùng player: 2 process node (sig / nsig) sống lâu thay vì
+    spawn lại mỗi video, có lock (NodeRunner không thread-safe) và nhớ kết quả đã giải mã
+    """
+
+    def __init__(self, js: str, js_url: str):
+        super().__init__(js=js, js_url=js_url)
+        self.runner_sig = SharedRunner(self.runner_sig)
+        self.runner_nsig = SharedRunner(self.runner_nsig)
+        # Tắt node khi cipher không còn ai giữ (đã bỏ khỏi _ciphers và apply_signature đang chạy đã xong)
+        weakref.finalize(self, _shutdown_runners, self.runner_sig, self.runner_nsig)
+        self._call_lock = threading.Lock()
+        self._sig_cache = {}
+        self._nsig_cache = {}
+
+    def _cached(self, cache, key, compute):
+        with self._call_lock:
+            if key not in cache:
+                if len(cache) >= SIG_CACHE_SIZE:
+                    cache.clear()
+                cache[key] = compute(key)
+            return cache[key]
+
+    def get_sig(self, ciphered_signature: str) -> str:
+        return self._cached(self._sig_cache, ciphered_signature, super().get_sig)
+
+    def get_nsig(self, n: str):
+        return self._cached(self._nsig_cache, n, super().get_nsig)
+
+
+def _get_cipher(js: str, js_url: str):
+    """Thay cho extract.Cipher: trả Cipher đã tạo sẵn cho player js_url (còn hạn)"""
+    now = time.time()
+    with _player_lock:
+        entry = _ciphers.get(js_url)
+        if entry and now - entry[0] < PLAYER_CACHE_TTL:
+            return entry[1]
+
+        print(f"🔑 Tạo cipher cho player mới: {js_url}")
+        cipher = SharedCipher(js, js_url)
+        _ciphers[js_url] = (now, cipher)
+        # Bỏ cipher hết hạn / cũ nhất khỏi cache. Không đóng trực tiếp: download khác có thể
+        # đang dùng, node process tự tắt khi không còn tham chiếu (weakref.finalize)
+        for url, (created_at, _) in sorted(_ciphers.items(), key=lambda item: item[1][0]):
+            if now - created_at >= PLAYER_CACHE_TTL or len(_ciphers) > PLAYER_CACHE_SIZE:
+                del _ciphers[url]
+        return cipher
+
+
+_generate_po_token = bot_guard.generate_po_token
+
+
+def _cached_po_token(video_id: str) -> str:
+    """botGuard spawn node mỗi lần gọi: nhớ po_token theo video_id trong PO_TOKEN_TTL"""
+    now = time.time()
+    with _player_lock:
+        entry = _po_tokens.get(video_id)
+        if entry and now - entry[0] < PO_TOKEN_TTL:
+            return entry[1]
+    po_token = _generate_po_token(video_id)
+    with _player_lock:
+        for key in [k for k, (t, _) in _po_tokens.items() if now - t >= PO_TOKEN_TTL]:
+            del _po_tokens[key]
+        _po_tokens[video_id] = (now, po_token)
+    return po_token
+
+
+def _install_player_cache():
+    """Patch pytubefix (extract / bot_guard tra cứu theo thuộc tính module nên patch được)"""
+    extract.Cipher = _get_cipher
+    if not hasattr(extract.signature_timestamp, "cache_info"):
+        # base.js giống nhau (cùng object str trong pytubefix.__js__) -> không regex lại 2 MB
+        extract.signature_timestamp = lru_cache(maxsize=8)(extract.signature_timestamp)
+    bot_guard.generate_po_token = _cached_po_token
+
+
+_install_player_cache()
+
+
+def create_youtube(url, client="WEB"):
+    """Tạo YouTube object, dùng lại visitor_data của lần trước (bỏ qua 1 request InnerTube)"""
+    video = YouTube(url, client=client, use_oauth=False)
+    with _player_lock:
+        if _visitor_data and time.time() - _visitor_data[0] < VISITOR_DATA_TTL:
+            video._visitor_data = _visitor_data[1]
+    return video
+
+
+def _remember_visitor_data(video):
+    global _visitor_data
+    value = getattr(video, "_visitor_data", None)
+    if value:
+        with _player_lock:
+            if not _visitor_data or _visitor_data[1] != value:
+                _visitor_data = (time.time(), value)
+
+
+# -----------------------
+# Ranged download: nhiều kết nối song song cho 1 stream
+# -----------------------
+RANGE_CHUNK_SIZE = 4 * 1024 * 1024    # Mỗi chunk 4 MB (&range=start-end)
+RANGED_MIN_SIZE = 2 * 1024 * 1024     # File nhỏ hơn thì tải 1 kết nối như cũ
+MIN_CONNECTIONS = 2
+MAX_CONNECTIONS = 8
+CHUNK_RETRIES = 3
+RAMP_INTERVAL = 1.0                   # Mỗi 1s đo tốc độ, tăng kết nối nếu còn nhanh lên
+RAMP_GAIN = 1.1                       # Thêm kết nối chỉ khi tốc độ tăng >= 10%
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    """requests.Session dùng chung (pool kết nối keep-alive tới googlevideo)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONNECTIONS * 4)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+            _session.headers.update({"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"})
+        return _session
+
+
+def _download_chunk(url, start, end, f, base=0, stats=None):
+    """
+    Tải 1 chunk, ghi đúng vị trí trong file; lỗi thì retry tiếp từ byte đã nhận
+    base: offset của f trong stream (f là buffer riêng của chunk thì base = start)
+    stats: StreamStats ghi nhận TTFB / bytes / thời gian ghi đĩa (tùy chọn)
+    """
+    session = _get_session()
+    pos = start
+    for attempt in range(CHUNK_RETRIES + 1):
+        try:
+            with session.get(f"{url}&range={pos}-{end}", stream=True, timeout=(10, 30)) as response:
+                response.raise_for_status()
+                for data in response.iter_content(chunk_size=256 * 1024):
+                    write_start = time.perf_counter()
+                    f.seek(pos - base)
+                    f.write(data)
+                    pos += len(data)
+                    if stats:
+                        stats.on_data(len(data), time.perf_counter() - write_start)
+            if pos > end:
+                return end - start + 1
+            raise IOError(f"chunk {start}-{end} thiếu {end - pos + 1} bytes")
+        except (requests.RequestException, IOError) as e:
+            if attempt == CHUNK_RETRIES:
+                raise
+            print(f"⚠️ Chunk {start}-{end} lỗi ({e}), thử lại {attempt + 1}/{CHUNK_RETRIES}")
+            time.sleep(0.5 * (attempt + 1))
+
+
+def download_stream_ranged(stream, filepath, max_connections=MAX_CONNECTIONS, stats=None):
+    """
+    Tải 1 stream bằng nhiều kết nối song song, mỗi kết nối tải 1 chunk &range=start-end
+    và ghi thẳng vào file đã cấp phát trước (mỗi thread 1 file handle riêng, seek + write).
+    Số kết nối bắt đầu từ MIN_CONNECTIONS, tăng dần khi tốc độ đo được còn tăng.
+    Stream SABR / OTF (không hỗ trợ range) hoặc file nhỏ thì tải như cũ.
+    """
+    total = stream.filesize if not (stream.is_sabr or stream.is_otf) else 0
+    if total < RANGED_MIN_SIZE:
+        stream.download(output_path=os.path.dirname(filepath) or ".", filename=os.path.basename(filepath))
+        if stats:
+            stats.finish(os.path.getsize(filepath))
+        return filepath
+
+    with open(filepath, "wb") as f:
+        f.truncate(total)
+
+    chunks = queue.Queue()
+    for start in range(0, total, RANGE_CHUNK_SIZE):
+        chunks.put((start, min(start + RANGE_CHUNK_SIZE, total) - 1))
+
+    progress = {"bytes": 0, "error": None, "active": 0}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def worker():
+        try:
+            with open(filepath, "r+b") as f:
+                while progress["error"] is None:
+                    try:
+                        start, end = chunks.get_nowait()
+                    except queue.Empty:
+                        return
+                    size = _download_chunk(stream.url, start, end, f, stats=stats)
+                    with lock:
+                        progress["bytes"] += size
+        except Exception as e:
+            progress["error"] = e
+        finally:
+            with lock:
+                progress["active"] -= 1
+                if progress["active"] == 0:
+                    done.set()
+
+    def spawn():
+        with lock:
+            progress["active"] += 1
+        threading.Thread(target=worker, daemon=True).start()
+
+    connections = MIN_CONNECTIONS
+    for _ in range(connections):
+        spawn()
+
+    # Mỗi RAMP_INTERVAL đo tốc độ: còn tăng >= RAMP_GAIN thì thêm 1 kết nối
+    last_rate = 0.0
+    last_bytes = 0
+    while not done.wait(RAMP_INTERVAL):
+        with lock:
+            rate = (progress["bytes"] - last_bytes) / RAMP_INTERVAL
+            last_bytes = progress["bytes"]
+        if connections < max_connections and not chunks.empty() and rate >= last_rate * RAMP_GAIN:
+            spawn()
+            connections += 1
+        last_rate = rate
+
+    if progress["error"] is not None:
+        os.remove(filepath)
+        raise progress["error"]
+
+    if stats:
+        stats.finish()
+    print(f"⚡ Ranged download {total / 1024 / 1024:.1f} MB với tối đa {connections} kết nối")
+    return filepath
+
+
+def iter_stream_chunks(stream, window=MIN_CONNECTIONS * 2, stats=None):
+    """
+    Tải stream theo thứ tự (dùng cho pipe): luôn có `window` chunk tải trước song song,
+    yield bytes của từng chunk đúng thứ tự
+    """
+    total = stream.filesize
+    ranges = [(start, min(start + RANGE_CHUNK_SIZE, total) - 1) for start in range(0, total, RANGE_CHUNK_SIZE)]
+
+    def fetch(start, end):
+        buffer = io.BytesIO()
+        _download_chunk(stream.url, start, end, buffer, base=start, stats=stats)
+        return buffer.getvalue()
+
+    # Bắt đầu tải `window` chunk đầu ngay khi gọi hàm (trước khi bắt đầu đọc generator)
+    pool = ThreadPoolExecutor(max_workers=window)
+    pending = [pool.submit(fetch, *r) for r in ranges[:window]]
+
+    def generate():
+        next_index = len(pending)
+        try:
+            while pending:
+                data = pending.pop(0).result()
+                if next_index < len(ranges):
+                    pending.append(pool.submit(fetch, *ranges[next_index]))
+                    next_index += 1
+                yield data
+            if stats:
+                stats.finish()
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    return generate()
+
+
+class PartialStream:
+    """
+    Stream adaptive chỉ tải `filesize` byte đầu (init + các fragment đầu),
+    mọi thuộc tính khác (url, itag, codec...) lấy từ stream gốc
+    """
+
+    def __init__(self, stream, size):
+        self._stream = stream
+        self.filesize = size
+        self.full_size = stream.filesize
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def download(self, output_path=".", filename=None, **kwargs):
+        """Thay cho Stream.download() (file nhỏ < RANGED_MIN_SIZE): 1 request range, không tải cả stream"""
+        filepath = os.path.join(output_path, filename)
+        with open(filepath, "wb") as f:
+            _download_chunk(self.url, 0, self.filesize - 1, f)
+        return filepath
+
+
+def _fetch_range(url, start, end) -> bytes:
+    buffer = io.BytesIO()
+    _download_chunk(url, start, end, buffer, base=start)
+    return buffer.getvalue()
+
+
+def partial_stream(stream, seconds):
+    """
+    Stream chỉ gồm phần đầu đủ `seconds` giây (+ PARTIAL_MARGIN) theo sidx.
+    Không có sidx / lỗi / phần cần tải gần bằng cả file thì trả về stream gốc (tải toàn bộ).
+    """
+    if stream.is_sabr or stream.is_otf or stream.subtype != "mp4":
+        return stream
+    try:
+        total = stream.filesize
+        head = _fetch_range(stream.url, 0, min(dash_index.HEAD_SIZE, total) - 1)
+        end = dash_index.sidx_end(head)
+        if end and len(head) < end <= total:
+            head += _fetch_range(stream.url, len(head), end - 1)
+        size = dash_index.partial_size(head, seconds + PARTIAL_MARGIN)
+    except Exception as e:
+        print(f"⚠️ Không đọc được sidx ({e}), tải toàn bộ stream")
+        return stream
+    if not size or size >= total:
+        return stream
+    return PartialStream(stream, size)
+
+
+def partial_streams(video_stream, audio_stream, seconds, metrics=None):
+    """Edit N giây: đọc sidx của video + audio song song, trả về (video, audio) chỉ gồm phần đầu"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        streams = list(pool.map(lambda s: partial_stream(s, seconds), (video_stream, audio_stream)))
+    partial = [s for s in streams if isinstance(s, PartialStream)]
+    if partial:
+        saved = sum(s.full_size - s.filesize for s in partial)
+        size = sum(s.filesize for s in streams)
+        print(f"✂️ Chỉ tải {size / 1024 / 1024:.1f} MB đầu (bỏ {saved / 1024 / 1024:.1f} MB sau {seconds}s)")
+        if metrics:
+            metrics.info["partial_saved_bytes"] = saved
+    if metrics:
+        metrics.add_phase("sidx", time.perf_counter() - start)
+    return streams
+
+
+def _pipe_stream(stream, sink, stats=None):
+    """Ghi toàn bộ stream vào sink (stdin của ffmpeg / FIFO) rồi đóng lại"""
+    try:
+        for data in iter_stream_chunks(stream, stats=stats):
+            sink.write(data)
+    finally:
+        try:
+            sink.close()
+        except OSError:
+            pass
+
+
+def stream_mux(video_stream, audio_stream, output_file, metrics=None, trim_duration=None):
+    """
+    Tải video + audio và mux bằng 1 process ffmpeg (-c copy) trong lúc đang tải.
+    POSIX: 2 FIFO làm input cho ffmpeg. Windows (không có FIFO): audio (nhỏ) tải ra file tạm,
+    video đẩy thẳng vào stdin của ffmpeg.
+    trim_duration: ffmpeg dừng sau N giây (đóng pipe sớm -> ngừng tải phần còn lại)
+    Returns: True nếu thành công, False để caller quay về cách tải file tạm + merge
+    """
+    if any(s.is_sabr or s.is_otf for s in (video_stream, audio_stream)):
+        return False
+
+    ffmpeg_path = get_ffmpeg_path()
+    use_fifo = hasattr(os, "mkfifo")
+    if use_fifo:
+        video_input = f"{output_file}.video.fifo"
+        audio_input = f"{output_file}.audio.fifo"
+        os.mkfifo(video_input)
+        os.mkfifo(audio_input)
+    else:
+        video_input = "pipe:0"
+        audio_input = f"{output_file}.audio.mp4"
+
+    errors = []
+    threads = []
+    process = None
+    video_stats = metrics.stream("video") if metrics else None
+    audio_stats = metrics.stream("audio") if metrics else None
+
+    def run(target, *args):
+        def wrapper():
+            try:
+                target(*args)
+            except BrokenPipeError:
+                pass  # ffmpeg đã đủ dữ liệu (-t / -shortest) và đóng input, vẫn đang ghi nốt output
+            except Exception as e:
+                errors.append(e)
+                if process and process.poll() is None:
+                    process.kill()
+        thread = threading.Thread(target=wrapper, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    try:
+        if not use_fifo:
+            # Bắt đầu tải trước video (window chunk) trong lúc tải audio ra file
+            video_chunks = iter_stream_chunks(video_stream, stats=video_stats)
+            download_stream_ranged(audio_stream, audio_input, stats=audio_stats)
+
+        command = [
+            ffmpeg_path,
+            "-y",
+            "-i", video_input,
+            "-i", audio_input,
+            "-map", "0:v:0",
+            "-map", "1:a:0",
+            "-c:v", "copy",
+            "-c:a", "copy",
+            "-shortest",
+            *trim_args(trim_duration),
+            output_file
+        ]
+        # Process mux chiếm 1 slot của ffmpeg_pool suốt thời gian tải (giới hạn chung với edit / merge)
+        with ffmpeg_pool.slot():
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE if not use_fifo else subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE
+            )
+
+            if use_fifo:
+                # open() FIFO sẽ chờ tới khi ffmpeg mở đầu đọc
+                run(lambda: _pipe_stream(video_stream, open(video_input, "wb"), video_stats))
+                run(lambda: _pipe_stream(audio_stream, open(audio_input, "wb"), audio_stats))
+            else:
+                def pipe_video():
+                    try:
+                        for data in video_chunks:
+                            process.stdin.write(data)
+                    finally:
+                        process.stdin.close()
+                run(pipe_video)
+
+            # Không dùng communicate(): nó tự đóng stdin trong khi thread còn đang ghi video vào
+            stderr = process.stderr.read()
+            process.wait()
+            if use_fifo:
+                # ffmpeg thoát sớm (chưa mở FIFO) thì mở đầu đọc để thread ghi không bị treo ở open()
+                for path in (video_input, audio_input):
+                    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                    os.close(fd)
+            for thread in threads:
+                thread.join()
+
+        if errors or process.returncode != 0:
+            reason = errors[0] if errors else stderr.decode("utf-8", errors="ignore")[-200:]
+            print(f"⚠️ Stream mux lỗi: {reason}")
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            return False
+        return True
+    except Exception as e:
+        print(f"⚠️ Stream mux lỗi: {e}")
+        if process and process.poll() is None:
+            process.kill()
+        return False
+    finally:
+        for path in (video_input, audio_input):
+            if path != "pipe:0" and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def download_stream_async(stream, output_path, filename, result_dict, key, stats=None):
     """Download stream trong thread riêng"""
     try:
-        stream.download(output_path=output_path, filename=filename)
         filepath = os.path.join(output_path, filename)
+        download_stream_ranged(stream, filepath, stats=stats)
         result_dict[key] = filepath
     except Exception as e:
         result_dict[key] = None
         print(f"❌ Error downloading {key}: {e}")
 
+# -----------------------
+# Resolve + chọn stream (dùng chung cho prepare và download)
+# -----------------------
+PREPARE_MARGIN = 300  # URL stream còn hạn < 5 phút thì resolve lại
+
+_prepared = {}         # (video_id, max_resolution) -> dict stream đã chọn
+_prepare_locks = {}    # (video_id, max_resolution) -> threading.Lock (không resolve trùng)
+
+
+def normalize_url(url):
+    """Chuẩn hóa URL về dạng https://www.youtube.com/watch?v=VIDEO_ID, None nếu không phải YouTube"""
+    # Normalize URL: chuyển shorts thành watch?v= và đảm bảo format đúng
+    url = url.replace("/shorts/", "/watch?v=")
+    # Đảm bảo URL có format đúng: https://www.youtube.com/watch?v=VIDEO_ID
+    if "youtube.com" not in url and "youtu.be" not in url:
+        print(f"❌ Invalid YouTube URL: {url}")
+        return None
+
+    # Nếu là youtu.be thì chuyển sang youtube.com/watch?v=
+    if "youtu.be/" in url:
+        video_id = url.split("youtu.be/")[-1].split("?")[0]
+        url = f"https://www.youtube.com/watch?v={video_id}"
+    return url
+
+
+def _res(stream):
+    value = (stream.resolution or "").replace("p", "")
+    return int(value) if value.isdigit() else 0
+
+
+def select_streams(all_streams, max_resolution=720):
+    """
+    Chọn stream từ danh sách mp4: ưu tiên progressive (không cần merge),
+    không có thì chọn cặp adaptive video (<= max_resolution) + audio (abr cao nhất)
+    Returns: (progressive_stream, video_stream, audio_stream), progressive hoặc cặp adaptive là None
+    """
+    progressive_streams = [s for s in all_streams if s.is_progressive]
+
+    if progressive_streams:
+        # Tìm stream có resolution <= max_resolution, ưu tiên cao nhất
+        candidates = [s for s in progressive_streams if s.resolution and _res(s) <= max_resolution]
+        if candidates:
+            stream = max(candidates, key=_res)
+            print(f"✅ Found progressive stream: {stream.resolution}")
+        else:
+            # Nếu không có stream <= max_resolution, lấy stream thấp nhất
+            stream = min(progressive_streams, key=lambda x: _res(x) if x.resolution else 9999)
+            print(f"✅ Using progressive stream: {stream.resolution}")
+        return stream, None, None
+
+    # Không có progressive, mới dùng adaptive (chậm hơn)
+    print("⚠️ No progressive stream, using adaptive (slower)...")
+    video_streams = [s for s in all_streams if s.includes_video_track and not s.includes_audio_track]
+    audio_streams = [s for s in all_streams if s.includes_audio_track and not s.includes_video_track]
+
+    # Chọn video stream <= max_resolution
+    video_candidates = [s for s in video_streams if _res(s) and _res(s) <= max_resolution]
+    if video_candidates:
+        video_stream = max(video_candidates, key=_res)
+    else:
+        video_stream = max(video_streams, key=_res) if video_streams else None
+
+    # Chọn audio stream chất lượng tốt nhất (abr cao nhất)
+    audio_stream = max(
+        audio_streams,
+        key=lambda x: int(x.abr.replace("kbps", "")) if x.abr and x.abr.replace("kbps", "").isdigit() else 0
+    ) if audio_streams else None
+    return None, video_stream, audio_stream
+
+
+def _stream_expiry(*streams):
+    try:
+        return min(s.expiration.timestamp() for s in streams if s is not None)
+    except Exception:
+        return time.time() + 3600
+
+
+def prepare_streams(url, max_resolution=720, metrics=None):
+    """
+    Resolve video + chọn stream (gọi ngay khi watcher phát hiện video mới, trước khi cần download).
+    Kết quả được cache tới khi URL stream (đã ký) sắp hết hạn.
+    metrics: DownloadMetrics ghi thời gian youtube_init / title / streams (tùy chọn)
+    Returns: dict {video_id, title, title_clean, length, progressive, video_stream, audio_stream,
+                   fmt, expires_at} hoặc None nếu lỗi
+    """
+    url = normalize_url(url)
+    if not url:
+        return None
+    key = (extract_video_id(url) or url, max_resolution)
+
+    with _player_lock:
+        lock = _prepare_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        prepared = _prepared.get(key)
+        if prepared and prepared["expires_at"] - time.time() > PREPARE_MARGIN:
+            if metrics:
+                metrics.info["resolve_cached"] = True
+            return prepared
+
+        metrics = metrics or DownloadMetrics()
+        metrics.info["resolve_cached"] = False
+        try:
+            # Chỉ định WEB client ngay từ đầu để tránh phải switch từ ANDROID_VR sang TV (tiết kiệm ~6s)
+            # WEB client thường work tốt và nhanh hơn TV, tránh delay do switch client
+            with metrics.phase("youtube_init"):
+                video = create_youtube(url, client='WEB')
+        except Exception as e:
+            print(f"❌ Error creating YouTube object: {e}")
+            print(f"❌ URL: {url}")
+            return None
+
+        with metrics.phase("title"):
+            title = video.title
+        print(f"\n📥 Video: {title}")
+        # TỐI ƯU TỐC ĐỘ: Tìm stream một lần duy nhất, không filter nhiều lần
+        with metrics.phase("streams"):
+            all_streams = video.streams.filter(file_extension='mp4')
+        _remember_visitor_data(video)
+        progressive, video_stream, audio_stream = select_streams(all_streams, max_resolution)
+
+        if progressive:
+            fmt = media_store.format_key(progressive)
+        elif video_stream and audio_stream:
+            fmt = media_store.format_key(video_stream, audio_stream)
+        else:
+            print("❌ No suitable stream found!")
+            return None
+
+        prepared = {
+            "video_id": video.video_id,
+            "title": title,
+            "title_clean": sanitize_filename(title),
+            "length": video.length,
+            "progressive": progressive,
+            "video_stream": video_stream,
+            "audio_stream": audio_stream,
+            "fmt": fmt,
+            "expires_at": _stream_expiry(progressive, video_stream, audio_stream),
+        }
+
+        with _player_lock:
+            now = time.time()
+            for k in [k for k, v in _prepared.items() if v["expires_at"] <= now]:
+                del _prepared[k]
+                _prepare_locks.pop(k, None)
+            _prepared[key] = prepared
+        return prepared
+
+
 def download_youtube_video(
     url,
     download_path="Downloads",
     max_resolution=720,
-    progressive_only=True
+    progressive_only=True,
+    return_metrics=False,
+    trim_duration=None
 ):
     """
     Download YouTube video về thư mục Downloads - TỐI ƯU TỐC ĐỘ
+    Stream đã được prepare_streams() resolve trước (lúc phát hiện video) thì dùng luôn
+    trim_duration: cần bản N giây đầu (edit 65s) -> adaptive stream được cắt luôn lúc mux,
+                   metrics["trimmed"] = True thì không cần gọi edit_video_to_65s nữa
     Returns: đường dẫn file đã download hoặc None nếu lỗi
+             return_metrics=True: (đường dẫn hoặc None, dict metrics từng pha)
     """
+    metrics = DownloadMetrics()
+    filepath = _download_youtube_video(url, download_path, max_resolution, progressive_only, metrics, trim_duration)
+    metrics.finish()
+    return (filepath, metrics.to_dict()) if return_metrics else filepath
+
+
+def _download_youtube_video(url, download_path, max_resolution, progressive_only, metrics, trim_duration=None):
     try:
         start_time = time.perf_counter()
 
         if not os.path.exists(download_path):
             os.makedirs(download_path)
             print(f"Directory created: {download_path}")
+        disk = get_disk_manager(download_path)
 
-        # Normalize URL: chuyển shorts thành watch?v= và đảm bảo format đúng
-        url = url.replace("/shorts/", "/watch?v=")
-        # Đảm bảo URL có format đúng: https://www.youtube.com/watch?v=VIDEO_ID
-        if "youtube.com" not in url and "youtu.be" not in url:
-            print(f"❌ Invalid YouTube URL: {url}")
+        prepared = prepare_streams(url, max_resolution, metrics)
+        if not prepared:
             return None
-        
-        # Nếu là youtu.be thì chuyển sang youtube.com/watch?v=
-        if "youtu.be/" in url:
-            video_id = url.split("youtu.be/")[-1].split("?")[0]
-            url = f"https://www.youtube.com/watch?v={video_id}"
-        
-        try:
-            # Chỉ định WEB client ngay từ đầu để tránh phải switch từ ANDROID_VR sang TV (tiết kiệm ~6s)
-            # WEB client thường work tốt và nhanh hơn TV, tránh delay do switch client
-            video = YouTube(url, client='WEB', use_oauth=False)
-        except Exception as e:
-            print(f"❌ Error creating YouTube object: {e}")
-            print(f"❌ URL: {url}")
-            return None
-        
-        # TỐI ƯU: Lấy title song song với việc tìm stream để tiết kiệm thời gian
-        title_clean = sanitize_filename(video.title)
-        print(f"\n📥 Video: {video.title}")
 
-        # TỐI ƯU TỐC ĐỘ: Tìm stream một lần duy nhất, không filter nhiều lần
-        # Ưu tiên progressive stream (nhanh nhất, không cần merge)
-        all_streams = video.streams.filter(file_extension='mp4')
-        progressive_streams = [s for s in all_streams if s.is_progressive]
-        
-        if progressive_streams:
-            # Tìm stream có resolution <= max_resolution, ưu tiên cao nhất
-            candidates = [s for s in progressive_streams 
-                         if s.resolution and int(s.resolution.replace("p", "")) <= max_resolution]
-            if candidates:
-                # Chọn resolution cao nhất trong giới hạn (tối ưu: dùng max với key function)
-                stream = max(candidates, key=lambda x: int(x.resolution.replace("p", "")))
-                progressive_only = True
-                print(f"✅ Found progressive stream: {stream.resolution}")
-            else:
-                # Nếu không có stream <= max_resolution, lấy stream thấp nhất
-                stream = min(progressive_streams, 
-                           key=lambda x: int(x.resolution.replace("p", "")) if x.resolution else 9999)
-                progressive_only = True
-                print(f"✅ Using progressive stream: {stream.resolution}")
-        else:
-            # Không có progressive, mới dùng adaptive (chậm hơn)
-            print("⚠️ No progressive stream, using adaptive (slower)...")
-            progressive_only = False
-            # Tối ưu: filter một lần và sort
-            adaptive_streams = [s for s in all_streams if not s.is_progressive]
-            if adaptive_streams:
-                stream = max(adaptive_streams, 
-                           key=lambda x: int(x.resolution.replace("p", "")) if x.resolution and x.resolution.replace("p", "").isdigit() else 0)
-            else:
-                stream = None
-
-        if not stream:
-            print("❌ No suitable stream found!")
-            return None
+        video_id = prepared["video_id"]
+        stream = prepared["progressive"]
+        video_stream = prepared["video_stream"]
+        audio_stream = prepared["audio_stream"]
+        print(f"📊 Selected resolution: {(stream or video_stream).resolution}")
+        trim, fmt, filename, metrics.info["trimmed"] = plan_output(prepared, trim_duration)
+        duration = min(prepared["length"], trim) if trim else prepared["length"]
 
-        res_value = int(stream.resolution.replace("p", "")) if stream.resolution else 0
-        print(f"📊 Selected resolution: {stream.resolution}")
+        existing = media_store.lookup(download_path, video_id, fmt)
+        if existing:
+            print(f"♻️ Đã có file {video_id}-{fmt}, bỏ qua download")
+            metrics.info["reused_file"] = True
+            disk.touch(existing)
+            return existing
 
         # Progressive stream - download trực tiếp (NHANH NHẤT)
-        if progressive_only or getattr(stream, "is_progressive", False):
-            filepath = os.path.join(download_path, f"{title_clean}.mp4")
+        if stream:
+            # Tải vào file tạm tên duy nhất, xong mới chuyển sang thư mục {video_id}-{format}
+            tmp_file = media_store.temp_path(download_path)
             print(f"⬇️ Downloading progressive stream...")
-            stream.download(output_path=download_path, filename=f"{title_clean}.mp4")
+            metrics.info["mode"] = "progressive"
+            with metrics.phase("download"):
+                download_stream_ranged(stream, tmp_file, stats=metrics.stream("progressive"))
+            with metrics.phase("publish"):
+                filepath = media_store.publish(
+                    tmp_file, download_path, video_id, fmt, filename,
+                    title=prepared["title"], duration=duration, **media_store.stream_info(stream)
+                )
+            disk.maintain()
             end_time = time.perf_counter()
             elapsed = end_time - start_time
-            size_kb = os.path.getsize(filepath) / 1024
+            metrics.info["size"] = os.path.getsize(filepath)
+            size_kb = metrics.info["size"] / 1024
             print(f"✅ Download complete in {elapsed:.1f}s | Size: {size_kb:.2f} KB")
             return filepath
         
         # Adaptive streams - download song song (NHANH HƠN)
         else:
             print(f"⬇️ Downloading adaptive streams (parallel)...")
-            
-            # TỐI ƯU: Tìm video và audio stream từ all_streams đã filter sẵn
-            video_streams = [s for s in all_streams if s.includes_video_track and not s.includes_audio_track]
-            audio_streams = [s for s in all_streams if s.includes_audio_track and not s.includes_video_track]
-            
-            # Chọn video stream <= max_resolution
-            video_candidates = [s for s in video_streams 
-                              if s.resolution and s.resolution.replace("p", "").isdigit() 
-                              and int(s.resolution.replace("p", "")) <= max_resolution]
-            if video_candidates:
-                video_stream = max(video_candidates, 
-                                  key=lambda x: int(x.resolution.replace("p", "")))
+
+            # Tên tạm duy nhất: nhiều download chạy song song không ghi đè nhau
+            video_file = media_store.temp_path(download_path)
+            audio_file = media_store.temp_path(download_path)
+            output_file = media_store.temp_path(download_path)
+            tmp_dir = os.path.dirname(video_file)
+
+            # Vừa tải vừa mux (ffmpeg đọc trực tiếp từ pipe), lỗi thì quay về tải file tạm + merge
+            merge_time = 0
+            muxed = mux_trim(video_stream, trim)
+            if trim:
+                print(f"✂️ Cắt {trim}s đầu ngay lúc mux")
+                if PARTIAL_DOWNLOAD:
+                    video_stream, audio_stream = partial_streams(video_stream, audio_stream, muxed, metrics)
+            mux_start = time.perf_counter()
+            if STREAM_MUX and stream_mux(video_stream, audio_stream, output_file, metrics, muxed):
+                print("🔀 Streamed download + mux (không cần merge riêng)")
+                metrics.info["mode"] = "stream_mux"
+                metrics.add_phase("download", time.perf_counter() - mux_start)
             else:
-                video_stream = max(video_streams, 
-                                  key=lambda x: int(x.resolution.replace("p", "")) if x.resolution and x.resolution.replace("p", "").isdigit() else 0) if video_streams else None
-            
-            # Chọn audio stream chất lượng tốt nhất (abr cao nhất)
-            audio_stream = max(audio_streams, 
-                             key=lambda x: int(x.abr.replace("kbps", "")) if x.abr and x.abr.replace("kbps", "").isdigit() else 0) if audio_streams else None
-            
-            if not video_stream or not audio_stream:
-                print("❌ Cannot find adaptive streams to merge!")
-                return None
-
-            video_file = os.path.join(download_path, f"video_temp_{int(time.time())}.mp4")
-            audio_file = os.path.join(download_path, f"audio_temp_{int(time.time())}.mp4")
-            output_file = os.path.join(download_path, f"{title_clean}.mp4")
-
-            # Download song song để tăng tốc độ
-            result_dict = {}
-            thread1 = threading.Thread(
-                target=download_stream_async,
-                args=(video_stream, download_path, os.path.basename(video_file), result_dict, "video")
-            )
-            thread2 = threading.Thread(
-                target=download_stream_async,
-                args=(audio_stream, download_path, os.path.basename(audio_file), result_dict, "audio")
-            )
-            
-            thread1.start()
-            thread2.start()
-            thread1.join()
-            thread2.join()
-            
-            if result_dict.get("video") is None or result_dict.get("audio") is None:
-                print("❌ Download failed!")
-                # Cleanup
-                for f in [video_file, audio_file]:
-                    if os.path.exists(f):
-                        os.remove(f)
-                return None
-            
-            video_file = result_dict["video"]
-            audio_file = result_dict["audio"]
-            
-            print(f"🔗 Merging audio and video...")
-            merge_start = time.perf_counter()
-            merge_audio_video(video_file, audio_file, output_file)
-            merge_time = time.perf_counter() - merge_start
-            
-            # Cleanup temp files
-            try:
-                os.remove(video_file)
-                os.remove(audio_file)
-            except:
-                pass
+                metrics.info["mode"] = "merge"
+                download_start = time.perf_counter()
+                # Download song song để tăng tốc độ
+                result_dict = {}
+                thread1 = threading.Thread(
+                    target=download_stream_async,
+                    args=(video_stream, tmp_dir, os.path.basename(video_file), result_dict, "video",
+                          metrics.stream("video"))
+                )
+                thread2 = threading.Thread(
+                    target=download_stream_async,
+                    args=(audio_stream, tmp_dir, os.path.basename(audio_file), result_dict, "audio",
+                          metrics.stream("audio"))
+                )
+                
+                thread1.start()
+                thread2.start()
+                thread1.join()
+                thread2.join()
+                metrics.add_phase("download", time.perf_counter() - download_start)
+                
+                if result_dict.get("video") is None or result_dict.get("audio") is None:
+                    print("❌ Download failed!")
+                    # Cleanup
+                    for f in [video_file, audio_file]:
+                        if os.path.exists(f):
+                            os.remove(f)
+                    return None
+                
+                video_file = result_dict["video"]
+                audio_file = result_dict["audio"]
+                
+                print(f"🔗 Merging audio and video...")
+                merge_start = time.perf_counter()
+                merge_audio_video(video_file, audio_file, output_file, muxed, metrics=metrics)
+                merge_time = time.perf_counter() - merge_start
+                metrics.add_phase("merge", merge_time)
+                
+                # Cleanup temp files
+                try:
+                    os.remove(video_file)
+                    os.remove(audio_file)
+                except:
+                    pass
+
+            exact_trim(output_file, trim, muxed, metrics)
+            with metrics.phase("publish"):
+                output_file = media_store.publish(
+                    output_file, download_path, video_id, fmt, filename,
+                    title=prepared["title"], duration=duration,
+                    **media_store.stream_info(video_stream, audio_stream)
+                )
+            disk.maintain()
     
             end_time = time.perf_counter()
             elapsed = end_time - start_time
-            size_kb = os.path.getsize(output_file) / 1024
+            metrics.info["size"] = os.path.getsize(output_file)
+            size_kb = metrics.info["size"] / 1024
             print(f"✅ Download complete in {elapsed:.1f}s (merge: {merge_time:.1f}s) | Size: {size_kb:.2f} KB")
             return output_file
 
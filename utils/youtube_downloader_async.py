@@ -0,0 +1,460 @@
+"""
+Download YouTube bằng asyncio - cùng quy tắc chọn stream / lưu file với youtube_downloader.py
+- Dữ liệu stream tải qua 1 session aiohttp dùng chung (gắn vào AsyncHTTPClient của pytubefix),
+  không tốn 1 thread cho mỗi stream / mỗi kết nối như bản đồng bộ
+- Resolve video (InnerTube + cipher của pytubefix là code đồng bộ) vẫn chạy trong thread qua
+  prepare_streams(), kết quả được cache nên thường không tốn thêm gì
+- Hủy task (task.cancel()) thì dừng mọi kết nối, kill ffmpeg và xóa file tạm
+"""
+import asyncio
+import io
+import os
+import threading
+import time
+from collections import deque
+
+import aiohttp
+from pytubefix.async_http_client import AsyncHTTPClient
+from pytubefix.exceptions import VideoUnavailable, AgeRestrictedError
+
+from utils import media_store
+from utils.download_metrics import DownloadMetrics
+from utils.video_editor import ffmpeg_pool
+from utils.youtube_downloader import (
+    prepare_streams,
+    get_ffmpeg_path,
+    get_disk_manager,
+    merge_audio_video,
+    plan_output,
+    trim_args,
+    mux_trim,
+    exact_trim,
+    partial_streams,
+    PARTIAL_DOWNLOAD,
+    STREAM_MUX,
+    RANGE_CHUNK_SIZE,
+    RANGED_MIN_SIZE,
+    MIN_CONNECTIONS,
+    MAX_CONNECTIONS,
+    CHUNK_RETRIES,
+    RAMP_INTERVAL,
+    RAMP_GAIN,
+)
+
+POOL_LIMIT = 100              # Tổng số kết nối đồng thời (mọi download cộng lại)
+POOL_LIMIT_PER_HOST = 32
+READ_SIZE = 256 * 1024
+HEADERS = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+CHUNK_TIMEOUT = aiohttp.ClientTimeout(sock_connect=10, sock_read=30)
+
+_session_loop = None
+
+
+# -----------------------
+# HTTP client dùng chung
+# -----------------------
+async def get_http_client() -> AsyncHTTPClient:
+    """
+    AsyncHTTPClient (singleton của pytubefix) với session aiohttp có pool giới hạn,
+    dùng chung cho mọi download trong process. Tạo lại nếu bị đóng hoặc đổi event loop.
+    """
+    global _session_loop
+    client = AsyncHTTPClient()
+    loop = asyncio.get_running_loop()
+    session = client._session
+    if session is None or session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(limit=POOL_LIMIT, limit_per_host=POOL_LIMIT_PER_HOST, ttl_dns_cache=300)
+        client._session = aiohttp.ClientSession(connector=connector, headers=HEADERS)
+        _session_loop = loop
+    return client
+
+
+async def close_http_client():
+    """Gọi khi tắt server / runner để đóng các kết nối keep-alive"""
+    await AsyncHTTPClient().close()
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    return (await get_http_client())._session
+
+
+# -----------------------
+# Ranged download (asyncio)
+# -----------------------
+class _FileWriter:
+    """
+    File đích của ranged download: ghi đĩa trong thread (không chặn event loop),
+    các worker dùng chung 1 file handle nên seek + write phải nằm trong lock
+    """
+
+    def __init__(self, filepath: str, size: int):
+        self.f = open(filepath, "wb")
+        self.f.truncate(size)
+        self.lock = threading.Lock()
+
+    def _write(self, offset, data):
+        with self.lock:
+            self.f.seek(offset)
+            self.f.write(data)
+
+    async def write(self, offset, data):
+        await asyncio.to_thread(self._write, offset, data)
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+async def _download_chunk(session, url, start, end, write, stats=None):
+    """
+    Bản async của youtube_downloader._download_chunk: lỗi thì retry tiếp từ byte đã nhận
+    write: coroutine function (offset trong stream, bytes)
+    """
+    pos = start
+    for attempt in range(CHUNK_RETRIES + 1):
+        try:
+            async with session.get(f"{url}&range={pos}-{end}", timeout=CHUNK_TIMEOUT) as response:
+                response.raise_for_status()
+                async for data in response.content.iter_chunked(READ_SIZE):
+                    write_start = time.perf_counter()
+                    await write(pos, data)
+                    pos += len(data)
+                    if stats:
+                        stats.on_data(len(data), time.perf_counter() - write_start)
+            if pos > end:
+                return end - start + 1
+            raise IOError(f"chunk {start}-{end} thiếu {end - pos + 1} bytes")
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError) as e:
+            if attempt == CHUNK_RETRIES:
+                raise
+            print(f"⚠️ Chunk {start}-{end} lỗi ({e}), thử lại {attempt + 1}/{CHUNK_RETRIES}")
+            await asyncio.sleep(0.5 * (attempt + 1))
+
+
+def _stream_size(stream):
+    # filesize có thể phải gửi HEAD (đồng bộ) nếu manifest không có contentLength
+    return stream.filesize if not (stream.is_sabr or stream.is_otf) else 0
+
+
+async def download_stream_ranged_async(stream, filepath, max_connections=MAX_CONNECTIONS, stats=None):
+    """
+    Tải 1 stream bằng nhiều kết nối (task asyncio, không phải thread), mỗi kết nối 1 chunk
+    &range=start-end ghi thẳng vào file đã cấp phát trước. Số kết nối tăng dần như bản đồng bộ.
+    Stream SABR / OTF hoặc file nhỏ thì tải bằng pytubefix trong thread.
+    """
+    total = await asyncio.to_thread(_stream_size, stream)
+    if total < RANGED_MIN_SIZE:
+        await asyncio.to_thread(
+            stream.download, output_path=os.path.dirname(filepath) or ".", filename=os.path.basename(filepath)
+        )
+        if stats:
+            stats.finish(os.path.getsize(filepath))
+        return filepath
+
+    session = await _get_session()
+    chunks = deque((start, min(start + RANGE_CHUNK_SIZE, total) - 1) for start in range(0, total, RANGE_CHUNK_SIZE))
+    progress = {"bytes": 0}
+    writer = await asyncio.to_thread(_FileWriter, filepath, total)
+
+    async def worker():
+        while chunks:
+            start, end = chunks.popleft()
+            progress["bytes"] += await _download_chunk(session, stream.url, start, end, writer.write, stats=stats)
+
+    pending = {asyncio.create_task(worker()) for _ in range(MIN_CONNECTIONS)}
+    connections = len(pending)
+    try:
+        # Mỗi RAMP_INTERVAL đo tốc độ: còn tăng >= RAMP_GAIN thì thêm 1 kết nối
+        last_rate = 0.0
+        last_bytes = 0
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=RAMP_INTERVAL, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            rate = (progress["bytes"] - last_bytes) / RAMP_INTERVAL
+            last_bytes = progress["bytes"]
+            if pending and connections < max_connections and chunks and rate >= last_rate * RAMP_GAIN:
+                pending.add(asyncio.create_task(worker()))
+                connections += 1
+            last_rate = rate
+    except BaseException:
+        # Lỗi hoặc bị hủy: dừng các kết nối còn lại, xóa file dở
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await asyncio.to_thread(writer.close)
+        os.remove(filepath)
+        raise
+    await asyncio.to_thread(writer.close)
+    if stats:
+        stats.finish()
+
+    print(f"⚡ Ranged download {total / 1024 / 1024:.1f} MB với tối đa {connections} kết nối (async)")
+    return filepath
+
+
+class StreamChunks:
+    """
+    Bản async của iter_stream_chunks: luôn có `window` chunk tải trước, `async for` trả bytes
+    từng chunk đúng thứ tự. Dừng giữa chừng thì phải gọi aclose() để hủy các chunk đang tải.
+    """
+
+    def __init__(self, session, stream, total, window=MIN_CONNECTIONS * 2, stats=None):
+        """total: kích thước stream (lấy trước bằng _stream_size trong thread, filesize có thể gửi HEAD)"""
+        self.session = session
+        self.stats = stats
+        self.url = stream.url
+        self.ranges = [(start, min(start + RANGE_CHUNK_SIZE, total) - 1) for start in range(0, total, RANGE_CHUNK_SIZE)]
+        # Bắt đầu tải `window` chunk đầu ngay khi tạo (trước khi bắt đầu đọc)
+        self.pending = deque(asyncio.create_task(self._fetch(*r)) for r in self.ranges[:window])
+        self.next_index = len(self.pending)
+
+    async def _fetch(self, start, end):
+        # Buffer trong RAM: ghi thẳng trên event loop (không đụng đĩa)
+        buffer = io.BytesIO()
+
+        async def write(offset, data):
+            buffer.seek(offset - start)
+            buffer.write(data)
+
+        await _download_chunk(self.session, self.url, start, end, write, stats=self.stats)
+        return buffer.getvalue()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.pending:
+            if self.stats:
+                self.stats.finish()
+            raise StopAsyncIteration
+        data = await self.pending[0]
+        self.pending.popleft()
+        if self.next_index < len(self.ranges):
+            self.pending.append(asyncio.create_task(self._fetch(*self.ranges[self.next_index])))
+            self.next_index += 1
+        return data
+
+    async def aclose(self):
+        for task in self.pending:
+            task.cancel()
+        await asyncio.gather(*self.pending, return_exceptions=True)
+        self.pending.clear()
+
+
+async def stream_mux_async(video_stream, audio_stream, output_file, metrics=None, trim_duration=None):
+    """
+    Tải video + audio và mux bằng ffmpeg (-c copy) trong lúc đang tải:
+    audio (nhỏ) tải ra file tạm, video đẩy thẳng vào stdin của ffmpeg (chạy được cả Windows).
+    trim_duration: ffmpeg dừng sau N giây, stdin bị đóng -> ngừng tải phần video còn lại
+    Returns: True nếu thành công, False để caller quay về cách tải file tạm + merge
+    """
+    if any(s.is_sabr or s.is_otf for s in (video_stream, audio_stream)):
+        return False
+
+    audio_file = f"{output_file}.audio.mp4"
+    process = None
+    video_chunks = None
+    ok = False
+    try:
+        session = await _get_session()
+        total = await asyncio.to_thread(_stream_size, video_stream)
+        # Bắt đầu tải trước video (window chunk) trong lúc tải audio ra file
+        video_chunks = StreamChunks(session, video_stream, total, stats=metrics.stream("video") if metrics else None)
+        await download_stream_ranged_async(audio_stream, audio_file, stats=metrics.stream("audio") if metrics else None)
+
+        # Process mux chiếm 1 slot của ffmpeg_pool suốt thời gian tải (app gọi trực tiếp, không qua slot
+        # của API server -> N row không chạy quá FFMPEG_WORKERS process ffmpeg cùng lúc)
+        async with ffmpeg_pool.async_slot():
+            process = await asyncio.create_subprocess_exec(
+                get_ffmpeg_path(),
+                "-y",
+                "-i", "pipe:0",
+                "-i", audio_file,
+                "-map", "0:v:0",
+                "-map", "1:a:0",
+                "-c:v", "copy",
+                "-c:a", "copy",
+                "-shortest",
+                *trim_args(trim_duration),
+                output_file,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stderr_task = asyncio.create_task(process.stderr.read())
+            try:
+                async for data in video_chunks:
+                    process.stdin.write(data)
+                    await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # ffmpeg thoát sớm (đủ -t / lỗi), returncode bên dưới sẽ báo lỗi
+            finally:
+                process.stdin.close()
+            stderr = await stderr_task
+            await process.wait()
+
+        if process.returncode != 0:
+            print(f"⚠️ Stream mux lỗi: {stderr.decode('utf-8', errors='ignore')[-200:]}")
+            return False
+        ok = True
+        return True
+    except NotImplementedError:
+        # Event loop không hỗ trợ subprocess (VD: một số loop trên Windows)
+        print("⚠️ Event loop không hỗ trợ subprocess, dùng merge thường")
+        return False
+    except Exception as e:
+        print(f"⚠️ Stream mux lỗi: {e}")
+        return False
+    finally:
+        if video_chunks is not None:
+            await video_chunks.aclose()
+        if process and process.returncode is None:
+            process.kill()
+            await process.wait()
+        for path in [audio_file] + ([] if ok else [output_file]):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+# -----------------------
+# Download
+# -----------------------
+async def download_youtube_video_async(
+    url,
+    download_path="Downloads",
+    max_resolution=720,
+    progressive_only=True,
+    return_metrics=False,
+    trim_duration=None
+):
+    """
+    Bản async của download_youtube_video: cùng chọn stream (prepare_streams / select_streams),
+    cùng lưu vào Downloads/{video_id}-{format} qua media_store
+    trim_duration: như download_youtube_video (cắt lúc mux, metrics["trimmed"])
+    Returns: đường dẫn file đã download hoặc None nếu lỗi (bị hủy thì raise CancelledError)
+             return_metrics=True: (đường dẫn hoặc None, dict metrics từng pha)
+    """
+    metrics = DownloadMetrics()
+    filepath = await _download_youtube_video_async(
+        url, download_path, max_resolution, progressive_only, metrics, trim_duration
+    )
+    metrics.finish()
+    return (filepath, metrics.to_dict()) if return_metrics else filepath
+
+
+async def _download_youtube_video_async(url, download_path, max_resolution, progressive_only, metrics,
+                                        trim_duration=None):
+    temp_files = []
+    try:
+        start_time = time.perf_counter()
+        os.makedirs(download_path, exist_ok=True)
+        disk = get_disk_manager(download_path)
+
+        prepared = await asyncio.to_thread(prepare_streams, url, max_resolution, metrics)
+        if not prepared:
+            return None
+
+        video_id = prepared["video_id"]
+        stream = prepared["progressive"]
+        video_stream = prepared["video_stream"]
+        audio_stream = prepared["audio_stream"]
+        print(f"📊 Selected resolution: {(stream or video_stream).resolution}")
+        trim, fmt, filename, metrics.info["trimmed"] = plan_output(prepared, trim_duration)
+        duration = min(prepared["length"], trim) if trim else prepared["length"]
+
+        existing = media_store.lookup(download_path, video_id, fmt)
+        if existing:
+            print(f"♻️ Đã có file {video_id}-{fmt}, bỏ qua download")
+            metrics.info["reused_file"] = True
+            disk.touch(existing)
+            return existing
+
+        merge_time = 0
+        if stream:
+            print(f"⬇️ Downloading progressive stream (async)...")
+            output_file = media_store.temp_path(download_path)
+            temp_files.append(output_file)
+            metrics.info["mode"] = "progressive"
+            with metrics.phase("download"):
+                await download_stream_ranged_async(stream, output_file, stats=metrics.stream("progressive"))
+            info = media_store.stream_info(stream)
+        else:
+            print(f"⬇️ Downloading adaptive streams (async)...")
+            output_file = media_store.temp_path(download_path)
+            temp_files.append(output_file)
+
+            mux_start = time.perf_counter()
+            muxed = mux_trim(video_stream, trim)
+            if trim:
+                print(f"✂️ Cắt {trim}s đầu ngay lúc mux")
+                if PARTIAL_DOWNLOAD:
+                    # Đọc sidx = 2 request nhỏ, chạy trong thread như prepare_streams
+                    video_stream, audio_stream = await asyncio.to_thread(
+                        partial_streams, video_stream, audio_stream, muxed, metrics
+                    )
+            if STREAM_MUX and await stream_mux_async(video_stream, audio_stream, output_file, metrics, muxed):
+                print("🔀 Streamed download + mux (không cần merge riêng)")
+                metrics.info["mode"] = "stream_mux"
+                metrics.add_phase("download", time.perf_counter() - mux_start)
+            else:
+                metrics.info["mode"] = "merge"
+                video_file = media_store.temp_path(download_path)
+                audio_file = media_store.temp_path(download_path)
+                temp_files += [video_file, audio_file]
+                with metrics.phase("download"):
+                    await asyncio.gather(
+                        download_stream_ranged_async(video_stream, video_file, stats=metrics.stream("video")),
+                        download_stream_ranged_async(audio_stream, audio_file, stats=metrics.stream("audio")),
+                    )
+
+                print(f"🔗 Merging audio and video...")
+                merge_start = time.perf_counter()
+                await asyncio.to_thread(
+                    merge_audio_video, video_file, audio_file, output_file, muxed, metrics=metrics
+                )
+                merge_time = time.perf_counter() - merge_start
+                metrics.add_phase("merge", merge_time)
+            # Smart-cut GOP cuối (ffmpeg qua pool) trong thread
+            await asyncio.to_thread(exact_trim, output_file, trim, muxed, metrics)
+            info = media_store.stream_info(video_stream, audio_stream)
+
+        with metrics.phase("publish"):
+            output_file = media_store.publish(
+                output_file, download_path, video_id, fmt, filename,
+                title=prepared["title"], duration=duration, **info
+            )
+        # Kiểm tra budget / dọn file mồ côi (duyệt thư mục) trong thread
+        await asyncio.to_thread(disk.maintain)
+
+        elapsed = time.perf_counter() - start_time
+        metrics.info["size"] = os.path.getsize(output_file)
+        size_kb = metrics.info["size"] / 1024
+        print(f"✅ Download complete in {elapsed:.1f}s (merge: {merge_time:.1f}s) | Size: {size_kb:.2f} KB")
+        return output_file
+
+    except asyncio.CancelledError:
+        print(f"🛑 Đã hủy download: {url}")
+        raise
+    except AgeRestrictedError:
+        print("❌ Video bị giới hạn tuổi.")
+        return None
+    except VideoUnavailable:
+        print("❌ Video không tồn tại hoặc private.")
+        return None
+    except Exception as e:
+        print(f"❌ Lỗi: {type(e).__name__} - {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+    finally:
+        # File tạm còn lại (đã publish thì đã được chuyển đi)
+        for path in temp_files:
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
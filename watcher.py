@@ -1,14 +1,176 @@
 import asyncio
+from collections import OrderedDict
+from datetime import datetime
 from googleapiclient.errors import HttpError
-from youtube_client import get_latest_video
+from token_rotator import QUOTA_COSTS, seconds_until_reset
+from youtube_client import (
+    get_recent_videos_async, get_recent_videos_rss, get_recent_videos_batch_async, get_playlist_backlog_async,
+    is_quota_exceeded, POLL_MODE, RECENT_COUNT
+)
 
-async def watch_channel(channel_id: str, rotator, interval=1, log_callback=None, video_callback=None):
+# Chi phí quota của 1 lần poll theo mode
+POLL_COSTS = {
+    "search": QUOTA_COSTS["search.list"],
+    "playlist": QUOTA_COSTS["playlistItems.list"],
+    "rss": 0,
+}
+
+
+async def handle_token_error(e: HttpError, token: str, rotator, log, tag: str):
+    """
+    Xử lý HttpError do token: hết quota -> đánh dấu và đổi ngay sang key còn quota (không sleep),
+    token lỗi khác -> đổi token như cũ.
+    """
+    if e.resp.status not in (400, 401, 403):
+        return
+
+    if is_quota_exceeded(e):
+        rotator.mark_exhausted(token)
+        if rotator.all_exhausted():
+            wait = min(seconds_until_reset(), 300)
+            log(f"⛔ [{tag}] Tất cả token đã hết quota, đợi {wait:.0f}s")
+            await asyncio.sleep(wait)
+            return
+        new = rotator.next()
+        log(f"⚠️ [{tag}] Token hết quota {token[:8]} → {new[:8]}")
+        return
+
+    new = rotator.next()
+    log(f"⚠️ [{tag}] Token lỗi {token[:8]} → {new[:8]}")
+    await asyncio.sleep(1)
+
+
+SEEN_LIMIT = 200      # Số video_id đã thấy giữ lại cho mỗi channel
+HWM_GRACE = 3600      # Video chưa thấy nhưng cũ hơn high-water mark quá 1 giờ -> log riêng (vẫn xử lý)
+
+
+def _published_ts(published_at):
+    if not published_at:
+        return None
+    try:
+        return datetime.fromisoformat(published_at.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+class ChannelHistory:
+    """
+    Theo dõi video đã thấy của 1 channel: seen-set (giới hạn SEEN_LIMIT) + high-water mark
+    (published_at, video_id) của video mới nhất. Mỗi video mới chỉ được trả về đúng 1 lần,
+    kể cả khi channel đăng nhiều video giữa 2 lần poll hoặc video mới nhất bị xoá.
+    Seen-set quyết định video nào là mới; high-water mark chỉ để nhận ra video publishedAt cũ
+    (hẹn giờ / private rồi mới public) và log lại, không bỏ qua video đó.
+    """
+
+    def __init__(self, channel_id: str):
+        self.channel_id = channel_id
+        self.seen = OrderedDict()
+        self.high_water = None  # (published_ts, video_id)
+        self.latest = None      # video mới nhất đã biết (để log)
+
+    @property
+    def ready(self) -> bool:
+        return self.latest is not None
+
+    def _mark_seen(self, video):
+        self.seen[video["video_id"]] = True
+        self.seen.move_to_end(video["video_id"])
+        while len(self.seen) > SEEN_LIMIT:
+            self.seen.popitem(last=False)
+
+        ts = _published_ts(video.get("published_at"))
+        if ts is not None and (self.high_water is None or (ts, video["video_id"]) > self.high_water):
+            self.high_water = (ts, video["video_id"])
+            self.latest = video
+        elif self.latest is None:
+            self.latest = video
+
+    def needs_backlog(self, videos) -> bool:
+        """Đã có baseline và cả trang vừa poll (đủ RECENT_COUNT video) đều chưa thấy -> có thể còn video cũ hơn"""
+        videos = [v for v in videos or [] if v.get("video_id")]
+        return (self.ready and len(videos) >= RECENT_COUNT
+                and not any(v["video_id"] in self.seen for v in videos))
+
+    def _is_stale(self, video) -> bool:
+        ts = _published_ts(video.get("published_at"))
+        return ts is not None and self.high_water is not None and ts < self.high_water[0] - HWM_GRACE
+
+    def update(self, videos):
+        """
+        videos: list {video_id, title, published_at} (thứ tự bất kỳ)
+        Returns: (event, list video)
+            "baseline" - lần đầu, [video mới nhất]
+            "new"      - các video chưa thấy, cũ trước mới sau
+            "same"     - không có gì mới, [video mới nhất đã biết]
+        """
+        videos = [v for v in videos or [] if v.get("video_id")]
+        if not videos:
+            return None, []
+
+        if not self.ready:
+            for video in videos:
+                self._mark_seen(video)
+            return "baseline", [self.latest]
+
+        unseen = [v for v in videos if v["video_id"] not in self.seen]
+        unseen.sort(key=lambda v: (_published_ts(v.get("published_at")) or 0, v["video_id"]))
+
+        late = [v["video_id"] for v in unseen if self._is_stale(v)]
+        if late:
+            print(f"⚠️ [{self.channel_id}] Video mới nhưng publishedAt cũ hơn video mới nhất đã thấy "
+                  f"(hẹn giờ / vừa chuyển public?): {', '.join(late)}")
+
+        for video in unseen:
+            self._mark_seen(video)
+        if unseen:
+            return "new", unseen
+        return "same", [self.latest]
+
+    def known_ids(self):
+        return self.seen.keys()
+
+
+async def fetch_backlog(history: ChannelHistory, videos, token, rotator):
+    """
+    Trang vừa poll toàn video chưa thấy -> đọc tiếp playlist (pageToken) tới khi gặp video đã thấy
+    để không sót video nào. Returns: videos gộp thêm phần cũ hơn (lỗi API thì raise HttpError,
+    caller không cập nhật history để lần poll sau đọc lại)
+    """
+    if not history.needs_backlog(videos):
+        return videos
+    older, pages = await get_playlist_backlog_async(history.channel_id, token, history.known_ids(),
+                                                    charge=rotator.charge)
+    rotator.charge(token, pages * QUOTA_COSTS["playlistItems.list"])
+    if not any(v["video_id"] in history.seen for v in older):
+        print(f"⚠️ [{history.channel_id}] Đọc {pages} trang vẫn chưa gặp video đã thấy, "
+              f"chỉ lấy {len(older)} video gần nhất")
+    merged = {v["video_id"]: v for v in older}
+    merged.update({v["video_id"]: v for v in videos})
+    print(f"📚 [{history.channel_id}] Có hơn {len(videos)} video mới, đọc thêm {pages} trang "
+          f"({len(merged)} video)")
+    return list(merged.values())
+
+
+async def watch_channel(channel_id: str, rotator, interval=1, log_callback=None, video_callback=None, mode=POLL_MODE,
+                        scheduler=None, prepare_callback=None):
     """
     Theo dõi video mới của channel.
     log_callback: function nhận string để log vào GUI hoặc file
     video_callback: function nhận video_url khi có video mới
+    mode: "playlist" (1 quota / lần poll), "search" (100 quota / lần poll) hoặc "rss" (không tốn quota)
+    scheduler: PollScheduler (tùy chọn) - interval thích ứng theo lịch sử upload thay cho interval cố định
+    prepare_callback: function (sync) nhận video_url ngay khi phát hiện, để resolve stream / tải trước
     """
-    baseline_video_id = None
+    history = ChannelHistory(channel_id)
+
+    async def fetch_recent(token):
+        if mode == "rss":
+            return await get_recent_videos_rss(channel_id, known_ids=history.known_ids())
+        result = await get_recent_videos_async(channel_id, token, mode, charge=rotator.charge)
+        rotator.charge(token, POLL_COSTS.get(mode, 1))
+        if mode == "playlist":
+            result = await fetch_backlog(history, result, token, rotator)
+        return result
 
     def log(msg, video_link=None):
         print(msg)  # in ra console để debug
@@ -19,15 +181,14 @@ async def watch_channel(channel_id: str, rotator, interval=1, log_callback=None,
     print(f"🔹 Starting watch_channel for {channel_id}")
     
     # ===== 1️⃣ LẤY VIDEO MỚI NHẤT BAN ĐẦU =====
-    while baseline_video_id is None:
+    while not history.ready:
         token = rotator.current()
         try:
             print(f"⏳ [{channel_id}] Using token {token[:8]} to get latest video")
-            result = await asyncio.to_thread(get_latest_video, channel_id, token)
+            event, videos = history.update(await fetch_recent(token))
 
-            if result and "video_id" in result and result["video_id"]:
-                baseline_video_id = result["video_id"]
-                log(f"▶ [{channel_id}] baseline set = {baseline_video_id}")
+            if event == "baseline":
+                log(f"▶ [{channel_id}] baseline set = {videos[0]['video_id']}")
                 print(f"✅ [{channel_id}] Baseline video ID set")
                 break
             else:
@@ -35,12 +196,7 @@ async def watch_channel(channel_id: str, rotator, interval=1, log_callback=None,
                 await asyncio.sleep(2)
 
         except HttpError as e:
-            if e.resp.status in (400, 401, 403):
-                old = token
-                new = rotator.next()
-                log(f"⚠️ [{channel_id}] Token lỗi {old[:8]} → {new[:8]}")
-                print(f"⚠️ [{channel_id}] Token lỗi, đổi token")
-                await asyncio.sleep(1)
+            await handle_token_error(e, token, rotator, log, channel_id)
 
         except Exception as e:
             log(f"❌ [{channel_id}] init error: {e}")
@@ -52,37 +208,162 @@ async def watch_channel(channel_id: str, rotator, interval=1, log_callback=None,
     while True:
         token = rotator.current()
         try:
-            result = await asyncio.to_thread(get_latest_video, channel_id, token)
+            event, videos = history.update(await fetch_recent(token))
 
-            if result and "video_id" in result:
-                video_id = result["video_id"]
-
-                if video_id != baseline_video_id:
-                    baseline_video_id = video_id
-                    video_url = f"https://www.youtube.com/watch?v={video_id}"
-                    log(f"🔥 [{channel_id}] NEW VIDEO: {result.get('title', '')} | token {token[:8]}", video_url)
+            if event == "new":
+                # Resolve stream cho tất cả video mới trước, song song với việc xử lý từng video
+                if prepare_callback:
+                    for video in videos:
+                        prepare_callback(f"https://www.youtube.com/watch?v={video['video_id']}")
+                # Gọi callback cho từng video mới, cũ trước mới sau
+                for video in videos:
+                    video_url = f"https://www.youtube.com/watch?v={video['video_id']}"
+                    log(f"🔥 [{channel_id}] NEW VIDEO: {video.get('title', '')} | token {token[:8]}", video_url)
                     print(f"🔥 [{channel_id}] NEW VIDEO detected: {video_url}")
+                    if scheduler:
+                        scheduler.record_upload(channel_id, _published_ts(video.get("published_at")))
                     # Gọi callback để download và upload
                     if video_callback:
                         await video_callback(video_url)
-                else:
-                    log(f"⏱ [{channel_id}] no new video, latest = {baseline_video_id}")
-                    print(f"⏱ [{channel_id}] Checked: no new video")
+            elif event == "same":
+                log(f"⏱ [{channel_id}] no new video, latest = {videos[0]['video_id']}")
+                print(f"⏱ [{channel_id}] Checked: no new video")
 
-            else:
-                print(f"⚠️ [{channel_id}] Result empty or missing 'video_id': {result}")
-
-            await asyncio.sleep(interval)
+            await asyncio.sleep(scheduler.interval_for(channel_id) if scheduler else interval)
 
         except HttpError as e:
-            if e.resp.status in (400, 401, 403):
-                old = token
-                new = rotator.next()
-                log(f"⚠️ [{channel_id}] Token lỗi {old[:8]} → {new[:8]}")
-                print(f"⚠️ [{channel_id}] HttpError token invalid, switch token")
-                await asyncio.sleep(1)
+            await handle_token_error(e, token, rotator, log, channel_id)
 
         except Exception as e:
             log(f"❌ [{channel_id}] Lỗi khác: {e}")
             print(f"❌ [{channel_id}] Unexpected error: {e}")
             await asyncio.sleep(5)
+
+
+class BatchPoller:
+    """
+    Poll tập trung cho nhiều channel: mỗi chu kỳ gom tối đa 50 channel vào 1 HTTP request
+    (thay vì mỗi channel 1 vòng watch_channel riêng), rồi đẩy kết quả về watch() của từng channel.
+    """
+
+    def __init__(self, rotator, interval=1, push_source=None, scheduler=None, prepare_callback=None):
+        self.rotator = rotator
+        self.interval = interval
+        # Nguồn push (WebSubReceiver): channel còn lease thì không cần poll
+        self.push_source = push_source
+        # PollScheduler (tùy chọn): mỗi chu kỳ chỉ poll channel đến lượt theo lịch thích ứng
+        self.scheduler = scheduler
+        # prepare_callback(video_url): gọi ngay khi phát hiện (kể cả khi row đang bận video trước)
+        self.prepare_callback = prepare_callback
+        self._queues = {}     # channel_id -> [asyncio.Queue] (1 channel có thể được nhiều row theo dõi)
+        self._histories = {}  # channel_id -> ChannelHistory
+
+    async def watch(self, channel_id: str, log_callback=None, video_callback=None):
+        """
+        Đăng ký theo dõi channel, giữ nguyên signature callback của watch_channel.
+        Chạy đến khi bị cancel.
+        """
+        def log(msg, video_link=None):
+            print(msg)
+            if log_callback:
+                log_callback(msg, video_link)
+
+        queue = asyncio.Queue()
+        self._queues.setdefault(channel_id, []).append(queue)
+        print(f"🔹 [{channel_id}] Registered to batch poller")
+
+        try:
+            while True:
+                event, result = await queue.get()
+                if event == "baseline":
+                    log(f"▶ [{channel_id}] baseline set = {result['video_id']}")
+                elif event == "same":
+                    log(f"⏱ [{channel_id}] no new video, latest = {result['video_id']}")
+                elif event == "new":
+                    video_url = f"https://www.youtube.com/watch?v={result['video_id']}"
+                    log(f"🔥 [{channel_id}] NEW VIDEO: {result.get('title', '')}", video_url)
+                    print(f"🔥 [{channel_id}] NEW VIDEO detected: {video_url}")
+                    if video_callback:
+                        await video_callback(video_url)
+        finally:
+            self._queues[channel_id].remove(queue)
+            if not self._queues[channel_id]:
+                del self._queues[channel_id]
+
+    def _dispatch(self, channel_id: str, videos):
+        history = self._histories.setdefault(channel_id, ChannelHistory(channel_id))
+        event, videos = history.update(videos)
+        if event is None:
+            return
+
+        if event == "new":
+            for video in videos:
+                if self.scheduler:
+                    self.scheduler.record_upload(channel_id, _published_ts(video.get("published_at")))
+                if self.prepare_callback and channel_id in self._queues:
+                    self.prepare_callback(f"https://www.youtube.com/watch?v={video['video_id']}")
+
+        for queue in self._queues.get(channel_id, []):
+            # Row đang bận xử lý video thì bỏ qua log "no new video" để không dồn queue
+            if event == "same" and not queue.empty():
+                continue
+            for video in videos:
+                queue.put_nowait((event, video))
+
+    def push(self, channel_id: str, result):
+        """Nhận video từ nguồn push (WebSub) và đẩy vào cùng pipeline với poll"""
+        # Chưa có baseline thì bỏ qua: lần poll đầu sẽ lấy cả video này làm baseline
+        history = self._histories.get(channel_id)
+        if channel_id in self._queues and history and history.ready:
+            self._dispatch(channel_id, [result])
+
+    def _needs_poll(self, channel_id: str) -> bool:
+        # Luôn poll lần đầu để có baseline, sau đó chỉ poll channel không có lease push
+        history = self._histories.get(channel_id)
+        if not history or not history.ready:
+            return True
+        return not (self.push_source and self.push_source.has_lease(channel_id))
+
+    async def poll_once(self):
+        channel_ids = [c for c in self._queues if self._needs_poll(c)]
+        if self.scheduler:
+            channel_ids = self.scheduler.due_channels(channel_ids)
+        if not channel_ids:
+            return
+
+        token = self.rotator.current()
+        try:
+            results = await get_recent_videos_batch_async(channel_ids, token, charge=self.rotator.charge)
+            self.rotator.charge(token, len(channel_ids) * QUOTA_COSTS["playlistItems.list"])
+        except HttpError as e:
+            await handle_token_error(e, token, self.rotator, print, "batch")
+            return
+
+        # Channel có cả trang đều mới: đọc thêm các trang cũ hơn (song song) trước khi dispatch
+        backlog = [c for c, videos in results.items()
+                   if c in self._histories and self._histories[c].needs_backlog(videos)]
+        if backlog:
+            fetched = await asyncio.gather(
+                *(fetch_backlog(self._histories[c], results[c], token, self.rotator) for c in backlog),
+                return_exceptions=True
+            )
+            for channel_id, videos in zip(backlog, fetched):
+                if isinstance(videos, Exception):
+                    # Không dispatch: history giữ nguyên, chu kỳ sau poll lại cả trang này
+                    print(f"⚠️ [{channel_id}] Không đọc được video cũ hơn: {videos}")
+                    results.pop(channel_id)
+                else:
+                    results[channel_id] = videos
+
+        for channel_id, videos in results.items():
+            self._dispatch(channel_id, videos)
+
+    async def run(self):
+        print("🔹 Batch poller started")
+        while True:
+            try:
+                await self.poll_once()
+            except Exception as e:
+                print(f"❌ [batch] Unexpected error: {e}")
+                await asyncio.sleep(5)
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,216 @@
+"""
+WebSub (PubSubHubbub) receiver - YouTube push thông báo khi channel upload video mới
+thay vì phải poll API liên tục.
+Chạy chung process với runner (main_no_ui) để đẩy video thẳng vào BatchPoller:
+    receiver = WebSubReceiver("https://<public-host>/websub", on_video=poller.push)
+    poller.push_source = receiver
+    asyncio.create_task(serve(receiver, port=8001))
+Channel nào mất lease (hub không xác nhận / hết hạn) sẽ tự động quay lại poll.
+"""
+import asyncio
+import hashlib
+import hmac
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from typing import Optional
+import httpx
+from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi.responses import PlainTextResponse
+
+HUB_URL = "https://pubsubhubbub.appspot.com/subscribe"
+TOPIC_URL = "https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}"
+LEASE_SECONDS = 5 * 24 * 3600  # Hub của Google cho tối đa ~10 ngày
+RENEW_BEFORE = 3600            # Gia hạn trước khi hết lease 1 giờ
+RENEW_CHECK_INTERVAL = 60
+RESUBSCRIBE_INTERVAL = 300     # Hub chưa xác nhận thì 5 phút sau mới gửi lại
+MAX_VIDEO_AGE = 6 * 3600       # Bỏ qua notification của video cũ (sửa title/description)
+
+ATOM_NS = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+
+
+def parse_atom_notification(body: bytes):
+    """
+    Parse Atom payload từ hub
+    Returns: list dict {channel_id, video_id, title, published} (bỏ qua deleted-entry)
+    """
+    root = ET.fromstring(body)
+    videos = []
+    for entry in root.findall("atom:entry", ATOM_NS):
+        video_id = entry.findtext("yt:videoId", namespaces=ATOM_NS)
+        channel_id = entry.findtext("yt:channelId", namespaces=ATOM_NS)
+        if not video_id or not channel_id:
+            continue
+        videos.append({
+            "channel_id": channel_id,
+            "video_id": video_id,
+            "title": entry.findtext("atom:title", default="", namespaces=ATOM_NS),
+            "published": entry.findtext("atom:published", namespaces=ATOM_NS),
+        })
+    return videos
+
+
+def _is_fresh(published: Optional[str]) -> bool:
+    if not published:
+        return True
+    try:
+        published_at = datetime.fromisoformat(published.replace("Z", "+00:00"))
+    except ValueError:
+        return True
+    return (datetime.now(timezone.utc) - published_at).total_seconds() <= MAX_VIDEO_AGE
+
+
+class WebSubReceiver:
+    """
+    Quản lý subscription + endpoint callback cho hub.
+    on_video(channel_id, {video_id, title, published_at}) được gọi khi có video mới.
+    """
+
+    def __init__(self, callback_url: str, on_video, secret: Optional[str] = None,
+                 hub_url: str = HUB_URL, lease_seconds: int = LEASE_SECONDS):
+        self.callback_url = callback_url
+        self.on_video = on_video
+        self.secret = secret
+        self.hub_url = hub_url
+        self.lease_seconds = lease_seconds
+
+        self.channels = set()  # channel đã yêu cầu subscribe
+        self.leases = {}       # channel_id -> thời điểm hết lease (time.time())
+        self._requested = {}   # channel_id -> lần cuối gửi subscribe
+        self._client = httpx.AsyncClient(timeout=15.0)
+
+        self.router = APIRouter()
+        self.router.add_api_route("/websub", self.verify, methods=["GET"])
+        self.router.add_api_route("/websub", self.notify, methods=["POST"])
+
+    def has_lease(self, channel_id: str) -> bool:
+        return self.leases.get(channel_id, 0) > time.time()
+
+    async def subscribe(self, channel_id: str, mode: str = "subscribe"):
+        """Gửi yêu cầu subscribe/unsubscribe lên hub (hub xác nhận lại qua GET /websub)"""
+        if mode == "subscribe":
+            self.channels.add(channel_id)
+            self._requested[channel_id] = time.time()
+        else:
+            self.channels.discard(channel_id)
+
+        data = {
+            "hub.callback": self.callback_url,
+            "hub.topic": TOPIC_URL.format(channel_id=channel_id),
+            "hub.verify": "async",
+            "hub.mode": mode,
+            "hub.lease_seconds": str(self.lease_seconds),
+        }
+        if self.secret:
+            data["hub.secret"] = self.secret
+
+        try:
+            response = await self._client.post(self.hub_url, data=data)
+            if response.status_code not in (202, 204):
+                print(f"⚠️ [{channel_id}] WebSub {mode} lỗi {response.status_code}: {response.text[:200]}")
+                return False
+            return True
+        except httpx.HTTPError as e:
+            print(f"⚠️ [{channel_id}] WebSub {mode} lỗi: {e}")
+            return False
+
+    async def verify(self, request: Request):
+        """Hub gọi GET để xác nhận subscription (trả lại hub.challenge)"""
+        params = request.query_params
+        mode = params.get("hub.mode")
+        topic = params.get("hub.topic", "")
+        channel_id = topic.split("channel_id=")[-1] if "channel_id=" in topic else None
+
+        if mode == "denied":
+            if channel_id:
+                self.leases.pop(channel_id, None)
+                print(f"⚠️ [{channel_id}] WebSub bị từ chối: {params.get('hub.reason', '')}, quay lại poll")
+            return Response(status_code=200)
+
+        if not channel_id or (mode == "subscribe" and channel_id not in self.channels):
+            return Response(status_code=404)
+
+        if mode == "subscribe":
+            lease = int(params.get("hub.lease_seconds") or self.lease_seconds)
+            self.leases[channel_id] = time.time() + lease
+            print(f"✅ [{channel_id}] WebSub lease {lease}s")
+        elif mode == "unsubscribe":
+            self.leases.pop(channel_id, None)
+
+        return PlainTextResponse(params.get("hub.challenge", ""))
+
+    async def notify(self, request: Request):
+        """Hub POST Atom payload khi có video mới / cập nhật"""
+        body = await request.body()
+
+        if self.secret:
+            signature = request.headers.get("X-Hub-Signature", "")
+            algo, _, digest = signature.partition("=")
+            if algo not in ("sha1", "sha256"):
+                return Response(status_code=202)
+            expected = hmac.new(self.secret.encode(), body, getattr(hashlib, algo)).hexdigest()
+            if not hmac.compare_digest(expected, digest):
+                # Theo spec: vẫn trả 2xx nhưng bỏ qua payload giả mạo
+                print("⚠️ WebSub signature không hợp lệ, bỏ qua")
+                return Response(status_code=202)
+
+        try:
+            videos = parse_atom_notification(body)
+        except ET.ParseError as e:
+            print(f"⚠️ WebSub payload lỗi: {e}")
+            return Response(status_code=202)
+
+        for video in videos:
+            if not _is_fresh(video["published"]):
+                continue
+            print(f"📨 [{video['channel_id']}] WebSub push: {video['video_id']}")
+            self.on_video(video["channel_id"], {
+                "video_id": video["video_id"],
+                "title": video["title"],
+                "published_at": video["published"],
+            })
+
+        return Response(status_code=204)
+
+    async def run_renewal(self):
+        """Gia hạn lease trước khi hết hạn; channel mất lease sẽ được poller poll lại"""
+        while True:
+            now = time.time()
+            for channel_id in list(self.channels):
+                if channel_id in self.leases and self.leases[channel_id] <= now:
+                    print(f"⚠️ [{channel_id}] WebSub lease hết hạn, quay lại poll")
+                    del self.leases[channel_id]
+                if self.leases.get(channel_id, 0) - now >= RENEW_BEFORE:
+                    continue
+                if now - self._requested.get(channel_id, 0) >= RESUBSCRIBE_INTERVAL:
+                    await self.subscribe(channel_id)
+            await asyncio.sleep(RENEW_CHECK_INTERVAL)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def create_app(receiver: WebSubReceiver) -> FastAPI:
+    app = FastAPI(title="YouTube WebSub Receiver", version="1.0.0")
+    app.include_router(receiver.router)
+
+    @app.get("/health")
+    async def health_check():
+        return {
+            "status": "healthy",
+            "service": "websub",
+            "subscribed": len(receiver.channels),
+            "active_leases": sum(1 for c in receiver.channels if receiver.has_lease(c)),
+        }
+
+    return app
+
+
+async def serve(receiver: WebSubReceiver, host: str = "0.0.0.0", port: int = 8001):
+    """Chạy receiver trong event loop hiện tại (cùng process với poller)"""
+    import uvicorn
+    config = uvicorn.Config(create_app(receiver), host=host, port=port, log_level="warning")
+    await uvicorn.Server(config).serve()
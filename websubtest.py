@@ -0,0 +1,218 @@
+"""
+Kiểm tra WebSub receiver với hub giả chạy local (không cần public URL / hub của Google)
+Hub giả: nhận subscribe -> GET xác nhận (hub.challenge) -> POST Atom payload có chữ ký HMAC
+Kiểm tra BatchPoller.push phát video mới đúng 1 lần và payload sai chữ ký bị bỏ qua
+Chạy: python websubtest.py
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+import uvicorn
+
+import youtube_client
+from polltest import StubAPI, StubRotator, start_stub_server
+from watcher import BatchPoller
+from websub_server import WebSubReceiver, create_app
+
+SECRET = "websub-test-secret"
+
+ATOM_TEMPLATE = """<?xml version='1.0' encoding='UTF-8'?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+ <link rel="hub" href="{hub}"/>
+ <link rel="self" href="https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}"/>
+ <title>YouTube video feed</title>
+ <updated>{published}</updated>
+ <entry>
+  <id>yt:video:{video_id}</id>
+  <yt:videoId>{video_id}</yt:videoId>
+  <yt:channelId>{channel_id}</yt:channelId>
+  <title>{title}</title>
+  <link rel="alternate" href="https://www.youtube.com/watch?v={video_id}"/>
+  <author><name>Stub channel</name><uri>https://www.youtube.com/channel/{channel_id}</uri></author>
+  <published>{published}</published>
+  <updated>{published}</updated>
+ </entry>
+</feed>
+"""
+
+
+class StubHub:
+    """
+    Hub giả: POST /subscribe trả 202 rồi xác nhận bất đồng bộ bằng GET tới hub.callback
+    (giống pubsubhubbub.appspot.com với hub.verify=async), publish() gửi Atom payload đã ký
+    """
+
+    def __init__(self):
+        self.subscriptions = {}  # topic -> form subscribe (callback, secret, lease...)
+        self.verified = {}       # topic -> receiver trả đúng hub.challenge
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                form = {k: v[0] for k, v in parse_qs(body).items()}
+                if self.path != "/subscribe" or "hub.callback" not in form:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                self.send_response(202)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                threading.Thread(target=hub._verify, args=(form,), daemon=True).start()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/subscribe"
+
+    def _verify(self, form):
+        challenge = secrets.token_hex(8)
+        topic = form["hub.topic"]
+        response = requests.get(form["hub.callback"], params={
+            "hub.mode": form["hub.mode"],
+            "hub.topic": topic,
+            "hub.challenge": challenge,
+            "hub.lease_seconds": form.get("hub.lease_seconds", "3600"),
+        }, timeout=5)
+        self.verified[topic] = response.status_code == 200 and response.text == challenge
+        if self.verified[topic] and form["hub.mode"] == "subscribe":
+            self.subscriptions[topic] = form
+
+    def publish(self, channel_id, video_id, secret=None, published=None, signed=True):
+        """POST Atom payload tới callback đã subscribe. secret: ghi đè để giả chữ ký sai"""
+        topic = f"https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}"
+        form = self.subscriptions[topic]
+        published = published or datetime.now(timezone.utc)
+        body = ATOM_TEMPLATE.format(
+            hub=self.url, channel_id=channel_id, video_id=video_id, title=f"Video {video_id}",
+            published=published.strftime("%Y-%m-%dT%H:%M:%S+00:00"),
+        ).encode()
+        headers = {"Content-Type": "application/atom+xml"}
+        if signed:
+            key = (secret or form.get("hub.secret", "")).encode()
+            headers["X-Hub-Signature"] = "sha1=" + hmac.new(key, body, hashlib.sha1).hexdigest()
+        return requests.post(form["hub.callback"], data=body, headers=headers, timeout=5).status_code
+
+    def close(self):
+        self.server.shutdown()
+
+
+async def main():
+    api = StubAPI()
+    api_server = start_stub_server(api)
+    base_url = f"http://127.0.0.1:{api_server.server_address[1]}"
+    youtube_client.API_URL = f"{base_url}/youtube/v3"
+    youtube_client.BATCH_URL = f"{base_url}/batch"
+    youtube_client.PLAYLIST_CACHE_FILE = os.path.join(tempfile.mkdtemp(prefix="websubtest_"), "playlists.json")
+
+    hub = StubHub()
+    poller = BatchPoller(StubRotator(), interval=0)
+
+    # Receiver chạy bằng uvicorn trên cổng trống của loopback, cùng event loop với poller
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    callback_url = f"http://127.0.0.1:{sock.getsockname()[1]}/websub"
+    receiver = WebSubReceiver(callback_url, on_video=poller.push, secret=SECRET, hub_url=hub.url)
+    poller.push_source = receiver
+    server = uvicorn.Server(uvicorn.Config(create_app(receiver), log_level="warning"))
+    server_task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    print("=" * 60)
+    print(f"📡 WEBSUB: hub giả {hub.url} -> receiver {callback_url}")
+    print("=" * 60)
+    failures = []
+
+    def check(ok, message):
+        print(f"   {'✅' if ok else '❌'} {message}")
+        if not ok:
+            failures.append(message)
+
+    channel_id = "UC000001"
+    api.add_video(channel_id, "old-1")
+    detected = []
+
+    async def on_video(video_url):
+        detected.append(video_url.rsplit("=", 1)[-1])
+
+    watch_task = asyncio.create_task(poller.watch(channel_id, video_callback=on_video))
+
+    async def settle():
+        # Đợi watch() xử lý hết queue
+        for _ in range(20):
+            await asyncio.sleep(0.01)
+
+    async def publish(*args, **kwargs):
+        status = await asyncio.to_thread(hub.publish, *args, **kwargs)
+        await settle()
+        return status
+
+    try:
+        # 1. Baseline bằng poll (push chỉ dùng sau khi đã có baseline)
+        await asyncio.sleep(0)  # để watch() đăng ký channel trước
+        await poller.poll_once()
+        await settle()
+
+        # 2. Subscribe -> hub GET xác nhận -> có lease -> channel không còn cần poll
+        check(await receiver.subscribe(channel_id), "hub nhận subscribe (202)")
+        deadline = time.time() + 5
+        while not receiver.has_lease(channel_id) and time.time() < deadline:
+            await asyncio.sleep(0.05)
+        topic = f"https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}"
+        check(hub.verified.get(topic), "receiver trả đúng hub.challenge")
+        check(receiver.has_lease(channel_id) and not poller._needs_poll(channel_id),
+              "có lease -> BatchPoller bỏ qua poll channel này")
+
+        # 3. Chữ ký sai / thiếu chữ ký -> bỏ qua
+        await publish(channel_id, "forged-1", secret="wrong-secret")
+        await publish(channel_id, "forged-2", signed=False)
+        check(not detected, f"payload sai / thiếu chữ ký bị bỏ qua (phát: {detected})")
+
+        # 4. Video mới -> phát đúng 1 lần, kể cả khi hub gửi lại (cập nhật title...)
+        status = await publish(channel_id, "new-1")
+        await publish(channel_id, "new-1")
+        check(status == 204 and detected == ["new-1"], f"video mới phát đúng 1 lần qua push (phát: {detected})")
+
+        # 5. Mất lease -> quay lại poll, video đã nhận qua push không bị phát lại
+        api.add_video(channel_id, "new-1")
+        receiver.leases.pop(channel_id)
+        await poller.poll_once()
+        await settle()
+        check(detected == ["new-1"], f"poll sau push không phát lại (phát: {detected})")
+
+        # 6. Notification của video cũ (sửa title/description) -> bỏ qua
+        receiver.leases[channel_id] = time.time() + 3600
+        await publish(channel_id, "old-2", published=datetime.now(timezone.utc) - timedelta(days=2))
+        check(detected == ["new-1"], "video cũ (quá MAX_VIDEO_AGE) bị bỏ qua")
+    finally:
+        watch_task.cancel()
+        await asyncio.gather(watch_task, return_exceptions=True)
+        server.should_exit = True
+        await server_task
+        await receiver.close()
+        await youtube_client.close_http_client()
+        hub.close()
+        api_server.shutdown()
+
+    print("-" * 60)
+    print("✅ WebSub OK" if not failures else f"❌ {len(failures)} kiểm tra lỗi")
+    return not failures
+
+
+if __name__ == "__main__":
+    sys.exit(0 if asyncio.run(main()) else 1)
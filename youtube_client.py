@@ -1,26 +1,661 @@
-from googleapiclient.discovery import build
-
-def get_latest_video(channel_id: str, api_key: str):
-    yt = build(
-        "youtube",
-        "v3",
-        developerKey=api_key,
-        cache_discovery=False
-    )
+import json
+import os
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import deque
+from email.parser import BytesParser
+from urllib.parse import urlencode, urlparse
+import httpx
+import httplib2
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+from token_rotator import QUOTA_COSTS
+
+# Chế độ poll mặc định:
+#   "search"   -> search().list(order="date"), tốn 100 quota / lần
+#   "playlist" -> playlistItems().list trên playlist "UU..." của channel, tốn 1 quota / lần
+#   "rss"      -> feed public feeds/videos.xml, không tốn quota (không cần token)
+POLL_MODE = "playlist"
+
+# Cache channel_id -> uploads playlist id (lưu ra file để restart không phải resolve lại)
+PLAYLIST_CACHE_FILE = "playlist_cache.json"
+
+_cache_lock = threading.Lock()
+_playlist_cache = None  # {channel_id: playlist_id}
+_etag_cache = {}        # {(playlist_id, count): (etag, result)} - 304 chỉ hợp lệ cho đúng maxResults đã gửi
+_missing_channels = {}  # {channel_id: thời điểm channels.list báo không tồn tại}
+
+# Channel không tồn tại (bị xóa / id sai) thì bao lâu mới resolve lại
+MISSING_TTL = 60 * 60
+
+# Số request tối đa gom vào 1 HTTP round trip (batch / multi-id)
+BATCH_SIZE = 50
+
+# Số video gần nhất lấy về mỗi lần poll (để không sót khi channel đăng nhiều video giữa 2 lần poll)
+RECENT_COUNT = 5
+# Cả RECENT_COUNT video đều mới -> đọc tiếp playlist theo pageToken (50 video / trang, tối đa 4 trang)
+BACKLOG_PAGE_SIZE = 50
+BACKLOG_PAGES = 4
+
+# Pool client theo API key: discovery document (bundled sẵn trong googleapiclient)
+# chỉ parse 1 lần, mỗi client giữ 1 httplib2.Http keep-alive.
+# httplib2.Http không thread-safe nên pool tách theo thread (asyncio.to_thread).
+HTTP_TIMEOUT = 15
+_discovery_doc = None
+_discovery_lock = threading.Lock()
+_pool_local = threading.local()
+
+# Thời gian mỗi lần gọi: (build_s, request_s) của N lần gần nhất
+_call_timings = deque(maxlen=1000)
+
+
+def _load_playlist_cache():
+    global _playlist_cache
+    if _playlist_cache is not None:
+        return _playlist_cache
+    _playlist_cache = {}
+    if os.path.exists(PLAYLIST_CACHE_FILE):
+        try:
+            with open(PLAYLIST_CACHE_FILE, "r", encoding="utf-8") as f:
+                _playlist_cache = json.load(f)
+        except Exception as e:
+            print(f"⚠️ Không đọc được {PLAYLIST_CACHE_FILE}: {e}")
+    return _playlist_cache
+
+
+def _save_playlist_cache():
+    tmp_file = f"{PLAYLIST_CACHE_FILE}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(_playlist_cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, PLAYLIST_CACHE_FILE)
+
 
+def _channels_to_resolve(channel_ids):
+    """Channel chưa có trong cache, bỏ qua channel vừa bị báo không tồn tại (trong MISSING_TTL)"""
+    now = time.time()
+    with _cache_lock:
+        cache = _load_playlist_cache()
+        return [
+            c for c in channel_ids
+            if c not in cache and now - _missing_channels.get(c, 0) >= MISSING_TTL
+        ]
+
+
+def _store_playlists(chunk, res):
+    """Lưu kết quả channels.list; id không có trong kết quả -> nhớ là không tồn tại"""
+    with _cache_lock:
+        found = set()
+        for item in res.get("items", []):
+            _playlist_cache[item["id"]] = item["contentDetails"]["relatedPlaylists"]["uploads"]
+            found.add(item["id"])
+        now = time.time()
+        for channel_id in chunk:
+            if channel_id not in found:
+                _missing_channels[channel_id] = now
+        if found:
+            _save_playlist_cache()
+
+
+def resolve_uploads_playlists(yt, channel_ids):
+    """
+    Resolve nhiều channel -> playlist "UU..." cùng lúc (channels.list nhận tối đa 50 id / request)
+    Returns: {channel_id: playlist_id hoặc None}
+    """
+    missing = _channels_to_resolve(channel_ids)
+
+    for i in range(0, len(missing), BATCH_SIZE):
+        chunk = missing[i:i + BATCH_SIZE]
+        res = yt.channels().list(
+            part="contentDetails",
+            id=",".join(chunk),
+            maxResults=BATCH_SIZE
+        ).execute()
+        _store_playlists(chunk, res)
+
+    with _cache_lock:
+        return {c: _playlist_cache.get(c) for c in channel_ids}
+
+
+def get_uploads_playlist_id(yt, channel_id: str):
+    """
+    Resolve channel -> playlist "UU..." chứa toàn bộ video upload (1 quota, chỉ 1 lần / channel)
+    """
+    return resolve_uploads_playlists(yt, [channel_id]).get(channel_id)
+
+
+def _parse_search_response(res):
+    return [
+        {
+            "video_id": item["id"].get("videoId"),
+            "title": item["snippet"]["title"],
+            "published_at": item["snippet"].get("publishedAt")
+        }
+        for item in res.get("items", [])
+        if item["id"].get("videoId")
+    ]
+
+
+def _get_recent_by_search(yt, channel_id: str, count: int = RECENT_COUNT):
     res = yt.search().list(
         part="snippet",
         channelId=channel_id,
         order="date",
-        maxResults=1
+        type="video",
+        maxResults=count
     ).execute()
+    return _parse_search_response(res)
+
 
-    items = res.get("items", [])
-    if not items:
-        return None
+def _playlist_request(yt, playlist_id: str, count: int = RECENT_COUNT):
+    request = yt.playlistItems().list(
+        part="snippet",
+        playlistId=playlist_id,
+        maxResults=count
+    )
+
+    # Conditional request: nếu playlist không đổi, server trả 304 (không có body)
+    cached = _etag_cache.get((playlist_id, count))
+    if cached:
+        request.headers["If-None-Match"] = cached[0]
+    return request
+
+
+def _parse_playlist_items(res):
+    """Returns: list {video_id, title, published_at}, mới nhất trước"""
+    return [
+        {
+            "video_id": item["snippet"]["resourceId"].get("videoId"),
+            "title": item["snippet"]["title"],
+            "published_at": item["snippet"].get("publishedAt")
+        }
+        for item in res.get("items", [])
+        if item["snippet"]["resourceId"].get("videoId")
+    ]
+
+
+def _parse_playlist_response(playlist_id: str, count: int, res):
+    """Như _parse_playlist_items, lưu kèm ETag để lần sau gửi conditional request"""
+    result = _parse_playlist_items(res)
+    if res.get("etag"):
+        _etag_cache[(playlist_id, count)] = (res["etag"], result)
+    return result
+
+
+def _handle_playlist_error(playlist_id: str, count: int, e: HttpError):
+    """304 -> kết quả cũ, 404 (channel chưa có video) -> [], còn lại raise"""
+    cached = _etag_cache.get((playlist_id, count))
+    if e.resp.status == 304 and cached:
+        return cached[1]
+    if e.resp.status == 404:
+        return []
+    raise e
+
+
+def _get_recent_by_playlist(yt, channel_id: str, count: int = RECENT_COUNT):
+    playlist_id = get_uploads_playlist_id(yt, channel_id)
+    if not playlist_id:
+        return []
+
+    try:
+        res = _playlist_request(yt, playlist_id, count).execute()
+    except HttpError as e:
+        return _handle_playlist_error(playlist_id, count, e)
+    return _parse_playlist_response(playlist_id, count, res)
+
+
+def is_quota_exceeded(e: HttpError) -> bool:
+    """403 do key đã hết quota trong ngày (khác với key sai / bị chặn)"""
+    if e.resp.status != 403:
+        return False
+    details = e.error_details if isinstance(e.error_details, list) else []
+    reasons = {d.get("reason") for d in details if isinstance(d, dict)}
+    return bool(reasons & {"quotaExceeded", "dailyLimitExceeded"}) or "quota" in str(e.reason).lower()
 
-    item = items[0]
+
+def _get_discovery_doc():
+    global _discovery_doc
+    with _discovery_lock:
+        if _discovery_doc is None:
+            _discovery_doc = json.loads(discovery_cache.get_static_doc("youtube", "v3"))
+        return _discovery_doc
+
+
+def get_client(api_key: str):
+    """
+    Lấy YouTube client đã build sẵn cho api_key (build lần đầu, các lần sau dùng lại)
+    """
+    clients = getattr(_pool_local, "clients", None)
+    if clients is None:
+        clients = _pool_local.clients = {}
+
+    yt = clients.get(api_key)
+    if yt is None:
+        yt = build_from_document(
+            _get_discovery_doc(),
+            developerKey=api_key,
+            http=httplib2.Http(timeout=HTTP_TIMEOUT)
+        )
+        clients[api_key] = yt
+    return yt
+
+
+def get_call_stats():
+    """
+    Thống kê thời gian gọi API (ms): build client và request thực tế
+    """
+    timings = list(_call_timings)
+    if not timings:
+        return {"calls": 0}
+
+    build_ms = sorted(t[0] * 1000 for t in timings)
+    request_ms = sorted(t[1] * 1000 for t in timings)
+    p95 = min(len(timings) - 1, int(len(timings) * 0.95))
     return {
-        "video_id": item["id"].get("videoId"),
-        "title": item["snippet"]["title"]
+        "calls": len(timings),
+        "build_avg_ms": round(sum(build_ms) / len(build_ms), 2),
+        "build_p95_ms": round(build_ms[p95], 2),
+        "request_avg_ms": round(sum(request_ms) / len(request_ms), 2),
+        "request_p95_ms": round(request_ms[p95], 2),
     }
+
+
+def get_recent_videos(channel_id: str, api_key: str, mode: str = POLL_MODE, count: int = RECENT_COUNT):
+    """
+    Lấy `count` video gần nhất của channel
+    Returns: list {video_id, title, published_at}, mới nhất trước
+    """
+    build_start = time.perf_counter()
+    yt = get_client(api_key)
+    request_start = time.perf_counter()
+
+    try:
+        if mode == "search":
+            return _get_recent_by_search(yt, channel_id, count)
+        return _get_recent_by_playlist(yt, channel_id, count)
+    finally:
+        _call_timings.append((request_start - build_start, time.perf_counter() - request_start))
+
+
+def get_latest_video(channel_id: str, api_key: str, mode: str = POLL_MODE):
+    videos = get_recent_videos(channel_id, api_key, mode, count=1)
+    return videos[0] if videos else None
+
+
+def get_recent_videos_batch(channel_ids, api_key: str, count: int = RECENT_COUNT):
+    """
+    Lấy `count` video gần nhất của nhiều channel, gom tối đa BATCH_SIZE playlistItems.list
+    vào 1 HTTP request (BatchHttpRequest).
+    Returns: {channel_id: list {video_id, title, published_at}, mới nhất trước}
+    Lỗi token (400/401/403) của bất kỳ request con nào sẽ được raise để rotate token.
+    """
+    build_start = time.perf_counter()
+    yt = get_client(api_key)
+    request_start = time.perf_counter()
+
+    results = {}
+    errors = []
+
+    try:
+        playlists = resolve_uploads_playlists(yt, channel_ids)
+
+        def on_response(channel_id, response, exception):
+            playlist_id = playlists[channel_id]
+            if exception is None:
+                results[channel_id] = _parse_playlist_response(playlist_id, count, response)
+                return
+            try:
+                results[channel_id] = _handle_playlist_error(playlist_id, count, exception)
+            except HttpError as e:
+                errors.append(e)
+
+        pending = [c for c in channel_ids if playlists.get(c)]
+        for c in channel_ids:
+            if not playlists.get(c):
+                results[c] = []
+
+        for i in range(0, len(pending), BATCH_SIZE):
+            batch = yt.new_batch_http_request(callback=on_response)
+            for channel_id in pending[i:i + BATCH_SIZE]:
+                batch.add(_playlist_request(yt, playlists[channel_id], count), request_id=channel_id)
+            batch.execute()
+    finally:
+        _call_timings.append((request_start - build_start, time.perf_counter() - request_start))
+
+    for e in errors:
+        if e.resp.status in (400, 401, 403):
+            raise e
+    if errors:
+        print(f"⚠️ Batch có {len(errors)} request lỗi: {errors[0]}")
+    return results
+
+
+# -----------------------
+# Async client (httpx) - không chiếm thread của executor mặc định
+# -----------------------
+API_URL = "https://www.googleapis.com/youtube/v3"
+BATCH_URL = "https://youtube.googleapis.com/batch"
+
+_http_client = None
+
+
+def _get_http_client():
+    """httpx client dùng chung cho mọi channel / API key (keep-alive, pool kết nối)"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+            headers={"User-Agent": "Mozilla/5.0"}
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
+
+
+async def _api_get(resource: str, params: dict, api_key: str, etag: str = None):
+    """
+    GET {API_URL}/{resource}. Lỗi (kể cả 304) được raise thành HttpError giống googleapiclient
+    để watcher phân loại lỗi token / hết quota như cũ.
+    """
+    headers = {"If-None-Match": etag} if etag else {}
+    response = await _get_http_client().get(
+        f"{API_URL}/{resource}",
+        params={**params, "key": api_key},
+        headers=headers
+    )
+    if response.status_code >= 300:
+        resp = httplib2.Response({"status": response.status_code, **response.headers})
+        raise HttpError(resp, response.content, uri=f"{API_URL}/{resource}")
+    return response.json()
+
+
+async def resolve_uploads_playlists_async(channel_ids, api_key: str, charge=None):
+    """
+    Bản async của resolve_uploads_playlists (dùng chung cache)
+    charge: function (token, units) - VD TokenRotator.charge, gọi cho mỗi channels.list đã gửi
+    """
+    missing = _channels_to_resolve(channel_ids)
+
+    for i in range(0, len(missing), BATCH_SIZE):
+        chunk = missing[i:i + BATCH_SIZE]
+        try:
+            res = await _api_get("channels", {
+                "part": "contentDetails",
+                "id": ",".join(chunk),
+                "maxResults": BATCH_SIZE
+            }, api_key)
+        finally:
+            if charge:
+                charge(api_key, QUOTA_COSTS["channels.list"])
+        _store_playlists(chunk, res)
+
+    with _cache_lock:
+        return {c: _playlist_cache.get(c) for c in channel_ids}
+
+
+async def _get_recent_by_playlist_async(channel_id: str, api_key: str, count: int, charge=None):
+    playlists = await resolve_uploads_playlists_async([channel_id], api_key, charge)
+    playlist_id = playlists.get(channel_id)
+    if not playlist_id:
+        return []
+
+    cached = _etag_cache.get((playlist_id, count))
+    try:
+        res = await _api_get("playlistItems", {
+            "part": "snippet",
+            "playlistId": playlist_id,
+            "maxResults": count
+        }, api_key, etag=cached[0] if cached else None)
+    except HttpError as e:
+        return _handle_playlist_error(playlist_id, count, e)
+    return _parse_playlist_response(playlist_id, count, res)
+
+
+async def get_playlist_backlog_async(channel_id: str, api_key: str, known_ids, max_pages: int = BACKLOG_PAGES,
+                                     charge=None):
+    """
+    Đọc playlist uploads theo pageToken (BACKLOG_PAGE_SIZE video / trang) tới khi gặp video trong
+    known_ids hoặc hết max_pages trang. Dùng khi cả RECENT_COUNT video gần nhất đều chưa thấy
+    (channel đăng nhiều video giữa 2 lần poll / runner vừa chạy lại sau downtime).
+    charge: function (token, units) cho channels.list nếu phải resolve playlist
+    Returns: (list video mới nhất trước, số trang đã gọi - mỗi trang 1 quota)
+    """
+    playlists = await resolve_uploads_playlists_async([channel_id], api_key, charge)
+    playlist_id = playlists.get(channel_id)
+    if not playlist_id:
+        return [], 0
+
+    videos = []
+    page_token = None
+    pages = 0
+    while pages < max_pages:
+        params = {"part": "snippet", "playlistId": playlist_id, "maxResults": BACKLOG_PAGE_SIZE}
+        if page_token:
+            params["pageToken"] = page_token
+        res = await _api_get("playlistItems", params, api_key)
+        pages += 1
+        page = _parse_playlist_items(res)
+        videos += page
+        page_token = res.get("nextPageToken")
+        if not page_token or any(v["video_id"] in known_ids for v in page):
+            break
+    return videos, pages
+
+
+async def _get_recent_by_search_async(channel_id: str, api_key: str, count: int):
+    res = await _api_get("search", {
+        "part": "snippet",
+        "channelId": channel_id,
+        "order": "date",
+        "type": "video",
+        "maxResults": count
+    }, api_key)
+    return _parse_search_response(res)
+
+
+async def get_recent_videos_async(channel_id: str, api_key: str, mode: str = POLL_MODE,
+                                  count: int = RECENT_COUNT, charge=None):
+    """
+    Bản async của get_recent_videos, cùng kết quả và cùng loại lỗi (HttpError)
+    charge: function (token, units) cho channels.list nếu phải resolve playlist
+    """
+    request_start = time.perf_counter()
+    try:
+        if mode == "search":
+            return await _get_recent_by_search_async(channel_id, api_key, count)
+        return await _get_recent_by_playlist_async(channel_id, api_key, count, charge)
+    finally:
+        _call_timings.append((0.0, time.perf_counter() - request_start))
+
+
+def _batch_body(calls, api_key: str, boundary: str) -> bytes:
+    """multipart/mixed cho batch endpoint, mỗi part là 1 GET (cùng format googleapiclient gửi)"""
+    prefix = urlparse(API_URL).path
+    parts = []
+    for request_id, (resource, params, etag) in calls.items():
+        lines = [
+            f"--{boundary}",
+            "Content-Type: application/http",
+            f"Content-ID: <{request_id}>",
+            "",
+            f"GET {prefix}/{resource}?{urlencode({**params, 'key': api_key})} HTTP/1.1",
+        ]
+        if etag:
+            lines.append(f"If-None-Match: {etag}")
+        parts.append("\r\n".join(lines) + "\r\n\r\n")
+    return ("".join(parts) + f"--{boundary}--\r\n").encode()
+
+
+def _parse_batch_response(content_type: str, content: bytes):
+    """Returns: {request_id: (status, body bytes)}"""
+    message = BytesParser().parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + content)
+    results = {}
+    for part in message.get_payload():
+        request_id = part.get("Content-ID", "").strip("<>")
+        if request_id.startswith("response-"):
+            request_id = request_id[len("response-"):]
+        payload = part.get_payload(decode=True) or b""
+        status_line, _, rest = payload.partition(b"\n")
+        # Bỏ header của response con, chỉ lấy body
+        body = rest.split(b"\r\n\r\n", 1)[-1] if b"\r\n\r\n" in rest else rest.split(b"\n\n", 1)[-1]
+        results[request_id] = (int(status_line.split()[1]), body)
+    return results
+
+
+async def _api_batch(calls, api_key: str):
+    """
+    Gửi nhiều GET trong 1 HTTP round trip (batch endpoint của Google API)
+    calls: {request_id: (resource, params, etag)}
+    Returns: {request_id: body dict hoặc HttpError}
+    """
+    boundary = uuid.uuid4().hex
+    response = await _get_http_client().post(
+        BATCH_URL,
+        content=_batch_body(calls, api_key, boundary),
+        headers={"Content-Type": f"multipart/mixed; boundary={boundary}"}
+    )
+    if response.status_code >= 300:
+        resp = httplib2.Response({"status": response.status_code, **response.headers})
+        raise HttpError(resp, response.content, uri=BATCH_URL)
+
+    results = {}
+    for request_id, (status, body) in _parse_batch_response(
+            response.headers.get("content-type", ""), response.content).items():
+        if status >= 300:
+            uri = f"{API_URL}/{calls[request_id][0]}" if request_id in calls else BATCH_URL
+            results[request_id] = HttpError(httplib2.Response({"status": status}), body, uri=uri)
+        else:
+            results[request_id] = json.loads(body)
+    return results
+
+
+async def get_recent_videos_batch_async(channel_ids, api_key: str, count: int = RECENT_COUNT, charge=None):
+    """
+    Bản async của get_recent_videos_batch: tối đa BATCH_SIZE playlistItems.list / HTTP request,
+    đi qua httpx client dùng chung (không chiếm thread của executor mặc định).
+    Lỗi token (400/401/403) của bất kỳ request con nào sẽ được raise để rotate token.
+    charge: function (token, units) cho các channels.list khi resolve playlist
+    """
+    request_start = time.perf_counter()
+    results = {}
+    errors = []
+
+    try:
+        playlists = await resolve_uploads_playlists_async(channel_ids, api_key, charge)
+        pending = [c for c in channel_ids if playlists.get(c)]
+        for c in channel_ids:
+            if not playlists.get(c):
+                results[c] = []
+
+        for i in range(0, len(pending), BATCH_SIZE):
+            calls = {}
+            for channel_id in pending[i:i + BATCH_SIZE]:
+                cached = _etag_cache.get((playlists[channel_id], count))
+                calls[channel_id] = ("playlistItems", {
+                    "part": "snippet",
+                    "playlistId": playlists[channel_id],
+                    "maxResults": count
+                }, cached[0] if cached else None)
+
+            for channel_id, res in (await _api_batch(calls, api_key)).items():
+                if channel_id not in calls:
+                    continue
+                playlist_id = playlists[channel_id]
+                if not isinstance(res, HttpError):
+                    results[channel_id] = _parse_playlist_response(playlist_id, count, res)
+                    continue
+                try:
+                    results[channel_id] = _handle_playlist_error(playlist_id, count, res)
+                except HttpError as e:
+                    errors.append(e)
+    finally:
+        _call_timings.append((0.0, time.perf_counter() - request_start))
+
+    for e in errors:
+        if e.resp.status in (400, 401, 403):
+            raise e
+    if errors:
+        print(f"⚠️ Batch có {len(errors)} request lỗi: {errors[0]}")
+    return results
+
+
+# -----------------------
+# RSS feed (không tốn quota)
+# -----------------------
+RSS_URL = "https://www.youtube.com/feeds/videos.xml"
+ATOM = "{http://www.w3.org/2005/Atom}"
+YT = "{http://www.youtube.com/xml/schemas/2015}"
+
+_rss_cache = {}  # {channel_id: (etag, last_modified, `count` entry đầu của feed)}
+
+
+async def get_recent_videos_rss(channel_id: str, count: int = RECENT_COUNT, known_ids=None):
+    """
+    Lấy các video gần nhất qua RSS feed của channel (mới nhất trước).
+    Dùng conditional GET (ETag / Last-Modified): 304 -> trả `count` entry đầu đã cache.
+    Parse XML dạng stream, dừng khi đủ `count` entry hoặc gặp video đã biết (known_ids):
+    khi đó chỉ trả các video mới hơn, phần sau của feed lấy từ bản cache trước để cache vẫn đủ.
+    """
+    headers = {}
+    cached = _rss_cache.get(channel_id)
+    if cached:
+        if cached[0]:
+            headers["If-None-Match"] = cached[0]
+        if cached[1]:
+            headers["If-Modified-Since"] = cached[1]
+
+    client = _get_http_client()
+    async with client.stream("GET", RSS_URL, params={"channel_id": channel_id}, headers=headers) as response:
+        if response.status_code == 304 and cached:
+            return cached[2]
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+
+        known_ids = known_ids or ()
+        parser = ET.XMLPullParser(events=("end",))
+        result = []
+        stopped_at = None  # video đã biết khiến dừng parse sớm
+        async for chunk in response.aiter_bytes():
+            parser.feed(chunk)
+            for _, elem in parser.read_events():
+                if elem.tag != f"{ATOM}entry":
+                    continue
+                video_id = elem.findtext(f"{YT}videoId")
+                if video_id in known_ids:
+                    stopped_at = video_id
+                    break
+                result.append({
+                    "video_id": video_id,
+                    "title": elem.findtext(f"{ATOM}title", default=""),
+                    "published_at": elem.findtext(f"{ATOM}published")
+                })
+                if len(result) >= count:
+                    break
+            # Đủ entry: thoát luôn, ra khỏi `async with` là đóng response (feed nhỏ, không cần đọc nốt)
+            if stopped_at or len(result) >= count:
+                break
+
+        entries = result
+        if stopped_at:
+            # Feed mới nhất trước: phần từ video đã biết trở đi giống bản cache trước
+            previous = [e["video_id"] for e in cached[2]] if cached else []
+            entries = (result + cached[2][previous.index(stopped_at):])[:count] if stopped_at in previous else None
+        if entries is None:
+            # Không dựng lại được đủ `count` entry -> không cache, 304 sau này không trả danh sách thiếu
+            _rss_cache.pop(channel_id, None)
+        else:
+            _rss_cache[channel_id] = (
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                entries
+            )
+        return result